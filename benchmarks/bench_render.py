@@ -0,0 +1,221 @@
+"""
+Rendering benchmark for create_docx, generate_html_sheet and generate_label_body_v2.
+
+Builds synthetic queues (10 to 50,000 labels) with a realistic mix of
+data_v2 / rich / text items and records wall time, peak memory and output
+size per case. The docx_open target times re-opening the generated file
+(a proxy for Word's open time) and reports the uncompressed document.xml size. Results are compared against a stored baseline:
+
+    python benchmarks/bench_render.py                       # compare with baseline
+    python benchmarks/bench_render.py --sizes 10 1000 --update-baseline
+    python benchmarks/bench_render.py --mix data --quantity batch --columns 8 13 20
+
+Exits with status 1 when a case is slower / larger than the baseline by more
+than --tolerance, so it can gate a release, and with status 2 when a case has
+no baseline entry (benchmarks/results/render_baseline.json is committed for
+the default cases).
+"""
+import argparse
+import datetime
+import gc
+import io
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+import zipfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(HERE)
+BASELINE_PATH = os.path.join(HERE, "results", "render_baseline.json")
+
+sys.path.insert(0, REPO_ROOT)
+from docx import Document  # noqa: E402
+from label_render import create_docx, generate_html_sheet, generate_label_body_v2  # noqa: E402
+
+# (data_v2, rich, text) proportions
+MIXES = {
+    'mixed': (0.7, 0.2, 0.1),
+    'data': (1.0, 0.0, 0.0),
+    'id': (0.0, 1.0, 0.0),
+}
+LOCALITIES = [
+    "Mt. Takao", "Kamikochi, Azusa River", "Yakushima Is., Shiratani-unsuikyo",
+    "Iriomote Is., Urauchi River, 2 km upstream from mouth", "Sapporo", "Shimanto-cho, Taisho",
+]
+COLORS = ["#FFFFFF", "#FFFF00", "#FFA500", "#FF0000", "#008000"]
+
+
+def make_item(rnd, kind, quantity):
+    if kind == 'data_v2':
+        lat, lon = rnd.uniform(24.0, 45.0), rnd.uniform(123.0, 146.0)
+        date = datetime.date(2024, rnd.randint(1, 12), rnd.randint(1, 28))
+        body = generate_label_body_v2(
+            rnd.choice(LOCALITIES), rnd.randint(0, 3000), lat, lon, date,
+            "M. Tsuchioka", rnd.choice(["", "Light trap", "Sweeping", "Malaise trap"]),
+        )
+        return {
+            'type': 'data_v2', 'header': "JAPAN: Tokyo,", 'body': body,
+            'color': rnd.choice(COLORS), 'quantity': quantity, 'lat': lat, 'lon': lon,
+            'preview': body[:40],
+        }
+    if kind == 'rich':
+        return {
+            'type': 'rich',
+            'content': [("Carabidae\n", False), ("Carabus ", True), ("insulicola ", True),
+                        ("Chaudoir, 1869\n", False), ("det. M. Tsuchioka 2024", False)],
+            'quantity': quantity, 'preview': "[ID] Carabus insulicola",
+        }
+    sample = f"DNA-{rnd.randint(1, 99999):05d}"
+    return {'type': 'text', 'content': f"{sample}\nDNA extracted", 'quantity': quantity, 'preview': f"[DNA] {sample}"}
+
+
+def make_queue(n_labels, mix='mixed', quantity='single', seed=0):
+    """Returns a queue whose quantities sum to exactly n_labels."""
+    rnd = random.Random(seed)
+    weights = MIXES[mix]
+    queue, remaining = [], n_labels
+    while remaining > 0:
+        if quantity == 'single':
+            q = 1
+        else:
+            # Mostly singles with occasional series of duplicates (e.g. a long trap sample)
+            q = rnd.choices([1, 2, 5, 10, 20], weights=[60, 20, 10, 7, 3])[0]
+        q = min(q, remaining)
+        kind = rnd.choices(['data_v2', 'rich', 'text'], weights=weights)[0]
+        queue.append(make_item(rnd, kind, q))
+        remaining -= q
+    return queue
+
+
+def render_docx(queue, columns):
+    buf = create_docx(queue, font_size=4.0, show_borders=True, num_columns=columns, font_name='Arial', char_spacing=-0.5)
+    return buf.getbuffer().nbytes
+
+
+_built_docx = {}
+
+
+def open_docx(queue, columns):
+    # Build once per case; only the re-open is timed
+    key = (id(queue), columns)
+    if key not in _built_docx:
+        _built_docx.clear()
+        _built_docx[key] = create_docx(queue, font_size=4.0, show_borders=True, num_columns=columns, font_name='Arial', char_spacing=-0.5).getvalue()
+    data = _built_docx[key]
+    Document(io.BytesIO(data))
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        return zf.getinfo('word/document.xml').file_size
+
+
+def render_html(queue, columns):
+    return len(generate_html_sheet(queue, columns, 'Arial', 4.0, '#FFFFFF').encode('utf-8'))
+
+
+def render_bodies(queue, columns):
+    rnd = random.Random(1)
+    date = datetime.date(2024, 5, 17)
+    n = sum(item['quantity'] for item in queue)
+    size = 0
+    for _ in range(n):
+        size += len(generate_label_body_v2("Mt. Takao", 599, rnd.uniform(24, 45), rnd.uniform(123, 146), date, "M. Tsuchioka", "Light trap"))
+    return size
+
+
+TARGETS = {'docx': render_docx, 'docx_open': open_docx, 'html': render_html, 'body': render_bodies}
+
+
+def measure(func, queue, columns, repeat):
+    """Best-of-N wall time, then one traced run for peak memory."""
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        size = func(queue, columns)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    gc.collect()
+    tracemalloc.start()
+    func(queue, columns)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': round(best, 4), 'peak_mb': round(peak / 2**20, 2), 'output_bytes': size}
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for key, metrics in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        for metric in ('seconds', 'peak_mb', 'output_bytes'):
+            # Ignore noise on tiny timings
+            if metric == 'seconds' and base[metric] < 0.05:
+                continue
+            if base[metric] and metrics[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f"{key} {metric}: {base[metric]} -> {metrics[metric]}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ラベル描画 (DOCX / HTML / 本文生成) のベンチマーク。')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000, 50000], help='ラベル数。')
+    parser.add_argument('--targets', nargs='+', choices=list(TARGETS), default=['docx', 'html', 'body'])
+    parser.add_argument('--mix', nargs='+', choices=list(MIXES), default=['mixed'])
+    parser.add_argument('--quantity', nargs='+', choices=['single', 'batch'], default=['single'])
+    parser.add_argument('--columns', type=int, nargs='+', default=[13])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--tolerance', type=float, default=0.2, help='回帰とみなす増加率 (デフォルト: 0.2 = 20%%)。')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true', help='今回の結果でベースラインを更新します。')
+    args = parser.parse_args()
+
+    results = {}
+    for size in args.sizes:
+        for mix in args.mix:
+            for quantity in args.quantity:
+                queue = make_queue(size, mix, quantity)
+                for columns in args.columns:
+                    for target in args.targets:
+                        key = f"{target}/n={size}/mix={mix}/qty={quantity}/cols={columns}"
+                        # Large DOCX cases are slow; don't repeat them
+                        repeat = 1 if target.startswith('docx') and size >= 10000 else args.repeat
+                        metrics = measure(TARGETS[target], queue, columns, repeat)
+                        metrics['items'] = len(queue)
+                        results[key] = metrics
+                        print(f"{key:<48} {metrics['seconds']:>9.3f}s {metrics['peak_mb']:>9.1f}MB {metrics['output_bytes']:>12,d}B")
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f).get('cases', {})
+
+    if args.update_baseline:
+        baseline.update(results)
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({'updated': datetime.datetime.now().isoformat(timespec='seconds'), 'cases': baseline}, f, indent=1)
+        print(f"ベースラインを更新しました: {args.baseline}")
+        return
+
+    # Without a baseline nothing can be flagged; that must not pass as "no regressions"
+    missing = [key for key in results if key not in baseline]
+    if missing:
+        print(f"\nベースラインがないケースがあります ({args.baseline}、--update-baseline で作成):")
+        for key in missing:
+            print(f"  {key}")
+        sys.exit(2)
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("\n回帰を検出しました:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print("\nベースラインからの回帰はありません。")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+End-to-end enrichment throughput benchmark (rows/sec) against the local mock server.
+
+    python benchmarks/bench_throughput.py --rows 2000 --latency 40 --error-rate 0.01
+    python benchmarks/bench_throughput.py --target tk --rows 500 --save
+
+`--target cli` runs label_app.py as a subprocess (what users run from the
+terminal); `--target tk` drives LabelApp.process_data from generate_data_sheet.py
+with a hidden Tk root. `--save` appends the result to
+benchmarks/results/throughput.jsonl so numbers can be compared between releases.
+"""
+import argparse
+import csv
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(HERE)
+RESULTS_PATH = os.path.join(HERE, "results", "throughput.jsonl")
+
+sys.path.insert(0, HERE)
+from mock_maps_server import MockMapsServer, load_fixtures  # noqa: E402
+
+
+def write_input_csv(path, rows, duplicate_ratio, seed):
+    """Writes a synthetic field sheet with coordinates scattered over Japan."""
+    rnd = random.Random(seed)
+    sites = []
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['latitude', 'longitude', '採集年月日', '採集方法', '採集者名'])
+        for i in range(rows):
+            if sites and rnd.random() < duplicate_ratio:
+                lat, lon = rnd.choice(sites)
+            else:
+                lat, lon = round(rnd.uniform(26.0, 45.0), 6), round(rnd.uniform(127.0, 145.0), 6)
+                sites.append((lat, lon))
+            writer.writerow([lat, lon, f"{rnd.randint(1, 28)}.{rnd.randint(1, 12)}.2024", 'Light trap', 'M. Tsuchioka'])
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_cli(input_path, output_path, env, extra_args):
+    cmd = [sys.executable, os.path.join(REPO_ROOT, 'label_app.py'), 'mock-key', input_path, output_path] + extra_args
+    subprocess.run(cmd, env=env, check=True, stdout=subprocess.DEVNULL)
+
+
+def run_tk(input_path, env):
+    os.environ.update(env)  # Endpoints are read at import time
+    sys.path.insert(0, REPO_ROOT)
+    import tkinter as tk
+    from generate_data_sheet import LabelApp, FileJob
+    from geocoding_core import Geocoder, GoogleMapsProvider
+
+    root = tk.Tk()
+    root.withdraw()
+    app = LabelApp(root)
+    col_map = {k: v.get() for k, v in app.col_entries.items()}
+    # start_process normally builds the per-run geocoder; mirror it here
+    app.geocoder = Geocoder(GoogleMapsProvider('mock-key'), rate_limiter=app.rate_limiter, metrics=app.metrics)
+    job = FileJob(input_path)
+    try:
+        app.process_data(job, 'mock-key', col_map)
+    finally:
+        app.executor.shutdown(wait=False)
+        root.destroy()
+    if job.state != '完了':
+        raise RuntimeError(f"LabelApp.process_data failed: {job.state}")
+    return job.output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='模擬サーバーを使ったエンリッチ処理のスループット計測 (行/秒)。')
+    parser.add_argument('--target', choices=['cli', 'tk'], default='cli')
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--duplicate-ratio', type=float, default=0.3, help='既出の座標を再利用する行の割合。')
+    parser.add_argument('--latency', type=float, default=40.0, help='模擬サーバーの遅延 (ms)。')
+    parser.add_argument('--jitter', type=float, default=10.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--qps', type=float, default=None)
+    parser.add_argument('--replay', help='記録済みレスポンスを再生します。')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', action='store_true', help=f'結果を {os.path.relpath(RESULTS_PATH, REPO_ROOT)} に追記します。')
+    args, extra_args = parser.parse_known_args()
+
+    fixtures = load_fixtures(args.replay) if args.replay else None
+    with tempfile.TemporaryDirectory() as tmp, MockMapsServer(
+        latency_ms=args.latency, jitter_ms=args.jitter, error_rate=args.error_rate,
+        qps=args.qps, fixtures=fixtures, seed=args.seed,
+    ) as server:
+        input_path = os.path.join(tmp, 'input.csv')
+        write_input_csv(input_path, args.rows, args.duplicate_ratio, args.seed)
+        env = dict(os.environ, **server.endpoints)
+
+        start = time.perf_counter()
+        if args.target == 'cli':
+            run_cli(input_path, os.path.join(tmp, 'output.csv'), env, extra_args)
+        else:
+            run_tk(input_path, env)
+        elapsed = time.perf_counter() - start
+        stats = dict(server.stats)
+
+    result = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'target': args.target,
+        'rows': args.rows,
+        'duplicate_ratio': args.duplicate_ratio,
+        'latency_ms': args.latency,
+        'error_rate': args.error_rate,
+        'qps': args.qps,
+        'extra_args': extra_args,
+        'seconds': round(elapsed, 3),
+        'rows_per_sec': round(args.rows / elapsed, 2),
+        'server': stats,
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+    if args.save:
+        os.makedirs(os.path.dirname(RESULTS_PATH), exist_ok=True)
+        with open(RESULTS_PATH, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,308 @@
+"""
+Local stand-in for the Google Geocoding and Elevation JSON endpoints.
+
+Used for throughput benchmarks and offline development. Point any entry point
+at it through the endpoint environment variables, e.g.:
+
+    python benchmarks/mock_maps_server.py --port 8765 --latency 40 --error-rate 0.01
+    export GEOCODING_API_ENDPOINT=http://127.0.0.1:8765/maps/api/geocode/json
+    export ELEVATION_API_ENDPOINT=http://127.0.0.1:8765/maps/api/elevation/json
+
+Responses are synthesized deterministically from the coordinates, or replayed
+from a fixtures file recorded against the real API (--record / --replay).
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+GOOGLE_BASE = "https://maps.googleapis.com"
+GEOCODE_PATH = "/maps/api/geocode/json"
+ELEVATION_PATH = "/maps/api/elevation/json"
+
+# (ja prefecture, en prefecture, ja city, en city, ja district, en district)
+SYNTHETIC_PLACES = [
+    ('東京都', 'Tokyo', '八王子市', 'Hachioji', '高尾町', 'Takaomachi'),
+    ('北海道', 'Hokkaido', '札幌市', 'Sapporo', '南区', 'Minami Ward'),
+    ('長野県', 'Nagano', '松本市', 'Matsumoto', '安曇', 'Azumi'),
+    ('高知県', 'Kochi', '四万十町', 'Shimanto', '大正', 'Taisho'),
+    ('鹿児島県', 'Kagoshima', '屋久島町', 'Yakushima', '宮之浦', 'Miyanoura'),
+    ('沖縄県', 'Okinawa', '国頭村', 'Kunigami', '奥', 'Oku'),
+]
+
+
+def _coord_key(value):
+    """Normalizes a 'lat,lon' query value so recorded fixtures match regardless of formatting."""
+    try:
+        lat, lon = (float(x) for x in value.split(','))
+    except ValueError:
+        return value
+    return f"{lat:.6f},{lon:.6f}"
+
+
+def synthetic_geocode(latlng, language):
+    key = _coord_key(latlng)
+    digest = int(hashlib.md5(key.encode('utf-8')).hexdigest()[:8], 16)
+    pref_ja, pref_en, city_ja, city_en, dist_ja, dist_en = SYNTHETIC_PLACES[digest % len(SYNTHETIC_PLACES)]
+    if language == 'ja':
+        country = ('日本', 'JP')
+        pref, city, dist = pref_ja, city_ja, dist_ja
+        formatted = f"日本、〒{digest % 900 + 100}-{digest % 10000:04d} {pref}{city}{dist}{digest % 50 + 1}"
+    else:
+        country = ('Japan', 'JP')
+        pref, city, dist = pref_en, city_en, dist_en
+        formatted = f"{digest % 50 + 1} {dist}, {city}, {pref} {digest % 900 + 100}-{digest % 10000:04d}, Japan"
+    components = [
+        {'long_name': dist, 'short_name': dist, 'types': ['political', 'sublocality', 'sublocality_level_1']},
+        {'long_name': city, 'short_name': city, 'types': ['locality', 'political']},
+        {'long_name': pref, 'short_name': pref, 'types': ['administrative_area_level_1', 'political']},
+        {'long_name': country[0], 'short_name': country[1], 'types': ['country', 'political']},
+    ]
+    return {
+        'status': 'OK',
+        'results': [{
+            'formatted_address': formatted,
+            'address_components': components,
+            'types': ['political', 'sublocality', 'sublocality_level_1'],
+        }],
+    }
+
+
+def synthetic_elevation(locations):
+    key = _coord_key(locations)
+    digest = int(hashlib.md5(key.encode('utf-8')).hexdigest()[:8], 16)
+    return {'status': 'OK', 'results': [{'elevation': (digest % 300000) / 100.0, 'resolution': 9.5}]}
+
+
+class MockMapsServer:
+    """
+    Threaded HTTP server emulating the two Maps endpoints.
+
+    latency_ms / jitter_ms: added delay per request.
+    error_rate: fraction of requests answered with HTTP 500.
+    qps: requests per second accepted before answering OVER_QUERY_LIMIT (None = unlimited).
+    daily_quota: total requests accepted before every call returns OVER_QUERY_LIMIT.
+    fixtures: dict {'geocode': {...}, 'elevation': {...}} of recorded responses keyed by coordinates.
+    record_key: if set, unknown coordinates are fetched from Google with this key and stored in fixtures.
+    """
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0,
+                 qps=None, daily_quota=None, fixtures=None, record_key=None, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.qps = qps
+        self.daily_quota = daily_quota
+        self.fixtures = fixtures if fixtures is not None else {'geocode': {}, 'elevation': {}}
+        self.record_key = record_key
+        self.stats = {'requests': 0, 'errors': 0, 'over_query_limit': 0, 'replayed': 0, 'recorded': 0}
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._thread = None
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server._handle(self)
+
+            def log_message(self, format, *args):
+                pass  # Keep benchmark output clean
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def endpoints(self):
+        """Environment overrides that point the apps at this server."""
+        return {
+            'GEOCODING_API_ENDPOINT': self.base_url + GEOCODE_PATH,
+            'ELEVATION_API_ENDPOINT': self.base_url + ELEVATION_PATH,
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # --- Request handling ---
+
+    def _admit(self):
+        """Applies error injection and quota rules. Returns (http_status, body) or None to serve normally."""
+        with self._lock:
+            self.stats['requests'] += 1
+            if self.daily_quota is not None and self.stats['requests'] > self.daily_quota:
+                self.stats['over_query_limit'] += 1
+                return 200, {'status': 'OVER_QUERY_LIMIT', 'error_message': 'Daily quota exceeded (mock).', 'results': []}
+            if self.qps:
+                now = time.monotonic()
+                if now - self._window_start >= 1.0:
+                    self._window_start, self._window_count = now, 0
+                self._window_count += 1
+                if self._window_count > self.qps:
+                    self.stats['over_query_limit'] += 1
+                    return 200, {'status': 'OVER_QUERY_LIMIT', 'error_message': 'Rate limit exceeded (mock).', 'results': []}
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.stats['errors'] += 1
+                return 500, {'status': 'UNKNOWN_ERROR', 'results': []}
+            delay = self.latency_ms + (self._random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        return None
+
+    def _lookup(self, kind, params):
+        if kind == 'geocode':
+            key = _coord_key(params.get('latlng', ''))
+            return self._lookup_one(kind, key, f"{key}|{params.get('language', '')}", params)
+
+        # Elevation accepts pipe-separated locations; each one is replayed/recorded on its own
+        results = []
+        for location in params.get('locations', '').split('|'):
+            key = _coord_key(location)
+            body = self._lookup_one(kind, key, key, {'locations': location})
+            if body.get('status') != 'OK':
+                return body
+            results.extend(body['results'])
+        return {'status': 'OK', 'results': results}
+
+    def _lookup_one(self, kind, key, fixture_key, params):
+        recorded = self.fixtures.setdefault(kind, {}).get(fixture_key)
+        if recorded is not None:
+            with self._lock:
+                self.stats['replayed'] += 1
+            return recorded
+
+        if self.record_key:
+            path = GEOCODE_PATH if kind == 'geocode' else ELEVATION_PATH
+            upstream = dict(params, key=self.record_key)
+            url = f"{GOOGLE_BASE}{path}?{urllib.parse.urlencode(upstream)}"
+            with urllib.request.urlopen(url, timeout=10) as resp:
+                body = json.load(resp)
+            if body.get('status') in ('OK', 'ZERO_RESULTS'):
+                with self._lock:
+                    self.fixtures[kind][fixture_key] = body
+                    self.stats['recorded'] += 1
+            return body
+
+        if kind == 'geocode':
+            return synthetic_geocode(key, params.get('language', 'en'))
+        return synthetic_elevation(key)
+
+    def _handle(self, handler):
+        parsed = urllib.parse.urlparse(handler.path)
+        params = {k: v[0] for k, v in urllib.parse.parse_qs(parsed.query).items()}
+        if parsed.path == GEOCODE_PATH:
+            kind = 'geocode'
+        elif parsed.path == ELEVATION_PATH:
+            kind = 'elevation'
+        else:
+            self._send(handler, 404, {'status': 'NOT_FOUND'})
+            return
+        if not params.get('key'):
+            self._send(handler, 200, {'status': 'REQUEST_DENIED', 'error_message': 'The provided API key is invalid.', 'results': []})
+            return
+
+        rejected = self._admit()
+        if rejected:
+            self._send(handler, *rejected)
+            return
+        try:
+            body = self._lookup(kind, params)
+        except Exception as e:
+            self._send(handler, 502, {'status': 'UNKNOWN_ERROR', 'error_message': f"Upstream error: {e}"})
+            return
+        self._send(handler, 200, body)
+
+    @staticmethod
+    def _send(handler, code, body):
+        payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        handler.send_response(code)
+        handler.send_header('Content-Type', 'application/json; charset=UTF-8')
+        handler.send_header('Content-Length', str(len(payload)))
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+
+def load_fixtures(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    data.setdefault('geocode', {})
+    data.setdefault('elevation', {})
+    return data
+
+
+def save_fixtures(fixtures, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(fixtures, f, ensure_ascii=False, indent=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Google Maps Geocoding / Elevation API のローカル模擬サーバー。')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='1リクエストあたりの遅延 (ms)。')
+    parser.add_argument('--jitter', type=float, default=0.0, help='遅延のばらつき (±ms)。')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='HTTP 500 を返す割合 (0〜1)。')
+    parser.add_argument('--qps', type=float, default=None, help='1秒あたりの受付上限。超過分は OVER_QUERY_LIMIT。')
+    parser.add_argument('--daily-quota', type=int, default=None, help='総リクエスト数の上限。超過後はすべて OVER_QUERY_LIMIT。')
+    parser.add_argument('--replay', help='記録済みレスポンス (JSON) を再生します。')
+    parser.add_argument('--record', help='未記録の座標を実APIから取得し、このファイルに保存します。')
+    parser.add_argument('--upstream-key', help='--record 時に使用する Google Maps APIキー。')
+    parser.add_argument('--seed', type=int, default=0, help='エラー注入用の乱数シード。')
+    args = parser.parse_args()
+
+    if args.record and not args.upstream_key:
+        parser.error('--record には --upstream-key が必要です。')
+
+    fixtures = None
+    if args.replay:
+        fixtures = load_fixtures(args.replay)
+    elif args.record:
+        try:
+            fixtures = load_fixtures(args.record)
+        except FileNotFoundError:
+            fixtures = None
+
+    server = MockMapsServer(
+        host=args.host, port=args.port, latency_ms=args.latency, jitter_ms=args.jitter,
+        error_rate=args.error_rate, qps=args.qps, daily_quota=args.daily_quota,
+        fixtures=fixtures, record_key=args.upstream_key if args.record else None, seed=args.seed,
+    )
+    print(f"模擬サーバー起動: {server.base_url}")
+    for name, url in server.endpoints.items():
+        print(f"  export {name}={url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        if args.record:
+            save_fixtures(server.fixtures, args.record)
+            print(f"{server.stats['recorded']} 件のレスポンスを '{args.record}' に保存しました。")
+        print(f"統計: {server.stats}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+Coordinate parsing for whole columns and multi-line pastes.
+
+Accepts decimal degrees, degrees-minutes (DM) and degrees-minutes-seconds
+(DMS), with a sign or an N/S/E/W hemisphere letter before or after the
+number, e.g. "35.6586", "-12.5", "35°39.5'N", "N 35 39 31", "139°44'43.4\"E".
+
+Work is done per column rather than per value: plain numbers go through
+pd.to_numeric, everything else through one vectorised regex extract. Each row
+gets an error message (None when valid) and a swapped flag when latitude and
+longitude were evidently given the wrong way round (hemisphere letters, or a
+|latitude| above 90 with a longitude that fits); swapped rows are returned
+corrected.
+"""
+import numpy as np
+import pandas as pd
+
+MISSING = 'missing'
+
+# Typographic variants -> the ASCII forms the regex expects
+_NORMALIZE = {'º': '°', '˚': '°', '′': "'", '’': "'", '‘': "'", '´': "'", '″': '"', '”': '"', '“': '"', "''": '"', '−': '-', '–': '-'}
+
+# One value: [hemisphere] [sign] degrees [°] [minutes [']] [seconds ["]] [hemisphere]
+VALUE_RE = (
+    r'^(?P<h1>[NSEW])?\s*(?P<sign>[-+])?\s*'
+    r'(?P<deg>\d+(?:\.\d+)?)\s*°?\s*'
+    r'(?:(?P<min>\d+(?:\.\d+)?)\s*\'?\s*)?'
+    r'(?:(?P<sec>\d+(?:\.\d+)?)\s*"?\s*)?'
+    r'(?P<h2>[NSEW])?$'
+)
+
+# Ways a pasted line can hold a pair, tried in order
+PAIR_RES = (
+    r'^(?P<a>[^,;\t]+?)\s*[,;\t]\s*(?P<b>[^,;\t]+?)$',  # Explicit separator
+    r'^(?P<a>.*?[NS])\s*(?P<b>[^NS]*[EW])$',             # Hemisphere suffixes: 35 39 N 139 44 E
+    r'^(?P<a>.*?[EW])\s*(?P<b>[^EW]*[NS])$',             # ... given longitude first
+    r'^(?P<a>[NSEW][^NSEW]*?)\s*(?P<b>[NSEW][^NSEW]*)$', # Hemisphere prefixes: N35.6 E139.7
+    r'^(?P<a>\S+)\s+(?P<b>\S+)$',                        # Two plain numbers
+)
+
+def _normalize(text):
+    text = text.str.strip().str.upper()
+    for src, dst in _NORMALIZE.items():
+        text = text.str.replace(src, dst, regex=False)
+    return text
+
+def parse_axis(values):
+    """
+    Parses one column of coordinate values without range checks.
+    Returns a DataFrame (value, hemisphere, error) on a fresh RangeIndex.
+    """
+    s = pd.Series(values, dtype=object).reset_index(drop=True)
+    text = _normalize(s.astype(str).where(s.notna(), ''))
+    value = pd.to_numeric(s, errors='coerce').astype(float)
+    hemisphere = pd.Series(None, index=s.index, dtype=object)
+    error = pd.Series(None, index=s.index, dtype=object)
+    error[text.isin(('', 'NAN', 'NONE'))] = MISSING
+
+    todo = value.isna() & error.isna()
+    if todo.any():
+        m = text[todo].str.extract(VALUE_RE)
+        deg = pd.to_numeric(m['deg'])
+        minutes = pd.to_numeric(m['min']).fillna(0.0)
+        seconds = pd.to_numeric(m['sec']).fillna(0.0)
+        hemi = m['h1'].fillna(m['h2'])
+        parsed = deg + minutes / 60.0 + seconds / 3600.0
+        parsed = parsed.where(~((m['sign'] == '-') | hemi.isin(('S', 'W'))), -parsed)
+
+        problems = pd.Series(None, index=m.index, dtype=object)
+        problems[(minutes >= 60) | (seconds >= 60)] = 'minutes/seconds must be below 60'
+        problems[(m['min'].notna() & m['deg'].str.contains('.', regex=False))
+                 | (m['sec'].notna() & m['min'].fillna('').str.contains('.', regex=False))] = 'fraction before minutes/seconds'
+        problems[m['sign'].notna() & hemi.notna()] = 'both sign and hemisphere given'
+        problems[m['h1'].notna() & m['h2'].notna()] = 'two hemisphere letters'
+        problems[deg.isna()] = 'unrecognised format'
+
+        value[todo] = parsed.where(problems.isna())
+        hemisphere[todo] = hemi
+        error[todo] = problems
+    return pd.DataFrame({'value': value, 'hemisphere': hemisphere, 'error': error})
+
+def parse_coordinate_columns(lats, lons):
+    """
+    Parses latitude and longitude columns together.
+    Returns a DataFrame (lat, lon, error, swapped) on a fresh RangeIndex;
+    lat/lon are NaN wherever error is set (error == MISSING for empty input).
+    """
+    a, b = parse_axis(lats), parse_axis(lons)
+    ha, hb = a['hemisphere'], b['hemisphere']
+    by_hemisphere = ha.isin(('E', 'W')) & hb.isin(('N', 'S'))
+    by_range = ha.isna() & hb.isna() & (a['value'].abs() > 90) & (b['value'].abs() <= 90)
+    swapped = by_hemisphere | by_range
+
+    lat = b['value'].where(swapped, a['value'])
+    lon = a['value'].where(swapped, b['value'])
+    lat_h = hb.where(swapped, ha)
+    lon_h = ha.where(swapped, hb)
+
+    error = a['error'].where(a['error'].notna(), b['error'])
+    error = error.where(error.notna() | ~lat_h.isin(('E', 'W')), 'E/W hemisphere on latitude')
+    error = error.where(error.notna() | ~lon_h.isin(('N', 'S')), 'N/S hemisphere on longitude')
+    error = error.where(error.notna() | ~(lat.abs() > 90), 'latitude out of range')
+    error = error.where(error.notna() | ~(lon.abs() > 180), 'longitude out of range')
+
+    bad = error.notna()
+    return pd.DataFrame({
+        'lat': lat.where(~bad),
+        'lon': lon.where(~bad),
+        'error': error.astype(object).where(bad, None),
+        'swapped': swapped & ~bad,
+    })
+
+def parse_coordinate_text(text):
+    """
+    Parses a multi-line paste, one "lat, lon" pair per line in any supported
+    notation. Blank lines are skipped. Returns parse_coordinate_columns()'s
+    frame plus 'line' (1-based line number) and 'text' columns.
+    """
+    lines = pd.Series(text.splitlines() if isinstance(text, str) else list(text), dtype=object)
+    line_no = pd.Series(np.arange(1, len(lines) + 1))
+    keep = lines.str.strip() != ''
+    lines, line_no = lines[keep].reset_index(drop=True), line_no[keep].reset_index(drop=True)
+
+    norm = _normalize(lines)
+    a = pd.Series(None, index=norm.index, dtype=object)
+    b = pd.Series(None, index=norm.index, dtype=object)
+    for pattern in PAIR_RES:
+        todo = a.isna()
+        if not todo.any():
+            break
+        m = norm[todo].str.extract(pattern)
+        a[todo], b[todo] = m['a'], m['b']
+
+    result = parse_coordinate_columns(a, b)
+    # Lines that could not be split into two values at all
+    result.loc[a.isna(), 'error'] = 'expected a latitude and a longitude'
+    result.insert(0, 'line', line_no)
+    result.insert(1, 'text', lines)
+    return result
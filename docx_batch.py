@@ -0,0 +1,145 @@
+"""
+Split print jobs: renders a label queue as several DOCX files in one zip.
+
+The queue is grouped by a key (region, bar color, collector or label type) and
+each group can further be cut after a maximum number of pages. Groups are
+rendered with docx_stream in a process pool, so large jobs use every core,
+and each document stays small enough to open quickly.
+
+Page breaks are estimated from line counts (labels are assumed not to wrap,
+see label_fit), so a part may end up a little shorter than max_pages.
+"""
+import os
+import re
+import tempfile
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from docx_stream import write_docx
+from queue_index import item_collector
+
+# Usable A4 height with the 0.3in top/bottom margins of docx_stream, in points
+PAGE_HEIGHT_PT = (11.69 - 0.6) * 72
+# Single line spacing of the label fonts, in ems
+LINE_HEIGHT_EM = 1.15
+# Height of the colored bar paragraph (line spacing 2pt)
+BAR_HEIGHT_PT = 2.0
+# Smaller jobs are rendered in-process; starting workers costs more than it saves
+PARALLEL_MIN_LABELS = 2000
+
+GROUP_KEYS = {
+    'region': lambda item: item.get('region'),
+    'color': lambda item: item.get('color', '').upper() or None,
+    'collector': item_collector,
+    'type': lambda item: item.get('type', 'text'),
+}
+
+def label_height_pt(item, font_size):
+    """Estimated printed height of one label, in points."""
+    size = item.get('font_size', font_size)
+    ctype = item.get('type', 'text')
+    if ctype == 'data_v2':
+        lines = str(item.get('header', '')).count('\n') + str(item.get('body', '')).count('\n') + 2
+        return lines * size * LINE_HEIGHT_EM + BAR_HEIGHT_PT
+    if ctype == 'rich':
+        text = ''.join(segment for segment, _ in item['content'])
+    else:
+        text = str(item['content'] if 'content' in item else item.get('text', ''))
+    return (text.count('\n') + 1) * size * LINE_HEIGHT_EM
+
+def _paginate(items, max_pages, num_columns, font_size):
+    """Cuts one group into parts of at most max_pages estimated pages (quantities split as needed)."""
+    parts = [[]]
+    state = {'pages': 1, 'page_height': 0.0}
+    row, row_height = [], 0.0
+
+    def end_row():
+        # A row that does not fit starts a new page; past max_pages, a new part
+        if state['page_height'] + row_height > PAGE_HEIGHT_PT and state['page_height'] > 0:
+            state['pages'] += 1
+            state['page_height'] = 0.0
+            if state['pages'] > max_pages:
+                parts.append([])
+                state['pages'] = 1
+        state['page_height'] += row_height
+        for item, count in row:
+            if parts[-1] and parts[-1][-1][0] is item:
+                parts[-1][-1][1] += count
+            else:
+                parts[-1].append([item, count])
+
+    filled = 0
+    for item in items:
+        height = label_height_pt(item, font_size)
+        remaining = item['quantity']
+        while remaining:
+            take = min(remaining, num_columns - filled)
+            row.append((item, take))
+            row_height = max(row_height, height)
+            filled += take
+            remaining -= take
+            if filled == num_columns:
+                end_row()
+                row, row_height, filled = [], 0.0, 0
+    if row:
+        end_row()
+    return [[dict(item, quantity=count) for item, count in part] for part in parts]
+
+def split_queue(label_queue, key=None, max_pages=None, num_columns=13, font_size=4.0):
+    """
+    Groups the queue by key (one of GROUP_KEYS, or None for a single group) in
+    order of first appearance, then cuts groups longer than max_pages.
+    Returns [(name, items)]; items without a key value go to 'other'.
+    """
+    groups = {}
+    get_key = GROUP_KEYS[key] if key else (lambda item: 'labels')
+    for item in label_queue:
+        if item['quantity']:
+            groups.setdefault(get_key(item) or 'other', []).append(item)
+    result = []
+    for name, items in groups.items():
+        parts = _paginate(items, max_pages, num_columns, font_size) if max_pages else [items]
+        for i, part in enumerate(parts, 1):
+            result.append((f"{name}_part{i}" if len(parts) > 1 else str(name), part))
+    return result
+
+def _file_stem(name):
+    return re.sub(r'[^\w.-]+', '_', str(name)).strip('_') or 'labels'
+
+def _render_part(path, items, options):
+    # Runs in a worker process
+    return write_docx(items, path, **options)
+
+def write_docx_zip(label_queue, target, key=None, max_pages=None, workers=None, **options):
+    """
+    Writes one DOCX per group into a zip at target (path or binary file object).
+    Options are those of docx_stream.DocxStreamWriter. workers limits the
+    process pool (None: one per core; 1: render in-process).
+    Returns [(file name in the zip, label count)].
+    """
+    parts = split_queue(label_queue, key, max_pages, options.get('num_columns', 13), options.get('font_size', 4.0))
+    total = sum(item['quantity'] for _, items in parts for item in items)
+    names = [f"{i:02d}_{_file_stem(name)}.docx" for i, (name, _) in enumerate(parts, 1)]
+
+    with tempfile.TemporaryDirectory(prefix='labels_') as tmp_dir:
+        paths = [os.path.join(tmp_dir, name) for name in names]
+        if workers == 1 or len(parts) < 2 or total < PARALLEL_MIN_LABELS:
+            counts = [_render_part(path, items, options) for path, (_, items) in zip(paths, parts)]
+        else:
+            # spawn: forking a threaded server (Streamlit) is not safe
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+                futures = [pool.submit(_render_part, path, items, options) for path, (_, items) in zip(paths, parts)]
+                counts = [future.result() for future in futures]
+
+        # Parts are already deflated; store them as they are
+        tmp_path = f"{os.fspath(target)}.part" if isinstance(target, (str, os.PathLike)) else None
+        try:
+            with zipfile.ZipFile(tmp_path or target, 'w', zipfile.ZIP_STORED) as zf:
+                for name, path in zip(names, paths):
+                    zf.write(path, name)
+            if tmp_path:
+                os.replace(tmp_path, target)
+        finally:
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return list(zip(names, counts))
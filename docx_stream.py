@@ -0,0 +1,294 @@
+"""
+Streaming DOCX output for label sheets.
+
+DocxStreamWriter writes the label grid straight into the zip container: the
+table rows of word/document.xml are generated as XML text and compressed as
+they are appended, so memory does not grow with the label count the way a
+python-docx object tree does. The small parts (styles, settings, section
+setup) come from a python-docx skeleton document and are written on close(),
+once every bar color is known.
+
+Like xlsx_stream.XlsxStreamWriter, a path target is written to <path>.part
+and moved into place on close(); cancelled runs leave nothing behind.
+"""
+import io
+import os
+import re
+import zipfile
+from xml.sax.saxutils import escape
+from docx import Document
+from docx.enum.style import WD_STYLE_TYPE
+from docx.opc.oxml import serialize_part_xml
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+from docx.shared import Inches, Pt
+
+DOCUMENT_PART = 'word/document.xml'
+
+# Named styles shared by every label in the document; runs and paragraphs
+# only reference them, so document.xml stays small for large sheets
+HEADER_STYLE = 'Label Header'
+ITALIC_STYLE = 'Label Italic'
+BAR_STYLE = 'Label Bar {}'
+GRID_STYLE = 'Label Grid'
+
+# Children that follow w:shd in w:pPr and w:spacing in w:rPr (schema order)
+_AFTER_SHD = ('w:tabs', 'w:suppressAutoHyphens', 'w:kinsoku', 'w:wordWrap', 'w:overflowPunct', 'w:topLinePunct',
+              'w:autoSpaceDE', 'w:autoSpaceDN', 'w:bidi', 'w:adjustRightInd', 'w:snapToGrid', 'w:spacing', 'w:ind',
+              'w:contextualSpacing', 'w:mirrorIndents', 'w:suppressOverlap', 'w:jc', 'w:textDirection',
+              'w:textAlignment', 'w:textboxTightWrap', 'w:outlineLvl', 'w:divId', 'w:cnfStyle', 'w:rPr')
+_AFTER_SPACING = ('w:w', 'w:kern', 'w:position', 'w:sz', 'w:szCs', 'w:highlight', 'w:u', 'w:effect',
+                  'w:bdr', 'w:shd', 'w:fitText', 'w:vertAlign', 'w:rtl', 'w:cs', 'w:em', 'w:lang', 'w:eastAsianLayout')
+
+def set_style_shading(style, color_hex):
+    """Sets the background shading of a paragraph style."""
+    shd = OxmlElement('w:shd')
+    shd.set(qn('w:val'), 'clear')
+    shd.set(qn('w:color'), 'auto')
+    shd.set(qn('w:fill'), color_hex.replace("#", ""))
+    style.element.get_or_add_pPr().insert_element_before(shd, *_AFTER_SHD)
+
+def set_style_spacing(style, value_pt):
+    """Sets character spacing (kerning/condensing) of a style. Value in points."""
+    spacing = OxmlElement('w:spacing')
+    spacing.set(qn('w:val'), str(int(value_pt * 20)))
+    style.element.get_or_add_rPr().insert_element_before(spacing, *_AFTER_SPACING)
+
+def add_grid_style(doc, show_borders=True):
+    """
+    Table style for the label grid:
+    1. Borders: Dotted Light Gray (#CCCCCC) if show_borders is True.
+    2. Margins: 0 for max density.
+    """
+    style = doc.styles.add_style(GRID_STYLE, WD_STYLE_TYPE.TABLE)
+    tblPr = OxmlElement('w:tblPr')
+
+    # 1. Borders
+    if show_borders:
+        tblBorders = OxmlElement('w:tblBorders')
+        for border_name in ['top', 'left', 'bottom', 'right', 'insideH', 'insideV']:
+            border = OxmlElement(f'w:{border_name}')
+            border.set(qn('w:val'), 'dotted')
+            border.set(qn('w:sz'), '4') # 1/8 pt, minimal vis
+            border.set(qn('w:space'), '0')
+            border.set(qn('w:color'), 'CCCCCC') # Light Gray
+            tblBorders.append(border)
+        tblPr.append(tblBorders)
+
+    # 2. Cell Margins (Zero)
+    tblCellMar = OxmlElement('w:tblCellMar')
+    for side in ['top', 'left', 'bottom', 'right']:
+        width = OxmlElement(f'w:{side}')
+        width.set(qn('w:w'), '0')
+        width.set(qn('w:type'), 'dxa')
+        tblCellMar.append(width)
+    tblPr.append(tblCellMar)
+    style.element.append(tblPr)
+    return style
+
+def add_label_styles(doc, font_name, font_size, char_spacing):
+    """
+    Sets up Normal (label text) and the character styles used by runs.
+    Returns {'header': style id, 'italic': style id}.
+    """
+    style = doc.styles['Normal']
+    font = style.font
+    font.name = font_name
+    font.size = Pt(font_size)
+    paragraph_format = style.paragraph_format
+    paragraph_format.space_after = Pt(0)
+    paragraph_format.line_spacing = 1.0 # Single spacing
+    if char_spacing != 0:
+        set_style_spacing(style, char_spacing)
+
+    header = doc.styles.add_style(HEADER_STYLE, WD_STYLE_TYPE.CHARACTER)
+    header.font.bold = True
+    italic = doc.styles.add_style(ITALIC_STYLE, WD_STYLE_TYPE.CHARACTER)
+    italic.font.italic = True
+    return {'header': header.style_id, 'italic': italic.style_id}
+
+def bar_style(doc, styles, color_hex, char_spacing=0.0):
+    """Style id of the paragraph style for a colored bar, created on first use per color."""
+    name = BAR_STYLE.format(color_hex.replace("#", "").upper())
+    if name not in styles:
+        style = doc.styles.add_style(name, WD_STYLE_TYPE.PARAGRAPH)
+        style.base_style = doc.styles['Normal']
+        style.paragraph_format.line_spacing = Pt(2)
+        style.font.size = Pt(1.5)
+        if char_spacing != 0:
+            set_style_spacing(style, 0)  # The bar keeps its width regardless of condensing
+        set_style_shading(style, color_hex)
+        styles[name] = style.style_id
+    return styles[name]
+
+
+# Characters python-docx refuses (not allowed in XML 1.0); dropped from label text
+_INVALID_XML_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+_BREAK_RE = re.compile(r'(\r\n|\n|\r|\t)')
+
+def _run_xml(text, style_id=None, half_points=None):
+    """A w:r for text; newlines become w:br and tabs w:tab, as in python-docx add_run()."""
+    props = ''
+    if style_id:
+        props += f'<w:rStyle w:val="{style_id}"/>'
+    if half_points:
+        props += f'<w:sz w:val="{half_points}"/>'
+    parts = []
+    for piece in _BREAK_RE.split(_INVALID_XML_RE.sub('', str(text))):
+        if piece in ('\r\n', '\n', '\r'):
+            parts.append('<w:br/>')
+        elif piece == '\t':
+            parts.append('<w:tab/>')
+        elif piece:
+            parts.append(f'<w:t xml:space="preserve">{escape(piece)}</w:t>')
+    return f"<w:r>{f'<w:rPr>{props}</w:rPr>' if props else ''}{''.join(parts)}</w:r>"
+
+class DocxStreamWriter:
+    """
+    Appends labels to a single-table A4 label sheet without keeping them in memory.
+
+    Use as a context manager and call close() once every label is written;
+    leaving the block without close() (cancel, exception) discards the file.
+    target is a path or a writable binary file object.
+    """
+    def __init__(self, target, font_size=4.0, show_borders=True, num_columns=13, font_name='Arial', char_spacing=0.0):
+        self.font_size = font_size
+        self.num_columns = num_columns
+        self.char_spacing = char_spacing
+        self.labels = 0
+        self.closed = False
+        self._row = []
+        # Cell XML of the last item written; copies of an item reuse it
+        self._last_item = self._last_cell = None
+
+        # Skeleton: page setup and shared styles; the table itself is streamed
+        self._doc = Document()
+        section = self._doc.sections[0]
+        section.page_width = Inches(8.27)
+        section.page_height = Inches(11.69)
+        section.left_margin = Inches(0.2)
+        section.right_margin = Inches(0.2)
+        section.top_margin = Inches(0.3)
+        section.bottom_margin = Inches(0.3)
+        self._styles = add_label_styles(self._doc, font_name, font_size, char_spacing)
+        add_grid_style(self._doc, show_borders)
+        # Same column width as python-docx add_table(), in twips
+        block_width = section.page_width - section.left_margin - section.right_margin
+        self._cell_open = f'<w:tc><w:tcPr><w:tcW w:type="dxa" w:w="{round(block_width // num_columns / 635)}"/></w:tcPr>'
+
+        if isinstance(target, (str, os.PathLike)):
+            self.path = os.fspath(target)
+            self._tmp_path = f"{self.path}.part"
+            self._zip = zipfile.ZipFile(self._tmp_path, 'w', zipfile.ZIP_DEFLATED)
+        else:
+            self.path = self._tmp_path = None
+            self._zip = zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED)
+        self._part = self._zip.open(DOCUMENT_PART, 'w')
+
+        document = serialize_part_xml(self._doc.element)
+        body = document.index(b'<w:body>') + len(b'<w:body>')
+        self._document_tail = document[document.index(b'<w:sectPr', body):]
+        grid = ''.join(f'<w:gridCol w:w="{round(block_width // num_columns / 635)}"/>' for _ in range(num_columns))
+        self._part.write(document[:body] + (
+            '<w:tbl><w:tblPr>'
+            f'<w:tblStyle w:val="{GRID_STYLE.replace(" ", "")}"/><w:tblW w:type="auto" w:w="0"/>'
+            '<w:tblLook w:firstColumn="1" w:firstRow="1" w:lastColumn="0" w:lastRow="0" w:noHBand="0" w:noVBand="1" w:val="04A0"/>'
+            f'</w:tblPr><w:tblGrid>{grid}</w:tblGrid>'
+        ).encode('utf-8'))
+
+    def _cell_xml(self, item):
+        size = item.get('font_size', self.font_size)
+        # Per-item size set by label_fit.shrink_to_fit (otherwise inherited from Normal)
+        half_points = round(size * 2) if size != self.font_size else None
+        ctype = item.get('type', 'text')
+        if ctype == 'data_v2':
+            bar = bar_style(self._doc, self._styles, item['color'], self.char_spacing)
+            paragraphs = (
+                f"<w:p>{_run_xml(item['header'], self._styles['header'], half_points)}</w:p>"
+                f'<w:p><w:pPr><w:pStyle w:val="{bar}"/></w:pPr><w:r><w:t xml:space="preserve">     </w:t></w:r></w:p>'
+                f"<w:p>{_run_xml(item['body'], None, half_points)}</w:p>"
+            )
+        elif ctype == 'rich':
+            paragraphs = '<w:p>' + ''.join(
+                _run_xml(segment, self._styles['italic'] if is_italic else None, half_points)
+                for segment, is_italic in item['content']
+            ) + '</w:p>'
+        else:
+            # content is simple string
+            content = item['content'] if 'content' in item else item.get('text', '')
+            paragraphs = f"<w:p>{_run_xml(content, None, half_points)}</w:p>"
+        return f"{self._cell_open}{paragraphs}</w:tc>"
+
+    def write_label(self, item):
+        """Appends one label (ignores the item's quantity)."""
+        if item is not self._last_item:
+            self._last_item, self._last_cell = item, self._cell_xml(item)
+        self._row.append(self._last_cell)
+        self.labels += 1
+        if len(self._row) == self.num_columns:
+            self._flush_row()
+
+    def write_queue(self, label_queue):
+        """Appends every queue item, quantity times each."""
+        for item in label_queue:
+            for _ in range(item['quantity']):
+                self.write_label(item)
+
+    def _flush_row(self):
+        self._part.write(f"<w:tr>{''.join(self._row)}</w:tr>".encode('utf-8'))
+        self._row = []
+
+    def close(self):
+        """Finishes the document; with a path target, atomically replaces the file."""
+        if self.closed:
+            return
+        try:
+            if self._row:
+                # Pad the last row with empty cells, as python-docx tables have
+                self._row.extend([f"{self._cell_open}<w:p/></w:tc>"] * (self.num_columns - len(self._row)))
+                self._flush_row()
+            self._part.write(b'</w:tbl>' + self._document_tail)
+            self._part.close()
+
+            # Remaining parts (styles incl. bar colors used, settings, ...) from the skeleton
+            skeleton = io.BytesIO()
+            self._doc.save(skeleton)
+            with zipfile.ZipFile(skeleton) as source:
+                for info in source.infolist():
+                    if info.filename != DOCUMENT_PART:
+                        self._zip.writestr(info.filename, source.read(info), zipfile.ZIP_DEFLATED)
+            self._zip.close()
+            if self.path:
+                os.replace(self._tmp_path, self.path)
+        finally:
+            self.closed = True
+            self._discard_tmp()
+
+    def abort(self):
+        """Drops everything written so far."""
+        self.closed = True
+        try:
+            self._part.close()
+            self._zip.close()
+        except (OSError, ValueError):
+            pass
+        self._discard_tmp()
+
+    def _discard_tmp(self):
+        if self._tmp_path and os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.closed:
+            self.abort()
+        return False
+
+def write_docx(label_queue, target, **options):
+    """Writes a whole queue to target (path or binary file). Options as in DocxStreamWriter."""
+    with DocxStreamWriter(target, **options) as writer:
+        writer.write_queue(label_queue)
+        writer.close()
+        return writer.labels
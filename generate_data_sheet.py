@@ -1,16 +1,21 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 import pandas as pd
-import requests
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import os
 import sys
 from pykakasi import kakasi
-
-# --- Configuration ---
-# API endpoints
-GEOCODING_API_ENDPOINT = "https://maps.googleapis.com/maps/api/geocode/json"
-ELEVATION_API_ENDPOINT = "https://maps.googleapis.com/maps/api/elevation/json"
+from run_metrics import RunMetrics
+from table_input import read_projected
+from coord_parser import MISSING, parse_coordinate_columns
+from label_templates import get_template
+from xlsx_stream import ENRICHED_COLUMNS, INPUT_SHEET_NAME, XlsxStreamWriter, input_sheet_columns
+from geocoding_core import (
+    FAILURE_COLUMNS, REQUEST_ERROR, Geocoder, RateLimiter, ResultCache, SpatialCache, elevation_value,
+    failure_kind, failure_records, make_provider,
+)
 
 # --- Data for Island Mapping ---
 ISLAND_MAP = {
@@ -32,16 +37,120 @@ kks.setMode("K", "a")
 kks.setMode("J", "a")
 conv = kks.getConverter()
 
+# --- Batch Settings ---
+PROGRESS_POLL_MS = 200  # UI refresh interval (ms)
+MAX_WORKERS = 4  # Files processed in parallel
+MAX_REQUESTS_PER_SEC = 20  # Global Google Maps request budget for all workers
+RETRY_DELAYS = (2.0, 10.0)  # Pauses before each end-of-file retry pass over transient failures (s)
+
+# --- Progress Channel ---
+
+class ProgressChannel:
+    """
+    Thread-safe counters shared between the worker thread and the Tk UI.
+    The worker only updates numbers; the UI reads a snapshot at a fixed rate,
+    so no per-row callbacks are queued on the Tk event loop.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.cancel_event = threading.Event()
+        self.reset(0)
+
+    def reset(self, total):
+        with self._lock:
+            self.total = total
+            self.done = 0
+            self.cache_hits = 0
+            self.errors = 0
+            self.started_at = time.monotonic()
+            self.finished = False
+        self.cancel_event.clear()
+
+    def add_total(self, n):
+        with self._lock:
+            self.total += n
+
+    def advance(self, cache_hit=False, error=False):
+        with self._lock:
+            self.done += 1
+            if cache_hit: self.cache_hits += 1
+            if error: self.errors += 1
+
+    def add_errors(self, n):
+        with self._lock:
+            self.errors += n
+
+    def finish(self):
+        with self._lock:
+            self.finished = True
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def snapshot(self):
+        """Returns a consistent copy of the counters plus derived rate/ETA."""
+        with self._lock:
+            done, total = self.done, self.total
+            elapsed = time.monotonic() - self.started_at
+            snap = {
+                'done': done, 'total': total,
+                'cache_hits': self.cache_hits, 'errors': self.errors,
+                'finished': self.finished,
+            }
+        rate = done / elapsed if elapsed > 0 else 0.0
+        snap['rate'] = rate
+        snap['eta'] = (total - done) / rate if rate > 0 else None
+        return snap
+
+def format_eta(seconds):
+    if seconds is None: return "--:--"
+    m, s = divmod(int(seconds), 60)
+    h, m = divmod(m, 60)
+    return f"{h}:{m:02d}:{s:02d}" if h else f"{m:02d}:{s:02d}"
+
+class FileJob:
+    """One queued input file and its per-file status (updated by the worker)."""
+    def __init__(self, path):
+        self.path = path
+        self.state = '待機中'
+        self.done = 0
+        self.total = 0
+        self.output_path = None
+        self.failed = 0  # Rows written to the dead-letter file
+
+    def status_text(self):
+        if self.state == '処理中' and self.total:
+            return f"処理中 {self.done}/{self.total}"
+        if self.state == '完了' and self.failed:
+            return f"完了 (失敗 {self.failed} 行)"
+        return self.state
+
 class LabelApp:
+    INPUT_EXTENSIONS = ('.csv', '.xlsx', '.xls')
+
     def __init__(self, root):
         self.root = root
         self.root.title("標本ラベルデータ生成ツール")
-        self.root.geometry("600x550")
+        self.root.geometry("680x720")
 
         # --- Variables ---
         self.api_key_var = tk.StringVar()
-        self.input_file_path = tk.StringVar()
         self.status_var = tk.StringVar(value="待機中")
+        self.stats_var = tk.StringVar(value="")
+        self.channel = ProgressChannel()
+
+        # --- Shared Processing Resources ---
+        # One bounded pool, one rate budget and one cache for every queued file
+        self.executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="label-worker")
+        self.rate_limiter = RateLimiter(MAX_REQUESTS_PER_SEC)
+        self.lookup_cache = ResultCache()
+        self.metrics = RunMetrics()  # Stage timings / API latency of the current run
+        self.jobs = {}  # Treeview item id -> FileJob
+        self.futures = []
         
         # --- UI Layout ---
         main_frame = ttk.Frame(root, padding="20")
@@ -58,11 +167,23 @@ class LabelApp:
         self.api_key_var.set("ここにあなたのAPIキーを入力")
 
         # 2. File Selection Section
-        file_frame = ttk.LabelFrame(main_frame, text="2. データファイルの選択 (CSV / Excel)", padding="10")
-        file_frame.pack(fill=tk.X, pady=5)
-        
-        ttk.Entry(file_frame, textvariable=self.input_file_path, state="readonly").pack(side=tk.LEFT, fill=tk.X, expand=True)
-        ttk.Button(file_frame, text="参照...", command=self.browse_file).pack(side=tk.LEFT, padx=5)
+        file_frame = ttk.LabelFrame(main_frame, text="2. データファイルの選択 (CSV / Excel、複数可)", padding="10")
+        file_frame.pack(fill=tk.BOTH, expand=True, pady=5)
+
+        self.job_tree = ttk.Treeview(file_frame, columns=("file", "status"), show="headings", height=8)
+        self.job_tree.heading("file", text="ファイル")
+        self.job_tree.heading("status", text="状態")
+        self.job_tree.column("file", width=420)
+        self.job_tree.column("status", width=140, anchor="center")
+        self.job_tree.pack(fill=tk.BOTH, expand=True)
+
+        file_btn_frame = ttk.Frame(file_frame)
+        file_btn_frame.pack(fill=tk.X, pady=(5, 0))
+        ttk.Button(file_btn_frame, text="ファイル追加...", command=self.browse_file).pack(side=tk.LEFT)
+        ttk.Button(file_btn_frame, text="フォルダ追加...", command=self.browse_folder).pack(side=tk.LEFT, padx=5)
+        self.clear_btn = ttk.Button(file_btn_frame, text="リストをクリア", command=self.clear_jobs)
+        self.clear_btn.pack(side=tk.RIGHT)
+        ttk.Button(file_btn_frame, text="メトリクス保存...", command=self.save_metrics).pack(side=tk.RIGHT, padx=5)
 
         # 3. Options (Column Mapping)
         opt_frame = ttk.LabelFrame(main_frame, text="3. 列名の設定 (CSVの列名と一致させてください)", padding="10")
@@ -84,126 +205,340 @@ class LabelApp:
             entry.grid(row=row, column=col+1, sticky="w", padx=5, pady=2)
             self.col_entries[label] = entry
 
+        self.input_sheet_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(opt_frame, text=f"「{INPUT_SHEET_NAME}」形式で出力", variable=self.input_sheet_var).grid(
+            row=len(cols) // 2 + 1, column=0, columnspan=4, sticky="w", padx=5, pady=(5, 0))
+
         # 4. Execution Section
         run_frame = ttk.Frame(main_frame, padding="10")
         run_frame.pack(fill=tk.X, pady=10)
         
-        self.run_btn = ttk.Button(run_frame, text="処理開始", command=self.start_process)
-        self.run_btn.pack(fill=tk.X, ipady=5)
+        btn_frame = ttk.Frame(run_frame)
+        btn_frame.pack(fill=tk.X)
+        self.run_btn = ttk.Button(btn_frame, text="処理開始", command=self.start_process)
+        self.run_btn.pack(side=tk.LEFT, fill=tk.X, expand=True, ipady=5)
+        self.cancel_btn = ttk.Button(btn_frame, text="中止", command=self.cancel_process, state="disabled")
+        self.cancel_btn.pack(side=tk.LEFT, padx=(5, 0), ipady=5)
         
         self.progress = ttk.Progressbar(run_frame, mode='determinate')
         self.progress.pack(fill=tk.X, pady=5)
         
         ttk.Label(run_frame, textvariable=self.status_var).pack()
+        ttk.Label(run_frame, textvariable=self.stats_var).pack()
+
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def add_jobs(self, paths):
+        queued = {job.path for job in self.jobs.values()}
+        for path in paths:
+            if path in queued or not path.lower().endswith(self.INPUT_EXTENSIONS):
+                continue
+            job = FileJob(path)
+            item_id = self.job_tree.insert("", tk.END, values=(os.path.basename(path), job.status_text()))
+            self.jobs[item_id] = job
+            queued.add(path)
 
     def browse_file(self):
-        filetypes = (("CSV files", "*.csv"), ("Excel files", "*.xlsx;*.xls"), ("All files", "*.*"))
-        filename = filedialog.askopenfilename(title="ファイルを開く", filetypes=filetypes)
-        if filename:
-            self.input_file_path.set(filename)
+        filetypes = (("CSV / Excel files", "*.csv;*.xlsx;*.xls"), ("CSV files", "*.csv"), ("Excel files", "*.xlsx;*.xls"), ("All files", "*.*"))
+        filenames = filedialog.askopenfilenames(title="ファイルを開く", filetypes=filetypes)
+        if filenames:
+            self.add_jobs(filenames)
+
+    def browse_folder(self):
+        folder = filedialog.askdirectory(title="フォルダを開く")
+        if folder:
+            self.add_jobs(sorted(
+                os.path.join(folder, name) for name in os.listdir(folder)
+                # Skip hidden files, Excel lock files and our own outputs
+                if not name.startswith(('.', '~$')) and not name.endswith(('_labeled.xlsx', '_failed.csv'))
+            ))
+
+    def clear_jobs(self):
+        self.job_tree.delete(*self.job_tree.get_children())
+        self.jobs.clear()
 
     def start_process(self):
         api_key = self.api_key_var.get()
-        input_path = self.input_file_path.get()
+        pending = [(item_id, job) for item_id, job in self.jobs.items() if job.state != '完了']
         
-        if not input_path:
-            messagebox.showwarning("警告", "入力ファイルを選択してください。")
+        if not pending:
+            messagebox.showwarning("警告", "入力ファイルを追加してください。")
             return
         if not api_key:
             messagebox.showwarning("警告", "APIキーを入力してください。")
             return
 
-        # Disable button
+        # Read Tk widgets on the main thread only
+        col_map = {k: v.get() for k, v in self.col_entries.items()}
+        input_sheet = self.input_sheet_var.get()
+
+        # Disable buttons
         self.run_btn.config(state="disabled")
+        self.clear_btn.config(state="disabled")
+        self.cancel_btn.config(state="normal")
         self.progress['value'] = 0
         self.status_var.set("処理中...")
-
-        # Run in a separate thread to keep UI responsive
-        thread = threading.Thread(target=self.process_data, args=(api_key, input_path))
-        thread.start()
-
-    def process_data(self, api_key, input_path):
+        self.stats_var.set("")
+        self.channel.reset(0)
+        self.metrics = RunMetrics()
+        # Nearby sites (within the core's NEAR_* radii) reuse an earlier response
+        self.geocoder = Geocoder(make_provider(api_key), rate_limiter=self.rate_limiter, metrics=self.metrics,
+                                 spatial=SpatialCache())
+
+        # Submit every file to the shared pool (at most MAX_WORKERS run at once)
+        self.futures = []
+        for item_id, job in pending:
+            job.state, job.done, job.total, job.failed = '待機中', 0, 0, 0
+            self.job_tree.set(item_id, "status", job.status_text())
+            self.futures.append(self.executor.submit(self.process_data, job, api_key, col_map, input_sheet))
+        self.root.after(PROGRESS_POLL_MS, self.poll_progress)
+
+    def cancel_process(self):
+        self.channel.cancel()
+        self.cancel_btn.config(state="disabled")
+        self.status_var.set("中止しています...")
+
+    def poll_progress(self):
+        """Refreshes the progress widgets from the channel at a fixed rate."""
+        snap = self.channel.snapshot()
+        if snap['total']:
+            self.progress.configure(value=snap['done'] / snap['total'] * 100)
+            if not self.channel.cancelled:
+                self.status_var.set(f"処理中: {snap['done']}/{snap['total']} 件")
+        self.stats_var.set(
+            f"{snap['rate']:.1f} 件/秒 | 残り {format_eta(snap['eta'])} | "
+            f"キャッシュ {snap['cache_hits']} | エラー {snap['errors']}"
+        )
+        for item_id, job in self.jobs.items():
+            self.job_tree.set(item_id, "status", job.status_text())
+
+        if all(f.done() for f in self.futures):
+            self.channel.finish()
+            self.on_all_finished()
+        else:
+            self.root.after(PROGRESS_POLL_MS, self.poll_progress)
+
+    def on_all_finished(self):
+        self.run_btn.config(state="normal")
+        self.clear_btn.config(state="normal")
+        self.cancel_btn.config(state="disabled")
+
+        jobs = list(self.jobs.values())
+        n_done = sum(job.state == '完了' for job in jobs)
+        n_failed = sum(job.state.startswith('エラー') for job in jobs)
+        if self.channel.cancelled:
+            self.status_var.set(f"中止しました (完了 {n_done} / {len(jobs)} ファイル)")
+        elif n_failed:
+            self.status_var.set("エラー発生")
+            messagebox.showerror("エラー", f"{n_failed} ファイルでエラーが発生しました。\n状態欄を確認してください。")
+        else:
+            self.status_var.set("完了")
+            folders = sorted({os.path.dirname(job.output_path) for job in jobs if job.output_path})
+            avoided = self.metrics.counters.get('api_calls_avoided', 0)
+            note = f"\n近傍キャッシュで省略したAPI呼び出し: {avoided} 回" if avoided else ""
+            messagebox.showinfo("完了", f"{n_done} ファイルの処理が完了しました！{note}\n\n保存先:\n" + "\n".join(folders))
+
+    def save_metrics(self):
+        filetypes = (("JSON", "*.json"), ("Prometheus textfile", "*.prom"))
+        path = filedialog.asksaveasfilename(title="メトリクスを保存", defaultextension=".json", filetypes=filetypes)
+        if not path:
+            return
         try:
-            # Read Data
-            if input_path.endswith('.csv'):
-                df = pd.read_csv(input_path)
+            if path.endswith('.prom'):
+                self.metrics.write_prometheus(path)
             else:
-                df = pd.read_excel(input_path)
+                self.metrics.write_json(path)
+        except OSError as e:
+            messagebox.showerror("エラー", f"メトリクスの保存に失敗しました:\n{e}")
+
+    def on_close(self):
+        self.channel.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.root.destroy()
+
+    def process_data(self, job, api_key, col_map, input_sheet=False):
+        """
+        Enriches one input file. Runs on a pool thread; reports via job and self.channel.
+        Rows are streamed to the output workbook as they are finished; with
+        input_sheet the output uses the 入力用シート layout instead of the
+        input columns followed by ENRICHED_COLUMNS.
+        Each distinct site is looked up once; sites that failed transiently
+        get one retry pass per RETRY_DELAYS after the whole file has been
+        looked up, and rows that still fail are listed in <input>_failed.csv.
+        """
+        channel = self.channel
+        metrics = self.metrics
+        if channel.cancelled:
+            job.state = '中止'
+            return
+        job.state = '処理中'
+        try:
+            # Read Data
+            with metrics.stage('read_input'):
+                # Enrichment only needs the mapped columns; the rest are passed through in pass 2
+                df, load_source = read_projected(job.path, list(col_map.values()))
+            metrics.incr('rows', len(df))
             
-            col_map = {k: v.get() for k, v in self.col_entries.items()}
-            total_rows = len(df)
-            results = []
-
-            for index, row in df.iterrows():
-                lat = row.get(col_map["緯度の列名"])
-                lon = row.get(col_map["経度の列名"])
-                
-                if pd.notna(lat) and pd.notna(lon):
-                    addr_info = self.get_google_address(lat, lon, api_key)
-                    elev = self.get_elevation(lat, lon, api_key)
-                    if elev is not None:
-                        addr_info['alt'] = elev
-                    results.append(addr_info)
+            job.total = len(df)
+            channel.add_total(len(df))
+
+            # Parse every coordinate up front (decimal / DM / DMS, hemispheres);
+            # malformed rows are marked here and never reach the API
+            empty = pd.Series([None] * len(df))
+            coords = parse_coordinate_columns(df.get(col_map["緯度の列名"], empty), df.get(col_map["経度の列名"], empty))
+            metrics.incr('coordinate_errors', int((coords['error'].notna() & (coords['error'] != MISSING)).sum()))
+            metrics.incr('coordinates_swapped', int(coords['swapped'].sum()))
+            label_template = get_template('tk')
+            label_columns = self.label_columns(col_map)
+
+            # Pass 1: look up every distinct site once (failures are not retried here)
+            sites = {}  # (lat, lon) -> [geo response, elevation response]
+            row_sites = []  # per row: site key, cached addr_info, or None (bad coordinates)
+            for lat, lon, coord_error in zip(coords['lat'], coords['lon'], coords['error']):
+                if channel.cancelled:
+                    job.state = '中止'
+                    return
+                if coord_error is not None:
+                    row_sites.append(None)
+                    channel.advance(error=coord_error != MISSING)
+                    job.done += 1
+                    continue
+                # Shared across files: duplicate sites are looked up once
+                key = (lat, lon)
+                cached = self.lookup_cache.get(key)
+                if cached is not None:
+                    row_sites.append(cached)
+                    metrics.incr('cache_hits')
                 else:
-                    results.append({'status': 'データなし'})
-                
-                # Update progress
-                progress_val = (index + 1) / total_rows * 100
-                self.root.after(0, lambda v=progress_val: self.progress.configure(value=v))
-                self.root.after(0, lambda i=index+1, t=total_rows: self.status_var.set(f"処理中: {i}/{t} 件"))
-
-            # Combine results
-            results_df = pd.DataFrame(results)
-            df_combined = pd.concat([df.reset_index(drop=True), results_df], axis=1)
-
-            # Generate Label Text
-            df_combined['label'] = df_combined.apply(
-                lambda r: self.create_label_text(r, col_map), axis=1
-            )
+                    if key not in sites:
+                        sites[key] = list(self.lookup_site(lat, lon))
+                    row_sites.append(key)
+                channel.advance(cache_hit=cached is not None)
+                job.done += 1
+
+            # Retry passes over transient failures, after the whole file
+            for delay in RETRY_DELAYS:
+                pending = [key for key, (geo, elev) in sites.items()
+                           if 'transient' in (failure_kind(geo), failure_kind(elev))]
+                if not pending:
+                    break
+                # Waiting on the cancel event lets Cancel interrupt the pause
+                if channel.cancel_event.wait(delay):
+                    job.state = '中止'
+                    return
+                with metrics.stage('retry'):
+                    for key in pending:
+                        if channel.cancelled:
+                            job.state = '中止'
+                            return
+                        sites[key] = list(self.lookup_site(*key, *sites[key]))
+                        metrics.incr('site_retries')
+                metrics.incr('retry_passes')
+
+            site_info = {}
+            for key, (geo_resp, elev_resp) in sites.items():
+                addr_info = self.parse_google_address(geo_resp)
+                elev = elevation_value(elev_resp)
+                if elev is not None:
+                    addr_info['alt'] = elev
+                if addr_info['status'] == '成功' and elev is not None:
+                    self.lookup_cache.put(key, addr_info)
+                site_info[key] = addr_info
 
             # Organize Columns
-            # Basic address info columns
-            new_cols = ['地点名の表記', '国名', '県名', '地点(ローマ字)', '島・大陸名', '市区町村', '市区町村種別', 'alt', 'status', 'label']
-            # Keep original columns + new columns
-            final_cols = df.columns.tolist() + [c for c in new_cols if c not in df.columns]
-            df_output = df_combined.reindex(columns=final_cols)
-
-            # Save Output
-            output_path = os.path.splitext(input_path)[0] + "_labeled.xlsx"
-            df_output.to_excel(output_path, index=False)
-
-            self.root.after(0, lambda: messagebox.showinfo("完了", f"処理が完了しました！\n\n保存先:\n{output_path}"))
-            self.root.after(0, lambda: self.status_var.set("完了"))
+            if input_sheet:
+                # The 入力用シート layout only uses the mapped columns
+                headers, keys = input_sheet_columns(col_map)
+                sheet_name = INPUT_SHEET_NAME
+            else:
+                # Keep original columns + new columns
+                with metrics.stage('read_input'):
+                    df = load_source()
+                headers = keys = df.columns.tolist() + [c for c in ENRICHED_COLUMNS if c not in df.columns]
+                sheet_name = 'Sheet1'
+            rows = df.to_dict('records')
+
+            # Pass 2: write the rows in input order
+            output_path = os.path.splitext(job.path)[0] + "_labeled.xlsx"
+            failures = []
+            site_errors = 0
+            # Stage times are summed locally and recorded once per file (no per-row locking)
+            format_seconds = 0.0
+            write_start = time.perf_counter()
+            with XlsxStreamWriter(output_path, headers, sheet_name) as writer:
+                for index, (row, site, coord_error) in enumerate(zip(rows, row_sites, coords['error'])):
+                    if channel.cancelled:
+                        job.state = '中止'
+                        return
+
+                    if isinstance(site, tuple):
+                        addr_info = site_info[site]
+                        geo_resp, elev_resp = sites[site]
+                        failures += failure_records([index], [site], [geo_resp], [elev_resp])
+                        site_errors += addr_info['status'] != '成功'
+                    elif site is not None:
+                        addr_info = site
+                    elif coord_error == MISSING:
+                        addr_info = {'status': 'データなし'}
+                    else:
+                        addr_info = {'status': f"座標エラー: {coord_error}"}
+
+                    record = dict(row)
+                    record.update(addr_info)
+
+                    # Generate Label Text
+                    format_start = time.perf_counter()
+                    record['label'] = label_template.render(record, label_columns)
+                    format_seconds += time.perf_counter() - format_start
+
+                    # Save Output
+                    writer.write_row([record.get(k) for k in keys])
+
+                writer.close()
+            metrics.add_stage_time('format_labels', format_seconds)
+            metrics.add_stage_time('write_output', time.perf_counter() - write_start - format_seconds)
+            channel.add_errors(site_errors)
+
+            self.write_failed_rows(job, failures)
+            job.output_path = output_path
+            job.state = '完了'
 
         except Exception as e:
-            self.root.after(0, lambda: messagebox.showerror("エラー", f"予期せぬエラーが発生しました:\n{e}"))
-            self.root.after(0, lambda: self.status_var.set("エラー発生"))
-        
-        finally:
-            self.root.after(0, lambda: self.run_btn.config(state="normal"))
+            job.state = f"エラー: {e}"
 
     # --- Logic Functions (Same as before, adapted for Class) ---
 
-    def get_elevation(self, lat, lon, api_key):
-        params = {'locations': f'{lat},{lon}', 'key': api_key}
-        try:
-            res = requests.get(ELEVATION_API_ENDPOINT, params=params, timeout=5).json()
-            if res['status'] == 'OK': return int(round(res['results'][0]['elevation']))
-        except: return None
-        return None
-
-    def get_google_address(self, lat, lon, api_key):
+    def write_failed_rows(self, job, failures):
+        """Dead-letter CSV next to the input (row = 0-based data row); a stale one is removed."""
+        path = os.path.splitext(job.path)[0] + "_failed.csv"
+        job.failed = len(failures)
+        if failures:
+            pd.DataFrame(failures, columns=FAILURE_COLUMNS).to_csv(path, index=False, encoding='utf-8-sig')
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def lookup_site(self, lat, lon, geo=None, elev=None):
+        """
+        Geocoding and elevation responses for one site. Given the responses
+        of an earlier attempt, only the parts that failed transiently are
+        requested again.
+        """
+        if geo is None or failure_kind(geo) == 'transient':
+            with self.metrics.stage('geocoding'):
+                geo = self.geocoder.reverse_geocode(
+                    lat, lon, 'ja', result_type='political|locality|sublocality|neighborhood|premise|subpremise'
+                )
+        if elev is None or failure_kind(elev) == 'transient':
+            with self.metrics.stage('elevation'):
+                elev = self.geocoder.elevation(lat, lon)
+        return geo, elev
+
+    def parse_google_address(self, resp):
         # Initialize structure
         res_data = {k: '' for k in ['地点名の表記', '国名', '県名', '地点(ローマ字)', '島・大陸名', '市区町村', '市区町村種別', 'alt']}
         res_data['status'] = 'エラー'
 
-        params = {
-            'latlng': f'{lat},{lon}', 'key': api_key, 'language': 'ja',
-            'result_type': 'political|locality|sublocality|neighborhood|premise|subpremise'
-        }
         try:
-            resp = requests.get(GEOCODING_API_ENDPOINT, params=params, timeout=5).json()
-            
             if resp['status'] == 'OK':
                 first = resp['results'][0]
                 
@@ -254,6 +589,8 @@ class LabelApp:
 
                 res_data['status'] = '成功'
             
+            elif resp['status'] == REQUEST_ERROR:
+                res_data['status'] = f"通信エラー: {resp.get('error_message')}"
             else:
                 res_data['status'] = f"APIエラー: {resp.get('status')}"
 
@@ -262,32 +599,14 @@ class LabelApp:
         
         return res_data
 
-    def create_label_text(self, row, col_map):
-        # Extract basic data
-        date = str(row.get(col_map["日付の列名"], ''))
-        method = str(row.get(col_map["採集方法の列名"], ''))
-        collector = str(row.get(col_map["採集者名の列名"], ''))
-        
-        # Extract API data
-        addr = row.get('地点名の表記', '')
-        elev = row.get('alt', '')
-        lat = row.get(col_map["緯度の列名"], '')
-        lon = row.get(col_map["経度の列名"], '')
-
-        # Build Text
-        lines = []
-        lines.append(f"JAPAN: {addr}")
-        lines.append(f"GPS({elev}m)")
-        
-        line3 = []
-        if date and date != 'nan': line3.append(date)
-        if method and method != 'nan': line3.append(method)
-        if collector and collector != 'nan': line3.append(collector)
-        if line3: lines.append(". ".join(line3) + ".")
-        
-        lines.append(f"N{lat}, E{lon}")
-        
-        return "\n".join(lines)
+    @staticmethod
+    def label_columns(col_map):
+        """Field -> record key mapping for the built-in 'tk' label template."""
+        return {
+            'address': '地点名の表記', 'elevation': 'alt',
+            'lat': col_map["緯度の列名"], 'lon': col_map["経度の列名"],
+            'date': col_map["日付の列名"], 'method': col_map["採集方法の列名"], 'collector': col_map["採集者名の列名"],
+        }
 
 if __name__ == "__main__":
     root = tk.Tk()
@@ -0,0 +1,737 @@
+"""
+Shared geocoding / elevation core used by every front end
+(label_app.py CLI, the Tk LabelApp and the Streamlit app).
+
+Providers fetch raw, Google-shaped responses ({'status': ..., 'results': [...]}).
+A Geocoder wraps one provider with a shared cache, rate limiter and metrics,
+and offers batch-first helpers that take lists of (lat, lon) pairs. The
+format_* / *_struct helpers turn responses into what each front end shows.
+
+Providers:
+    google     Google Maps Geocoding + Elevation APIs (pooled HTTP session)
+    gazetteer  offline nearest-place lookup from a local CSV
+    mock       deterministic offline responses for development
+"""
+import csv
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+
+# --- Configuration ---
+# API endpoints (override via environment, e.g. to target benchmarks/mock_maps_server.py)
+GEOCODING_API_ENDPOINT = os.environ.get("GEOCODING_API_ENDPOINT", "https://maps.googleapis.com/maps/api/geocode/json")
+ELEVATION_API_ENDPOINT = os.environ.get("ELEVATION_API_ENDPOINT", "https://maps.googleapis.com/maps/api/elevation/json")
+
+# Locations per Elevation API request (Google allows up to 512; URL length is the practical limit)
+ELEVATION_BATCH_SIZE = 256
+# Attempts per lookup before a throttled request is given up
+MAX_THROTTLE_ATTEMPTS = 8
+# Default reuse radii of the spatial cache (metres): addresses change slowly, elevation does not
+NEAR_ADDRESS_M = 25.0
+NEAR_ELEVATION_M = 5.0
+# Status used for transport-level failures (timeouts, connection errors, bad JSON)
+REQUEST_ERROR = 'REQUEST_ERROR'
+
+
+# --- Errors ---
+
+class GeocodingError(Exception):
+    """Transport-level failure talking to a provider."""
+
+class ThrottledError(GeocodingError):
+    """Raised when the provider signals quota exhaustion (OVER_QUERY_LIMIT, HTTP 429 or 5xx)."""
+    def __init__(self, message, endpoint=None):
+        super().__init__(message)
+        self.endpoint = endpoint
+
+def error_response(status, message=''):
+    """Google-shaped response used to carry a failure through the batch APIs."""
+    return {'status': status, 'error_message': message, 'results': []}
+
+# Statuses that may succeed on a later attempt. Anything else that is not OK
+# (ZERO_RESULTS, INVALID_REQUEST, REQUEST_DENIED, ...) is a final answer.
+TRANSIENT_STATUSES = frozenset({REQUEST_ERROR, 'OVER_QUERY_LIMIT', 'UNKNOWN_ERROR'})
+
+def failure_kind(response):
+    """None for an OK response, otherwise 'transient' or 'permanent'."""
+    status = response.get('status')
+    if status == 'OK':
+        return None
+    return 'transient' if status in TRANSIENT_STATUSES else 'permanent'
+
+FAILURE_COLUMNS = ['row', 'latitude', 'longitude', 'kind', 'geocode_status', 'elevation_status', 'error']
+
+def failure_records(rows, coords, addresses, elevations):
+    """
+    Dead-letter records: one per row whose address or elevation lookup failed.
+    kind is 'transient' if any part may still succeed on retry, else 'permanent'.
+    """
+    records = []
+    for row, (lat, lon), address, elevation in zip(rows, coords, addresses, elevations):
+        kinds = [failure_kind(address), failure_kind(elevation)]
+        if not any(kinds):
+            continue
+        errors = [r.get('error_message') or r.get('status') for r, k in zip((address, elevation), kinds) if k]
+        records.append({
+            'row': row, 'latitude': lat, 'longitude': lon,
+            'kind': 'transient' if 'transient' in kinds else 'permanent',
+            'geocode_status': address.get('status'), 'elevation_status': elevation.get('status'),
+            'error': ' / '.join(str(e) for e in errors),
+        })
+    return records
+
+
+# --- Rate Limiting ---
+
+class RateLimiter:
+    """
+    Token-bucket limiter shared by all worker threads, so the total request
+    rate stays within one budget however many threads or files are active.
+    """
+    def __init__(self, rate_per_sec):
+        self.rate = rate_per_sec
+        self._lock = threading.Lock()
+        self._next_slot = time.monotonic()
+
+    def acquire(self):
+        """Blocks until the caller may issue the next request."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + 1.0 / self.rate
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def on_success(self):
+        pass
+
+    def on_throttle(self):
+        pass
+
+class AimdRateController(RateLimiter):
+    """
+    RateLimiter with additive-increase / multiplicative-decrease: every
+    success raises the rate by roughly `increase` req/s per second, every
+    throttle multiplies it by `decrease`.
+    """
+    def __init__(self, initial_rate=10.0, min_rate=0.5, max_rate=50.0,
+                 increase=1.0, decrease=0.5, log=print):
+        super().__init__(initial_rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.log = log
+        self.successes = 0
+        self.throttles = 0
+        self._last_decrease = 0.0
+
+    def on_success(self):
+        with self._lock:
+            self.successes += 1
+            # +increase/rate per call ~= +increase req/s for every second at this rate
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def on_throttle(self):
+        with self._lock:
+            self.throttles += 1
+            now = time.monotonic()
+            # Requests already in flight were sent at the old rate; back off once per second at most
+            if now - self._last_decrease < 1.0:
+                return
+            self._last_decrease = now
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            # Push the next slot out so the reduced rate takes effect immediately
+            self._next_slot = max(self._next_slot, now + 1.0 / self.rate)
+            rate = self.rate
+        self.log(f"クォータ制限を検出: レートを {rate:.1f} 件/秒 に下げます。")
+
+
+# --- Cache ---
+
+class ResultCache:
+    """Thread-safe key -> value cache shared across threads, files and sessions."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def get(self, key):
+        with self._lock:
+            return self._data.get(key)
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+class SpatialIndex:
+    """
+    Grid index of (lat, lon) -> value for nearest-within-radius queries.
+    Cells are radius_m tall, so a query only scans the neighbouring cells.
+    Not locked; SpatialCache serialises access.
+    """
+    def __init__(self, radius_m):
+        self.radius_m = radius_m
+        self.cell_deg = radius_m / 111320.0
+        self.grid = {}
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg))
+
+    def add(self, lat, lon, value):
+        self.grid.setdefault(self._cell(lat, lon), []).append((lat, lon, value))
+
+    def nearest(self, lat, lon):
+        """Value of the closest point within radius_m, or None."""
+        ci, cj = self._cell(lat, lon)
+        # Longitude cells shrink towards the poles; widen the scan to keep covering radius_m
+        reach_j = int(math.ceil(1.0 / max(math.cos(math.radians(lat)), 0.01)))
+        best, best_d = None, None
+        for di in (-1, 0, 1):
+            for dj in range(-reach_j, reach_j + 1):
+                for plat, plon, value in self.grid.get((ci + di, cj + dj), ()):
+                    d = haversine_km(lat, lon, plat, plon) * 1000.0
+                    if d <= self.radius_m and (best_d is None or d < best_d):
+                        best, best_d = value, d
+        return best
+
+class SpatialCache:
+    """
+    Serves a cached response for any point within a radius of an already
+    answered one, e.g. specimens a few metres apart along a transect.
+    Address and elevation use separate radii (0 disables one); `avoided`
+    counts the API calls saved per endpoint.
+    """
+    def __init__(self, address_radius_m=NEAR_ADDRESS_M, elevation_radius_m=NEAR_ELEVATION_M):
+        self.radii = {'geocode': address_radius_m, 'elevation': elevation_radius_m}
+        self.avoided = {'geocode': 0, 'elevation': 0}
+        self._indexes = {}  # (endpoint, variant) -> SpatialIndex
+        self._lock = threading.Lock()
+
+    def enabled(self, endpoint):
+        return self.radii.get(endpoint, 0) > 0
+
+    def _index(self, endpoint, variant):
+        key = (endpoint, variant)
+        if key not in self._indexes:
+            self._indexes[key] = SpatialIndex(self.radii[endpoint])
+        return self._indexes[key]
+
+    def get(self, endpoint, variant, lat, lon):
+        """Nearby response or None. A hit counts as one avoided call."""
+        if not self.enabled(endpoint):
+            return None
+        with self._lock:
+            value = self._index(endpoint, variant).nearest(float(lat), float(lon))
+            if value is not None:
+                self.avoided[endpoint] += 1
+            return value
+
+    def put(self, endpoint, variant, lat, lon, response):
+        if self.enabled(endpoint):
+            with self._lock:
+                self._index(endpoint, variant).add(float(lat), float(lon), response)
+
+    def count_avoided(self, endpoint, n=1):
+        with self._lock:
+            self.avoided[endpoint] += n
+
+
+# --- Providers ---
+
+class GeocodingProvider:
+    """
+    Provider interface. Responses are Google-shaped dicts; transport failures
+    raise GeocodingError and quota exhaustion raises ThrottledError.
+    """
+    name = 'base'
+
+    def reverse_geocode(self, lat, lon, language='ja', result_type=None):
+        raise NotImplementedError
+
+    def elevation(self, lat, lon):
+        return self.elevations([(lat, lon)])[0]
+
+    def elevations(self, coords):
+        """One response per (lat, lon). Providers that support batching override this."""
+        return [self.elevation(lat, lon) for lat, lon in coords]
+
+class GoogleMapsProvider(GeocodingProvider):
+    name = 'google'
+
+    def __init__(self, api_key, session=None, timeout=10,
+                 geocoding_endpoint=None, elevation_endpoint=None):
+        self.api_key = api_key
+        self.session = session or requests.Session()  # Pooled keep-alive connections
+        self.timeout = timeout
+        self.geocoding_endpoint = geocoding_endpoint or GEOCODING_API_ENDPOINT
+        self.elevation_endpoint = elevation_endpoint or ELEVATION_API_ENDPOINT
+
+    def _get(self, url, params):
+        try:
+            response = self.session.get(url, params=dict(params, key=self.api_key), timeout=self.timeout)
+            if response.status_code == 429 or response.status_code >= 500:
+                raise ThrottledError(f"HTTP {response.status_code}")
+            response.raise_for_status()
+            data = response.json()
+        except requests.exceptions.RequestException as e:
+            # Messages include the request URL; keep the key out of outputs and dead-letter files
+            message = str(e).replace(self.api_key, '***') if self.api_key else str(e)
+            raise GeocodingError(message) from e
+        except ValueError as e:
+            raise GeocodingError(f"Invalid JSON: {e}") from e
+        if data.get('status') == 'OVER_QUERY_LIMIT':
+            raise ThrottledError(data.get('error_message') or data['status'])
+        return data
+
+    def reverse_geocode(self, lat, lon, language='ja', result_type=None):
+        params = {'latlng': f'{lat},{lon}', 'language': language}
+        if result_type:
+            params['result_type'] = result_type
+        return self._get(self.geocoding_endpoint, params)
+
+    def elevations(self, coords):
+        # The Elevation API accepts many pipe-separated locations per request
+        locations = '|'.join(f'{lat},{lon}' for lat, lon in coords)
+        data = self._get(self.elevation_endpoint, {'locations': locations})
+        if data.get('status') != 'OK':
+            return [dict(data) for _ in coords]
+        results = data.get('results', [])
+        if len(results) != len(coords):
+            return [error_response('UNKNOWN_ERROR', 'Elevation result count mismatch') for _ in coords]
+        return [{'status': 'OK', 'results': [r]} for r in results]
+
+class GazetteerProvider(GeocodingProvider):
+    """
+    Offline provider: nearest entry of a local gazetteer CSV within max_distance_km.
+
+    Expected columns: lat, lon, country, country_code, admin, locality,
+    sublocality, address_ja, address_en and optionally elevation.
+    """
+    name = 'gazetteer'
+    CELL_DEG = 0.1  # Grid cell size for the nearest-neighbour index
+
+    def __init__(self, path, max_distance_km=5.0):
+        self.max_distance_km = max_distance_km
+        self.grid = {}
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            for row in csv.DictReader(f):
+                try:
+                    lat, lon = float(row['lat']), float(row['lon'])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                self.grid.setdefault(self._cell(lat, lon), []).append((lat, lon, row))
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.CELL_DEG), math.floor(lon / self.CELL_DEG))
+
+    def nearest(self, lat, lon):
+        """Returns (row, distance_km) of the closest entry within range, or (None, None)."""
+        ci, cj = self._cell(lat, lon)
+        # Cells to search so that max_distance_km is always covered
+        reach = int(math.ceil(self.max_distance_km / (111.0 * self.CELL_DEG * max(math.cos(math.radians(lat)), 0.01)))) + 1
+        best, best_d = None, None
+        for di in range(-reach, reach + 1):
+            for dj in range(-reach, reach + 1):
+                for plat, plon, row in self.grid.get((ci + di, cj + dj), ()):
+                    d = haversine_km(lat, lon, plat, plon)
+                    if d <= self.max_distance_km and (best_d is None or d < best_d):
+                        best, best_d = row, d
+        return best, best_d
+
+    def reverse_geocode(self, lat, lon, language='ja', result_type=None):
+        row, _ = self.nearest(lat, lon)
+        if row is None:
+            return error_response('ZERO_RESULTS')
+        components = []
+        if row.get('sublocality'):
+            components.append({'long_name': row['sublocality'], 'short_name': row['sublocality'], 'types': ['political', 'sublocality', 'sublocality_level_1']})
+        if row.get('locality'):
+            components.append({'long_name': row['locality'], 'short_name': row['locality'], 'types': ['locality', 'political']})
+        if row.get('admin'):
+            components.append({'long_name': row['admin'], 'short_name': row['admin'], 'types': ['administrative_area_level_1', 'political']})
+        if row.get('country'):
+            components.append({'long_name': row['country'], 'short_name': row.get('country_code') or row['country'], 'types': ['country', 'political']})
+        address = row.get('address_ja') if language == 'ja' else row.get('address_en')
+        return {'status': 'OK', 'results': [{
+            'formatted_address': address or row.get('address_en') or row.get('address_ja') or '',
+            'address_components': components,
+            'types': ['political'],
+        }]}
+
+    def elevation(self, lat, lon):
+        row, _ = self.nearest(lat, lon)
+        if row is None or not row.get('elevation'):
+            return error_response('ZERO_RESULTS')
+        return {'status': 'OK', 'results': [{'elevation': float(row['elevation'])}]}
+
+class MockProvider(GeocodingProvider):
+    """Deterministic offline responses (for development without a key)."""
+    name = 'mock'
+
+    def reverse_geocode(self, lat, lon, language='ja', result_type=None):
+        lat, lon = float(lat), float(lon)
+        if language == 'ja':
+            address, country, admin, locality = f"日本、東京都模擬市 {lat:.3f},{lon:.3f}", '日本', '東京都', '模擬市'
+        else:
+            address, country, admin, locality = f"Mock City, Tokyo {lat:.3f},{lon:.3f}, Japan", 'Japan', 'Tokyo', 'Mock City'
+        return {'status': 'OK', 'results': [{
+            'formatted_address': address,
+            'address_components': [
+                {'long_name': locality, 'short_name': locality, 'types': ['locality', 'political']},
+                {'long_name': admin, 'short_name': admin, 'types': ['administrative_area_level_1', 'political']},
+                {'long_name': country, 'short_name': 'JP', 'types': ['country', 'political']},
+            ],
+            'types': ['locality', 'political'],
+        }]}
+
+    def elevation(self, lat, lon):
+        return {'status': 'OK', 'results': [{'elevation': round(abs(float(lat) * 10 + float(lon)) % 3000, 1)}]}
+
+PROVIDERS = {'google': GoogleMapsProvider, 'gazetteer': GazetteerProvider, 'mock': MockProvider}
+
+def make_provider(api_key=None, name=None, gazetteer_path=None):
+    """
+    Builds a provider by name. Defaults come from the GEOCODING_PROVIDER and
+    GAZETTEER_PATH environment variables, falling back to Google.
+    """
+    name = name or os.environ.get('GEOCODING_PROVIDER', 'google')
+    if name == 'google':
+        return GoogleMapsProvider(api_key)
+    if name == 'gazetteer':
+        path = gazetteer_path or os.environ.get('GAZETTEER_PATH')
+        if not path:
+            raise ValueError("gazetteer provider requires a CSV path (GAZETTEER_PATH)")
+        return GazetteerProvider(path)
+    if name == 'mock':
+        return MockProvider()
+    raise ValueError(f"Unknown geocoding provider: {name}")
+
+
+# --- Geocoder ---
+
+class Geocoder:
+    """
+    One provider plus the shared cache, rate limiter and metrics.
+    Single lookups never raise: failures come back as error responses
+    (status REQUEST_ERROR / OVER_QUERY_LIMIT) except when raise_throttled is set.
+    With a SpatialCache, points near an already answered one reuse its
+    response, and batches only fetch one point per reuse radius.
+    """
+    def __init__(self, provider, rate_limiter=None, cache=None, metrics=None, spatial=None):
+        self.provider = provider
+        self.rate_limiter = rate_limiter
+        self.cache = cache
+        self.metrics = metrics
+        self.spatial = spatial
+
+    def _call(self, endpoint, func, *args):
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        start = time.perf_counter()
+        status = 'ERROR'
+        try:
+            result = func(*args)
+            first = result[0] if isinstance(result, list) and result else result
+            status = first.get('status', 'UNKNOWN') if isinstance(first, dict) else 'UNKNOWN'
+            if self.rate_limiter:
+                self.rate_limiter.on_success()
+            return result
+        except ThrottledError as e:
+            e.endpoint = endpoint
+            status = 'OVER_QUERY_LIMIT'
+            if self.rate_limiter:
+                self.rate_limiter.on_throttle()
+            raise
+        except GeocodingError:
+            status = REQUEST_ERROR
+            raise
+        finally:
+            if self.metrics is not None:
+                self.metrics.observe(endpoint, time.perf_counter() - start, status)
+
+    def _cached(self, key):
+        if self.cache is None:
+            return None
+        value = self.cache.get(key)
+        if value is not None and self.metrics is not None:
+            self.metrics.incr('cache_hits')
+        return value
+
+    def _store(self, key, response):
+        # Only cache definitive answers; errors may succeed on a later attempt
+        if self.cache is not None and response.get('status') in ('OK', 'ZERO_RESULTS'):
+            self.cache.put(key, response)
+        if self.spatial is not None and response.get('status') == 'OK':
+            endpoint, lat, lon, *variant = key
+            self.spatial.put(endpoint, tuple(variant), lat, lon, response)
+
+    def _nearby(self, key):
+        """Spatial-cache response for a cache key, or None."""
+        if self.spatial is None:
+            return None
+        endpoint, lat, lon, *variant = key
+        response = self.spatial.get(endpoint, tuple(variant), lat, lon)
+        if response is not None:
+            self._count_avoided(endpoint, 1)
+        return response
+
+    def _count_avoided(self, endpoint, n):
+        if n and self.metrics is not None:
+            self.metrics.incr('api_calls_avoided', n)
+            self.metrics.incr(f'api_calls_avoided_{endpoint}', n)
+
+    def _group_nearby(self, endpoint, points):
+        """
+        Splits key -> (lat, lon) into representatives to fetch and
+        key -> representative key for points within the reuse radius of one.
+        """
+        if self.spatial is None or not self.spatial.enabled(endpoint):
+            return dict(points), {}
+        index = SpatialIndex(self.spatial.radii[endpoint])
+        reps, alias = {}, {}
+        for key, (lat, lon) in points.items():
+            near = index.nearest(float(lat), float(lon))
+            if near is not None:
+                alias[key] = near
+            else:
+                index.add(float(lat), float(lon), key)
+                reps[key] = (lat, lon)
+        if alias:
+            self.spatial.count_avoided(endpoint, len(alias))
+            self._count_avoided(endpoint, len(alias))
+        return reps, alias
+
+    @staticmethod
+    def _geocode_key(lat, lon, language, result_type):
+        return ('geocode', round(float(lat), 7), round(float(lon), 7), language, result_type)
+
+    @staticmethod
+    def _elevation_key(lat, lon):
+        return ('elevation', round(float(lat), 7), round(float(lon), 7))
+
+    def reverse_geocode(self, lat, lon, language='ja', result_type=None, raise_throttled=False):
+        key = self._geocode_key(lat, lon, language, result_type)
+        cached = self._cached(key) or self._nearby(key)
+        if cached is not None:
+            return cached
+        try:
+            response = self._call('geocode', self.provider.reverse_geocode, lat, lon, language, result_type)
+        except ThrottledError as e:
+            if raise_throttled:
+                raise
+            return error_response('OVER_QUERY_LIMIT', str(e))
+        except GeocodingError as e:
+            return error_response(REQUEST_ERROR, str(e))
+        self._store(key, response)
+        return response
+
+    def elevation(self, lat, lon, raise_throttled=False):
+        key = self._elevation_key(lat, lon)
+        cached = self._cached(key) or self._nearby(key)
+        if cached is not None:
+            return cached
+        try:
+            response = self._call('elevation', self.provider.elevation, lat, lon)
+        except ThrottledError as e:
+            if raise_throttled:
+                raise
+            return error_response('OVER_QUERY_LIMIT', str(e))
+        except GeocodingError as e:
+            return error_response(REQUEST_ERROR, str(e))
+        self._store(key, response)
+        return response
+
+    # --- Batch API ---
+
+    def reverse_geocode_batch(self, coords, language='ja', result_type=None, workers=4,
+                              max_attempts=MAX_THROTTLE_ATTEMPTS, on_progress=None):
+        """
+        Reverse-geocodes a list of (lat, lon) pairs on `workers` threads.
+        Duplicate (and, with a spatial cache, nearby) coordinates are fetched
+        once; throttled lookups are re-queued transparently (up to
+        max_attempts). Returns responses in input order.
+        """
+        unique = {}
+        for lat, lon in coords:
+            unique.setdefault(self._geocode_key(lat, lon, language, result_type), (lat, lon))
+        unique, alias = self._group_nearby('geocode', unique)
+        done = {}
+
+        def fetch(lat, lon):
+            return self.reverse_geocode(lat, lon, language, result_type, raise_throttled=True)
+
+        def on_done(key, response):
+            done[key] = response
+            if on_progress:
+                on_progress(1)
+
+        self._run_requeue(unique, fetch, on_done, workers, max_attempts, 'geocode')
+        for key, rep_key in alias.items():
+            done[key] = done[rep_key]
+        if on_progress and alias:
+            on_progress(len(alias))
+        return [done[self._geocode_key(lat, lon, language, result_type)] for lat, lon in coords]
+
+    def elevation_batch(self, coords, chunk_size=ELEVATION_BATCH_SIZE, workers=2,
+                        max_attempts=MAX_THROTTLE_ATTEMPTS, on_progress=None):
+        """
+        Looks up elevations for a list of (lat, lon) pairs, sending up to
+        chunk_size locations per provider request. Duplicates and cached
+        coordinates are skipped. Returns responses in input order.
+        on_progress(n) is called with the number of unique locations resolved.
+        """
+        done = {}
+        missing = {}
+        for lat, lon in coords:
+            key = self._elevation_key(lat, lon)
+            if key in done or key in missing:
+                continue
+            cached = self._cached(key) or self._nearby(key)
+            if cached is not None:
+                done[key] = cached
+            else:
+                missing[key] = (lat, lon)
+        missing, alias = self._group_nearby('elevation', missing)
+        if on_progress and done:
+            on_progress(len(done))
+
+        keys = list(missing)
+        chunks = [tuple(keys[i:i + chunk_size]) for i in range(0, len(keys), chunk_size)]
+
+        def fetch_chunk(chunk):
+            try:
+                return self._call('elevation', self.provider.elevations, [missing[k] for k in chunk])
+            except ThrottledError:
+                raise
+            except GeocodingError as e:
+                return [error_response(REQUEST_ERROR, str(e)) for _ in chunk]
+
+        def on_done(chunk, responses):
+            if isinstance(responses, dict):
+                # Attempts exhausted: the same error for every location in the chunk
+                responses = [responses] * len(chunk)
+            for k, response in zip(chunk, responses):
+                self._store(k, response)
+                done[k] = response
+            if on_progress:
+                on_progress(len(chunk))
+
+        self._run_requeue({chunk: (chunk,) for chunk in chunks}, fetch_chunk, on_done, workers, max_attempts, 'elevation')
+        for key, rep_key in alias.items():
+            done[key] = done[rep_key]
+        if on_progress and alias:
+            on_progress(len(alias))
+        return [done[self._elevation_key(lat, lon)] for lat, lon in coords]
+
+    def _run_requeue(self, tasks, fetch, on_done, workers, max_attempts, endpoint):
+        """
+        Runs fetch(*args) for every key -> args in tasks on a thread pool and
+        calls on_done(key, result) from the calling thread. ThrottledError puts
+        the task back on the queue (with a short backoff for limiters that do
+        not adapt); after max_attempts the result is an OVER_QUERY_LIMIT response.
+        """
+        attempts = {key: 0 for key in tasks}
+        pending = deque(tasks.items())
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            in_flight = {}
+            while pending or in_flight:
+                while pending and len(in_flight) < workers * 2:
+                    key, args = pending.popleft()
+                    attempts[key] += 1
+                    in_flight[pool.submit(fetch, *args)] = (key, args)
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    key, args = in_flight.pop(future)
+                    try:
+                        result = future.result()
+                    except ThrottledError as e:
+                        if self.metrics is not None:
+                            self.metrics.count_retry(e.endpoint or endpoint)
+                        if attempts[key] < max_attempts:
+                            if not isinstance(self.rate_limiter, AimdRateController):
+                                time.sleep(min(0.1 * 2 ** attempts[key], 5.0))
+                            pending.append((key, args))  # Re-queue transparently
+                            continue
+                        result = error_response('OVER_QUERY_LIMIT', str(e))
+                    on_done(key, result)
+
+
+# --- Response Formatting ---
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in kilometres."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 6371.0088 * 2 * math.asin(min(1.0, math.sqrt(a)))
+
+def clean_japanese_address(addr):
+    """Strips the leading '日本、' and a postal-code prefix from a formatted address."""
+    if addr.startswith('日本、'):
+        addr = addr.replace('日本、', '', 1)
+    space_pos = addr.find(' ')
+    if space_pos != -1 and addr[:space_pos].replace('〒', '').replace('-', '').isdigit():
+        return addr[space_pos+1:].strip()
+    return addr.strip()
+
+def format_label_address(response):
+    """CLI label format: cleaned Japanese address, or an error message string."""
+    status = response.get('status')
+    if status == 'OK' and response.get('results'):
+        for result in response['results']:
+            # Skip results that are just plus codes
+            if 'plus_code' in result and result.get('types') == ['plus_code']:
+                continue
+            return clean_japanese_address(result.get('formatted_address', ''))
+        return None
+    if status == 'ZERO_RESULTS':
+        return "エラー: 住所が見つかりません"
+    if status == REQUEST_ERROR:
+        return f"住所APIリクエストエラー: {response.get('error_message', '')}"
+    return f"住所APIエラー: {response.get('error_message') or status or 'Unknown Error'}"
+
+def elevation_value(response):
+    """Elevation in whole metres, or None."""
+    if response.get('status') == 'OK' and response.get('results'):
+        return int(round(response['results'][0]['elevation']))
+    return None
+
+def format_label_elevation(response):
+    """CLI label format: elevation as int, or an error message string."""
+    value = elevation_value(response)
+    if value is not None:
+        return value
+    if response.get('status') == REQUEST_ERROR:
+        return f"高度APIリクエストエラー: {response.get('error_message', '')}"
+    return f"高度APIエラー: {response.get('error_message') or response.get('status') or 'Unknown Error'}"
+
+def address_struct(response):
+    """
+    Web app header format: {'country': 'JAPAN', 'admin': ..., 'locality': ...}
+    from the first result, or None.
+    """
+    if response.get('status') != 'OK' or not response.get('results'):
+        return None
+    addr_info = {'country': '', 'admin': '', 'locality': ''}
+    for c in response['results'][0].get('address_components', []):
+        types = c.get('types', [])
+        if 'country' in types:
+            # Long name upper-cased (e.g. MADAGASCAR), falling back to the short code
+            addr_info['country'] = (c.get('long_name') or c.get('short_name', '')).upper()
+        if 'administrative_area_level_1' in types:
+            addr_info['admin'] = c.get('long_name', '')
+        if 'locality' in types:
+            addr_info['locality'] = c.get('long_name', '')
+        if not addr_info['locality'] and 'administrative_area_level_2' in types:
+            addr_info['locality'] = c.get('long_name', '')
+    return addr_info
@@ -1,125 +1,363 @@
 import pandas as pd
-import requests
-import time
 import argparse
+import os
+import hashlib
 from tqdm import tqdm
 import sys
+import time
+from run_metrics import RunMetrics
+from table_input import read_projected
+from coord_parser import MISSING, parse_coordinate_columns
+from label_templates import BUILTIN_TEMPLATES, TemplateError, get_template
+from geocoding_core import (
+    AimdRateController, Geocoder, ResultCache, SpatialCache, PROVIDERS, FAILURE_COLUMNS, NEAR_ADDRESS_M,
+    NEAR_ELEVATION_M, failure_kind, failure_records, make_provider,
+    format_label_address, format_label_elevation,
+)
 
-# --- Configuration ---
-# API endpoints
-GEOCODING_API_ENDPOINT = "https://maps.googleapis.com/maps/api/geocode/json"
-ELEVATION_API_ENDPOINT = "https://maps.googleapis.com/maps/api/elevation/json"
+# Column added to shard outputs so `merge` can restore the original row order
+ROW_INDEX_COL = '_row'
+# Pause before each end-of-run retry pass over transient failures (seconds)
+RETRY_PASS_DELAYS = (2.0, 10.0)
 
-def get_elevation(lat, lon, api_key):
+def enrich_rows(df, args, metrics):
     """
-    Calls the Google Elevation API to get the altitude or an error message.
+    Looks up address and elevation for every row of df through the shared
+    geocoding core: addresses on a small thread pool, elevations in batched
+    requests. Duplicate coordinates are fetched once and throttled lookups are
+    re-queued after the AIMD controller backs off.
+    Transient failures (network errors, quota exhaustion) get up to
+    args.retries extra passes at the end of the run.
+    Returns (one result dict per row in row order, failure records for rows
+    that still failed; see geocoding_core.failure_records).
     """
-    params = {'locations': f'{lat},{lon}', 'key': api_key}
+    controller = AimdRateController(initial_rate=args.rate, max_rate=args.max_rate, log=tqdm.write)
+    provider = make_provider(args.api_key, args.provider, args.gazetteer)
+    spatial = SpatialCache(args.near_address_m, args.near_elevation_m)
+    geocoder = Geocoder(provider, rate_limiter=controller, cache=ResultCache(), metrics=metrics, spatial=spatial)
+
+    # Decimal / DM / DMS with hemispheres; malformed rows are rejected here, before any API call
+    parsed = parse_coordinate_columns(
+        df.get(args.lat_col, pd.Series([None] * len(df))), df.get(args.lon_col, pd.Series([None] * len(df)))
+    )
+    report_coordinate_problems(parsed)
+    valid = parsed.index[parsed['error'].isna()].tolist()
+    coords = list(zip(parsed['lat'].iloc[valid].tolist(), parsed['lon'].iloc[valid].tolist()))
+    n_unique = len(set(coords))
+
+    def progress(bar):
+        def update(n):
+            bar.update(n)
+            bar.set_postfix(rate=f"{controller.rate:.1f}/s", throttled=controller.throttles)
+        return update
+
+    with metrics.stage('geocoding'), tqdm(total=n_unique, desc="住所取得中") as bar:
+        addresses = geocoder.reverse_geocode_batch(coords, 'ja', workers=args.workers, on_progress=progress(bar))
+    with metrics.stage('elevation'), tqdm(total=n_unique, desc="高度取得中") as bar:
+        elevations = geocoder.elevation_batch(coords, on_progress=progress(bar))
+
+    for attempt, delay in enumerate(RETRY_PASS_DELAYS[:args.retries], start=1):
+        retry_geo = [j for j, r in enumerate(addresses) if failure_kind(r) == 'transient']
+        retry_elev = [j for j, r in enumerate(elevations) if failure_kind(r) == 'transient']
+        if not retry_geo and not retry_elev:
+            break
+        print(f"一時的なエラーを再試行します ({attempt}/{args.retries}): 住所 {len(retry_geo)} 件、高度 {len(retry_elev)} 件")
+        time.sleep(delay)
+        with metrics.stage('retry'):
+            for j, response in zip(retry_geo, geocoder.reverse_geocode_batch(
+                    [coords[j] for j in retry_geo], 'ja', workers=args.workers)):
+                addresses[j] = response
+            for j, response in zip(retry_elev, geocoder.elevation_batch([coords[j] for j in retry_elev])):
+                elevations[j] = response
+        metrics.incr('retry_passes')
+
+    results = [
+        {'api_address': '入力データなし' if error == MISSING else f"座標エラー: {error}", 'api_elevation': ''}
+        for error in parsed['error']
+    ]
+    for i, address, elevation in zip(valid, addresses, elevations):
+        results[i] = {
+            'api_address': format_label_address(address),
+            'api_elevation': format_label_elevation(elevation),
+        }
+
+    failures = failure_records(valid, coords, addresses, elevations)
+
+    metrics.incr('api_throttles', controller.throttles)
+    metrics.incr('rows_failed', len(failures))
+    print(f"最終レート: {controller.rate:.1f} 件/秒 (API呼び出し成功 {controller.successes} 回、クォータ制限 {controller.throttles} 回)")
+    if spatial.avoided['geocode'] or spatial.avoided['elevation']:
+        print(f"近傍キャッシュで省略したAPI呼び出し: 住所 {spatial.avoided['geocode']} 回、高度 {spatial.avoided['elevation']} 地点")
+    return results, failures
+
+def report_coordinate_problems(parsed):
+    """Prints how many rows have malformed or swapped coordinates (first few row numbers)."""
+    malformed = parsed.index[parsed['error'].notna() & (parsed['error'] != MISSING)].tolist()
+    swapped = parsed.index[parsed['swapped']].tolist()
+    if malformed:
+        print(f"座標を解釈できない行: {len(malformed)} 行 (APIは呼び出しません) 例: {malformed[:5]}")
+    if swapped:
+        print(f"緯度と経度が逆と判断して入れ替えた行: {len(swapped)} 行 例: {swapped[:5]}")
+
+# --- Failed rows (dead-letter file) ---
+
+def dead_letter_path(output_csv):
+    return os.path.splitext(output_csv)[0] + '_failed.csv'
+
+def write_dead_letter(failures, output_csv):
+    """Writes the failed rows next to the output, or removes a stale file when there are none."""
+    path = dead_letter_path(output_csv)
+    if not failures:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    pd.DataFrame(failures, columns=FAILURE_COLUMNS).to_csv(path, index=False, encoding='utf-8-sig')
+    n_transient = sum(1 for f in failures if f['kind'] == 'transient')
+    print(f"取得に失敗した {len(failures)} 行 (一時的 {n_transient} 行、恒久的 {len(failures) - n_transient} 行) を '{path}' に保存しました。")
+    print("  --retry-failed を付けて再実行すると、これらの行だけを再取得して出力ファイルを更新します。")
+
+def retry_failed(args, metrics):
+    """
+    --retry-failed: re-enriches only the rows listed in the dead-letter file and
+    patches their api_address / api_elevation / label into the existing output.
+    """
+    path = dead_letter_path(args.output_csv)
+    if not os.path.exists(path):
+        print(f"'{path}' がありません。再取得する行はありません。")
+        return
+    with metrics.stage('read_input'):
+        output = pd.read_csv(args.output_csv, encoding='utf-8-sig')
+        rows = pd.read_csv(path, encoding='utf-8-sig')['row'].tolist()
+    print(f"{len(rows)} 行を再取得します。")
+    metrics.incr('rows', len(rows))
+
+    subset = output.iloc[rows].reset_index(drop=True)
+    with metrics.stage('enrich'):
+        results, failures = enrich_rows(subset, args, metrics)
+
+    # Error messages may have left api_elevation numeric-only; allow mixed values
+    output['api_elevation'] = output['api_elevation'].astype(object)
+    template, columns = label_template(args)
+    with metrics.stage('format_labels'):
+        for row, result in zip(rows, results):
+            output.loc[row, ['api_address', 'api_elevation']] = [result['api_address'], result['api_elevation']]
+            output.loc[row, 'label'] = template.render(output.loc[row], columns)
+    for failure in failures:
+        failure['row'] = rows[failure['row']]
+
+    with metrics.stage('write_output'):
+        output.to_csv(args.output_csv, index=False, encoding='utf-8-sig')
+    print(f"{len(rows) - len(failures)} 行を更新しました。結果を '{args.output_csv}' に保存しました。")
+    write_dead_letter(failures, args.output_csv)
+
+def label_template(args):
+    """(compiled --template, field -> column mapping) for this run."""
+    columns = {
+        'address': 'api_address', 'elevation': 'api_elevation',
+        'lat': args.lat_col, 'lon': args.lon_col,
+        'date': args.date_col, 'method': args.method_col, 'collector': args.collector_col,
+    }
+    return get_template(args.template), columns
+
+# --- Sharding (multi-machine batch mode) ---
+
+def parse_shard(value):
+    """Parses '--shard i/N' (1 <= i <= N) into (i, N)."""
     try:
-        response = requests.get(ELEVATION_API_ENDPOINT, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        if data['status'] == 'OK' and len(data['results']) > 0:
-            return int(round(data['results'][0]['elevation'])) # Return as integer
-        else:
-             # Return the specific error message from Google
-             return f"高度APIエラー: {data.get('error_message', data.get('status', 'Unknown Error'))}"
-    except requests.exceptions.RequestException as e:
-        return f"高度APIリクエストエラー: {e}"
+        i, n = (int(x) for x in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"--shard は 'i/N' の形式で指定してください: {value}")
+    if n < 1 or not 1 <= i <= n:
+        raise argparse.ArgumentTypeError(f"--shard の値が不正です (1 <= i <= N): {value}")
+    return i, n
 
-def get_google_address_for_label(lat, lon, api_key):
+def shard_key(lat, lon, row_index):
     """
-    Calls Google Geocoding API and returns the most suitable formatted address or an error message.
+    Deterministic partition key. Rows with coordinates are keyed by the rounded
+    coordinates so duplicate sites land on the same shard (and hit the same
+    cache); rows without coordinates are keyed by their row number.
     """
-    params = {'latlng': f'{lat},{lon}', 'key': api_key, 'language': 'ja'}
+    return coord_key(lat, lon) or f"row:{row_index}"
+
+def coord_key(lat, lon):
+    """Coordinates rounded to 6 decimals as a string, or None if either is missing / not numeric."""
+    if pd.notna(lat) and pd.notna(lon):
+        try:
+            return f"{float(lat):.6f},{float(lon):.6f}"
+        except (TypeError, ValueError):
+            pass
+    return None
+
+def shard_of(key, shard_count):
+    """Maps a key to a 1-based shard number. Uses md5, not hash(), so it is stable across machines."""
+    digest = hashlib.md5(key.encode('utf-8')).hexdigest()
+    return int(digest[:8], 16) % shard_count + 1
+
+def select_shard(df, lat_col, lon_col, shard_index, shard_count):
+    """Returns the rows of df belonging to the given shard, tagged with their original row number."""
+    df = df.reset_index(drop=True)
+    df.insert(0, ROW_INDEX_COL, range(len(df)))
+    lats = df[lat_col] if lat_col in df.columns else pd.Series([None] * len(df))
+    lons = df[lon_col] if lon_col in df.columns else pd.Series([None] * len(df))
+    mask = [
+        shard_of(shard_key(lat, lon, i), shard_count) == shard_index
+        for i, (lat, lon) in enumerate(zip(lats, lons))
+    ]
+    return df[mask].reset_index(drop=True)
+
+# --- Incremental re-enrichment ---
+
+def label_fields(args):
+    """Input columns the label reads besides the coordinates (incl. extra --template fields)."""
+    fields = [args.date_col, args.method_col, args.collector_col]
+    template, columns = label_template(args)
+    return fields + [f for f in template.fields if f not in columns and f not in fields]
+
+def row_fingerprints(df, args):
+    """md5 of each row's coordinates and label fields, i.e. everything that affects its output."""
+    cols = [df[c] if c in df.columns else pd.Series([None] * len(df)) for c in label_fields(args)]
+    lats = df[args.lat_col] if args.lat_col in df.columns else pd.Series([None] * len(df))
+    lons = df[args.lon_col] if args.lon_col in df.columns else pd.Series([None] * len(df))
+    fingerprints = []
+    for lat, lon, *fields in zip(lats, lons, *cols):
+        parts = [coord_key(lat, lon) or ''] + ['' if pd.isna(v) else str(v) for v in fields]
+        fingerprints.append(hashlib.md5('\x1f'.join(parts).encode('utf-8')).hexdigest())
+    return fingerprints
+
+def is_reusable(address, elevation):
+    """True for a previous result that holds a real address and a numeric elevation (not an error message)."""
+    if not isinstance(address, str) or not address or 'エラー' in address or 'Error' in address:
+        return False
     try:
-        response = requests.get(GEOCODING_API_ENDPOINT, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-    except requests.exceptions.RequestException as e:
-        return f"住所APIリクエストエラー: {e}"
-        
-    if data['status'] == 'OK' and len(data['results']) > 0:
-        for result in data['results']:
-            # Skip results that are just plus codes
-            if 'plus_code' in result and result.get('types') == ['plus_code']:
-                continue
-            
-            addr = result.get('formatted_address', '')
-            # Clean up the address
-            if addr.startswith('日本、'):
-                addr = addr.replace('日本、', '', 1)
-            # Remove postal code prefix
-            space_pos = addr.find(' ')
-            if space_pos != -1 and addr[:space_pos].replace('〒', '').replace('-', '').isdigit():
-                return addr[space_pos+1:].strip()
-            return addr.strip()
-            
-    elif data['status'] == 'ZERO_RESULTS':
-        return "エラー: 住所が見つかりません"
-    else:
-        # Return the specific error message from Google
-        return f"住所APIエラー: {data.get('error_message', data.get('status', 'Unknown Error'))}"
-
-def create_label(row, lat_col, lon_col, date_col, method_col, collector_col):
+        float(elevation)
+    except (TypeError, ValueError):
+        return False
+    return pd.notna(elevation)
+
+def load_previous_output(path, args):
     """
-    Creates the final formatted label string from a DataFrame row.
-    Handles potential error messages in address or elevation.
+    Reads a previous output CSV. Returns (fingerprint counts, {coord_key: result})
+    where result is an api_address / api_elevation dict for successfully enriched sites.
     """
-    # Extract data from the row
-    date = row.get(date_col, '')
-    method = row.get(method_col, '')
-    collector = row.get(collector_col, '')
-    
-    # --- FIX ---
-    # Use the new, unique column names from the API results
-    full_address = row.get('api_address', '') 
-    elevation_val = row.get('api_elevation', '') 
-    # --- END FIX ---
-
-    lat = row.get(lat_col, '')
-    lon = row.get(lon_col, '')
-    
-    # Format elevation
-    elevation_str = ""
-    if isinstance(elevation_val, (int, float)):
-        elevation_str = f"GPS({elevation_val}m)"
-    elif pd.notna(elevation_val) and str(elevation_val) != '':
-        # If elevation_val is an error message, display it
-        elevation_str = f"GPS(エラー: {elevation_val})"
-    else:
-        elevation_str = "GPS(高度取得失敗)"
-
-    # Format address
-    if not full_address or 'エラー' in str(full_address) or 'Error' in str(full_address):
-        address_str = f"住所取得エラー: {full_address}"
-    else:
-        address_str = f"JAPAN: {full_address}"
-
-    # Build the label string line by line
-    label = f"{address_str}\n"
-    label += f"{elevation_str}\n"
-    
-    line3_parts = []
-    # Ensure all parts are strings before joining
-    if pd.notna(date) and date != '': line3_parts.append(str(date))
-    if pd.notna(method) and method != '': line3_parts.append(str(method))
-    if pd.notna(collector) and collector != '': line3_parts.append(str(collector))
-    
-    if line3_parts:
-        label += ". ".join(line3_parts)
-        if not label.endswith('.'):
-             label += "."
-    
-    label += f"\nN{lat}, E{lon}"
-    
-    return label
+    prev = pd.read_csv(path, encoding='utf-8-sig')
+    for col in ('api_address', 'api_elevation'):
+        if col not in prev.columns:
+            raise ValueError(f"'{path}' はこのツールの出力ファイルではありません ({col} 列がありません)。")
+
+    fingerprints = {}
+    for fp in row_fingerprints(prev, args):
+        fingerprints[fp] = fingerprints.get(fp, 0) + 1
+
+    results = {}
+    lats = prev.get(args.lat_col, pd.Series([None] * len(prev)))
+    lons = prev.get(args.lon_col, pd.Series([None] * len(prev)))
+    for lat, lon, address, elevation in zip(lats, lons, prev['api_address'], prev['api_elevation']):
+        key = coord_key(lat, lon)
+        if key and key not in results and is_reusable(address, elevation):
+            results[key] = {'api_address': address, 'api_elevation': int(round(float(elevation)))}
+    return fingerprints, results
+
+def enrich_incremental(df, args, metrics, previous, changes_path):
+    """
+    Like enrich_rows (same return value), but reuses the previous output: rows whose coordinates were
+    already enriched successfully take the stored address / elevation, and only
+    the remaining rows go to the API. Writes a per-row change summary CSV.
+    """
+    prev_fingerprints, prev_results = previous
+    fingerprints = row_fingerprints(df, args)
+    lats = df.get(args.lat_col, pd.Series([None] * len(df)))
+    lons = df.get(args.lon_col, pd.Series([None] * len(df)))
+
+    results = [None] * len(df)
+    changes = []
+    remaining = dict(prev_fingerprints)
+    for i, (fp, lat, lon) in enumerate(zip(fingerprints, lats, lons)):
+        if remaining.get(fp):
+            remaining[fp] -= 1
+            change = 'unchanged'
+        else:
+            change = 'new_or_changed'
+        reused = prev_results.get(coord_key(lat, lon))
+        if reused is not None:
+            results[i] = dict(reused)
+            changes.append((change, 'reused'))
+        else:
+            changes.append((change, 'enriched'))
+
+    todo = [i for i, r in enumerate(results) if r is None]
+    failures = []
+    if todo:
+        fresh, failures = enrich_rows(df.iloc[todo].reset_index(drop=True), args, metrics)
+        for i, result in zip(todo, fresh):
+            results[i] = result
+        for failure in failures:
+            failure['row'] = todo[failure['row']]
+
+    n_unchanged = sum(1 for change, _ in changes if change == 'unchanged')
+    n_removed = sum(remaining.values())
+    metrics.incr('rows_reused', len(df) - len(todo))
+    metrics.incr('rows_enriched', len(todo))
+    print(f"差分処理: 変更なし {n_unchanged} 行、追加・変更 {len(df) - n_unchanged} 行、前回から削除 {n_removed} 行")
+    print(f"  前回の結果を再利用 {len(df) - len(todo)} 行、APIで取得 {len(todo)} 行")
+
+    row_ids = df[ROW_INDEX_COL] if ROW_INDEX_COL in df.columns else range(len(df))
+    pd.DataFrame(
+        [(row, change, source) for row, (change, source) in zip(row_ids, changes)],
+        columns=['row', 'change', 'source']
+    ).to_csv(changes_path, index=False, encoding='utf-8-sig')
+    print(f"変更内容を '{changes_path}' に保存しました。")
+    return results, failures
+
+def merge_shards(shard_paths, output_path):
+    """Concatenates shard outputs and restores the original row order."""
+    parts = []
+    for path in shard_paths:
+        part = pd.read_csv(path, encoding='utf-8-sig')
+        if ROW_INDEX_COL not in part.columns:
+            raise ValueError(f"'{path}' は --shard で生成されたファイルではありません ({ROW_INDEX_COL} 列がありません)。")
+        parts.append(part)
+
+    merged = pd.concat(parts, ignore_index=True)
+    duplicated = merged[ROW_INDEX_COL].duplicated()
+    if duplicated.any():
+        raise ValueError(f"同じ行が複数のシャードに含まれています ({int(duplicated.sum())} 行)。")
+
+    merged = merged.sort_values(ROW_INDEX_COL, kind='stable')
+    expected = set(range(int(merged[ROW_INDEX_COL].max()) + 1)) if len(merged) else set()
+    missing = expected - set(merged[ROW_INDEX_COL])
+    if missing:
+        print(f"警告: {len(missing)} 行が見つかりません (シャードが不足している可能性があります)。")
+
+    merged.drop(columns=[ROW_INDEX_COL]).to_csv(output_path, index=False, encoding='utf-8-sig')
+    return len(merged)
+
+def merge_main(argv):
+    """ Entry point for the `merge` subcommand. """
+    parser = argparse.ArgumentParser(
+        prog='label_app.py merge',
+        description='--shard で分割処理した出力CSVを結合し、元の行順に並べ直します。'
+    )
+    parser.add_argument('shard_csvs', nargs='+', help='各シャードの出力CSVファイル。')
+    parser.add_argument('-o', '--output', required=True, help='結合後の出力CSVファイルのパス。')
+    args = parser.parse_args(argv)
+
+    try:
+        n_rows = merge_shards(args.shard_csvs, args.output)
+    except (OSError, ValueError) as e:
+        print(f"結合エラー: {e}")
+        sys.exit(1)
+    print(f"{len(args.shard_csvs)} 個のシャード ({n_rows} 行) を '{args.output}' に結合しました。")
 
 def main():
     """ Main function to run the script. """
+    if len(sys.argv) > 1 and sys.argv[1] == 'merge':
+        merge_main(sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser(description='CSVファイル内の緯度経度から住所と高度を取得し、最終的なラベル形式の文字列を生成します。')
     parser.add_argument('api_key', help='Google Maps APIキー (Geocoding APIとElevation APIが有効であること)。')
-    parser.add_argument('input_csv', help='入力CSVファイルのパス。')
+    parser.add_argument('input_csv', nargs='?',
+                        help='入力ファイル (.csv / .xlsx) のパス。解析結果は <入力ファイル名>.parquet にキャッシュされます (--retry-failed では省略できます)。')
     # --- MODIFICATION ---
     parser.add_argument('output_csv', help='ラベル情報を追加した出力CSVファイル (.csv) のパス。')
     # --- END MODIFICATION ---
@@ -128,64 +366,137 @@ def main():
     parser.add_argument('--date_col', default='採集年月日', help='日付が含まれる列の名前 (デフォルト: 採集年月日)。')
     parser.add_argument('--method_col', default='採集方法', help='採集方法が含まれる列の名前 (デフォルト: 採集方法)。')
     parser.add_argument('--collector_col', default='採集者名', help='採集者名が含まれる列の名前 (デフォルト: 採集者名)。')
+    parser.add_argument('--shard', type=parse_shard, metavar='i/N',
+                        help='入力をN分割し、i番目 (1始まり) だけを処理します。出力は `merge` サブコマンドで結合します。')
+    parser.add_argument('--rate', type=float, default=10.0, help='開始時のAPIリクエストレート (件/秒、デフォルト: 10)。成功時は徐々に上げ、クォータ制限時は半減します。')
+    parser.add_argument('--max_rate', type=float, default=50.0, help='APIリクエストレートの上限 (件/秒、デフォルト: 50)。')
+    parser.add_argument('--workers', type=int, default=4, help='同時に処理する行数 (デフォルト: 4)。')
+    parser.add_argument('--provider', choices=list(PROVIDERS), default=None,
+                        help='住所・高度の取得元 (google / gazetteer / mock、デフォルト: 環境変数 GEOCODING_PROVIDER または google)。')
+    parser.add_argument('--gazetteer', help='--provider gazetteer で使用する地名辞書CSVのパス。')
+    parser.add_argument('--incremental', nargs='?', const=True, metavar='PREVIOUS_CSV',
+                        help='前回の出力CSV (省略時は output_csv) を読み込み、座標が同じ行は前回の住所・高度を再利用して、新しい行・変更された行だけをAPIで取得します。')
+    parser.add_argument('--near_address_m', type=float, default=NEAR_ADDRESS_M,
+                        help=f'この距離 (m) 以内で取得済みの地点があれば、その住所を再利用します (デフォルト: {NEAR_ADDRESS_M:g}、0で無効)。')
+    parser.add_argument('--near_elevation_m', type=float, default=NEAR_ELEVATION_M,
+                        help=f'この距離 (m) 以内で取得済みの地点があれば、その高度を再利用します (デフォルト: {NEAR_ELEVATION_M:g}、0で無効)。')
+    parser.add_argument('--retries', type=int, default=len(RETRY_PASS_DELAYS), choices=range(len(RETRY_PASS_DELAYS) + 1),
+                        help=f'一時的なエラー (通信エラー・クォータ制限) の行を処理の最後に再試行する回数 (デフォルト: {len(RETRY_PASS_DELAYS)})。')
+    parser.add_argument('--retry-failed', dest='retry_failed', action='store_true',
+                        help='前回の実行で <出力ファイル名>_failed.csv に記録された行だけを再取得し、出力ファイルを更新します (入力ファイルは読み込みません)。')
+    parser.add_argument('--template', default='cli',
+                        help=f'ラベルの書式。組み込みの書式名 ({" / ".join(BUILTIN_TEMPLATES)}) またはテンプレートファイルのパス (デフォルト: cli)。')
+    parser.add_argument('--metrics_json', help='処理時間・APIレイテンシの集計JSONの出力先 (デフォルト: <出力ファイル名>_metrics.json)。')
+    parser.add_argument('--prometheus', help='Prometheus textfile 形式のメトリクス出力先 (任意)。')
     
     args = parser.parse_args()
+    if args.input_csv is None and not args.retry_failed:
+        parser.error('input_csv が必要です (--retry-failed のときだけ省略できます)。')
+    try:
+        label_template(args)
+    except (OSError, TemplateError) as e:
+        print(f"ラベル書式のエラー: {e}")
+        sys.exit(1)
+
+    metrics = RunMetrics()
+
+    if args.retry_failed:
+        try:
+            retry_failed(args, metrics)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"再取得エラー: {e}")
+            sys.exit(1)
+        write_metrics(metrics, args)
+        return
 
     print(f"入力ファイル: {args.input_csv}")
     try:
-        df = pd.read_csv(args.input_csv)
+        # Only the mapped columns are needed for enrichment; the rest are passed through at the end
+        mapped = [args.lat_col, args.lon_col] + label_fields(args)
+        with metrics.stage('read_input'):
+            df, load_source = read_projected(args.input_csv, mapped)
     except FileNotFoundError:
         print(f"エラー: 入力ファイル '{args.input_csv}' が見つかりません。")
         sys.exit(1)
     except Exception as e:
         print(f"入力ファイルの読み込みエラー: {e}")
         sys.exit(1)
+
+    if args.shard:
+        shard_index, shard_count = args.shard
+        total_rows = len(df)
+        df = select_shard(df, args.lat_col, args.lon_col, shard_index, shard_count)
+        print(f"シャード {shard_index}/{shard_count}: {len(df)} / {total_rows} 行を処理します。")
         
-    temp_results = []
-    for index, row in tqdm(df.iterrows(), total=df.shape[0], desc="ジオコーディング処理中"):
-        lat = row.get(args.lat_col)
-        lon = row.get(args.lon_col)
-        
-        result = {}
-        if pd.notna(lat) and pd.notna(lon):
-            address = get_google_address_for_label(lat, lon, args.api_key)
-            elevation = get_elevation(lat, lon, args.api_key)
-            
-            # --- FIX ---
-            # Use new, unique column names to avoid conflict
-            result['api_address'] = address
-            result['api_elevation'] = elevation
-            # --- END FIX ---
+    df = df.reset_index(drop=True)
+    # Results use the unique column names api_address / api_elevation to avoid conflicts
+    metrics.incr('rows', len(df))
+    previous = None
+    if args.incremental:
+        previous_csv = args.output_csv if args.incremental is True else args.incremental
+        if os.path.exists(previous_csv):
+            try:
+                with metrics.stage('read_previous'):
+                    previous = load_previous_output(previous_csv, args)
+            except (OSError, ValueError) as e:
+                print(f"前回の出力の読み込みエラー: {e}")
+                sys.exit(1)
+            print(f"前回の出力: {previous_csv} ({len(previous[1])} 地点を再利用可能)")
         else:
-            result['api_address'] = '入力データなし'
-            result['api_elevation'] = ''
-            
-        temp_results.append(result)
-        time.sleep(0.05) # Rate limiting
+            print(f"前回の出力 '{previous_csv}' が見つからないため、すべての行を処理します。")
 
-    results_df = pd.DataFrame(temp_results)
+    with metrics.stage('enrich'):
+        if previous is not None:
+            changes_path = os.path.splitext(args.output_csv)[0] + '_changes.csv'
+            temp_results, failures = enrich_incremental(df, args, metrics, previous, changes_path)
+        else:
+            temp_results, failures = enrich_rows(df, args, metrics)
+
+    results_df = pd.DataFrame(temp_results, columns=['api_address', 'api_elevation'])
     
     # Combine original data with new API data
     df_combined = pd.concat([df.reset_index(drop=True), results_df], axis=1)
 
     # Generate the final label column
-    df_combined['label'] = df_combined.apply(
-        lambda row: create_label(
-            row, args.lat_col, args.lon_col, args.date_col, 
-            args.method_col, args.collector_col
-        ),
-        axis=1
-    )
+    # Compiled template over whole columns (no per-row Series)
+    template, columns = label_template(args)
+    with metrics.stage('format_labels'):
+        df_combined['label'] = template.render_frame(df_combined, columns)
     
+    # Pass the original columns through (from the first parse, or the Parquet sidecar)
+    with metrics.stage('read_input'):
+        passthrough = load_source().reset_index(drop=True)
+    if ROW_INDEX_COL in df.columns:
+        rows = df[ROW_INDEX_COL].to_numpy()
+        passthrough = passthrough.iloc[rows].reset_index(drop=True)
+        passthrough.insert(0, ROW_INDEX_COL, rows)
+    df_combined = pd.concat([passthrough, df_combined[['api_address', 'api_elevation', 'label']]], axis=1)
+
     # --- MODIFICATION: Output to CSV ---
     try:
         # Save to CSV with UTF-8-SIG encoding for Excel compatibility
-        df_combined.to_csv(args.output_csv, index=False, encoding='utf-8-sig')
+        with metrics.stage('write_output'):
+            df_combined.to_csv(args.output_csv, index=False, encoding='utf-8-sig')
         print(f"処理が完了しました。結果を '{args.output_csv}' に保存しました。")
+        write_dead_letter(failures, args.output_csv)
     except Exception as e:
         print(f"\nCSVファイルへの書き出し中にエラーが発生しました: {e}")
     # --- END MODIFICATION ---
 
+    write_metrics(metrics, args)
+
+def write_metrics(metrics, args):
+    """Prints the stage summary and writes the JSON (and optional Prometheus) metrics files."""
+    print(metrics.format_report())
+    metrics_json = args.metrics_json or os.path.splitext(args.output_csv)[0] + '_metrics.json'
+    try:
+        metrics.write_json(metrics_json)
+        print(f"メトリクスを '{metrics_json}' に保存しました。")
+        if args.prometheus:
+            metrics.write_prometheus(args.prometheus)
+    except OSError as e:
+        print(f"メトリクスの書き出し中にエラーが発生しました: {e}")
+
 if __name__ == '__main__':
     main()
 
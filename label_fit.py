@@ -0,0 +1,206 @@
+"""
+Fit checking for printed labels: does every line of every label fit the width
+of its DOCX table cell at the configured font, size and character spacing?
+
+Glyph advances come from the font file for font_name (found in the usual font
+folders; Liberation fonts stand in for Arial / Times New Roman) and are read
+through Pillow once per glyph, then cached per font. Widths for a whole queue
+are computed in one pass: all text is turned into a codepoint array, advances
+are looked up for the distinct characters only, and line sums come from a
+cumulative sum. Kerning is ignored, so results are slightly conservative.
+
+Without Pillow or a matching font file, Pillow's bundled font or a simple
+per-character estimate is used, and FontMetrics.source says so.
+"""
+import functools
+import os
+import unicodedata
+import numpy as np
+
+try:
+    from PIL import ImageFont
+except ImportError:  # Estimated metrics only
+    ImageFont = None
+
+# Must match create_docx: A4 width minus 0.2in margins, zero cell margins
+PAGE_WIDTH_IN = 8.27
+SIDE_MARGINS_IN = 0.4
+MIN_FONT_SIZE = 3.0
+# Bold headers are measured with the regular font, widened by this factor
+BOLD_WIDTH_FACTOR = 1.07
+# Size at which advances are measured; results are in ems
+_MEASURE_SIZE = 1000
+
+FONT_DIRS = [
+    os.path.expanduser('~/Library/Fonts'), '/Library/Fonts', '/System/Library/Fonts',
+    '/System/Library/Fonts/Supplemental', '/usr/share/fonts', '/usr/local/share/fonts',
+    os.path.expanduser('~/.fonts'), os.path.expanduser('~/.local/share/fonts'),
+    os.path.join(os.environ.get('WINDIR', 'C:\\Windows'), 'Fonts'),
+]
+
+# font_name -> file name stems to try (lowercase, without spaces, hyphens or underscores)
+FONT_FILES = {
+    'Arial': ['arial', 'arialmt', 'liberationsansregular', 'liberationsans', 'arimoregular'],
+    'Times New Roman': ['timesnewroman', 'times', 'liberationserifregular', 'liberationserif', 'tinosregular'],
+    'PT Sans Narrow': ['ptsansnarrow', 'ptsansnarrowregular', 'ptn57f'],
+    'Seravek': ['seravek'],
+    'Hiragino Sans': ['hiraginosansw3', 'ヒラギノ角ゴシックw3', 'hiraginosansgbw3'],
+}
+
+def _stem_key(name):
+    return os.path.splitext(name)[0].lower().replace(' ', '').replace('-', '').replace('_', '')
+
+@functools.lru_cache(maxsize=1)
+def _font_index():
+    """{normalised file stem: path} of every font file in FONT_DIRS."""
+    index = {}
+    for root_dir in FONT_DIRS:
+        for root, _, files in os.walk(root_dir):
+            for name in files:
+                if name.lower().endswith(('.ttf', '.otf', '.ttc')):
+                    index.setdefault(_stem_key(name), os.path.join(root, name))
+    return index
+
+def find_font_file(font_name):
+    """Path of the font file for font_name, or None."""
+    index = _font_index()
+    for stem in FONT_FILES.get(font_name, []) + [_stem_key(font_name)]:
+        if stem in index:
+            return index[stem]
+    return None
+
+def _estimated_advance(ch):
+    if ch == ' ':
+        return 0.28
+    return 1.0 if unicodedata.east_asian_width(ch) in ('W', 'F') else 0.55
+
+class FontMetrics:
+    """
+    Per-glyph advances (in ems) for one font. Looked-up advances are kept in a
+    dense array indexed by codepoint, so measuring text is a single gather.
+    """
+
+    def __init__(self, font_name):
+        self.font_name = font_name
+        self._font = None
+        self._bundled = False
+        self.source = 'estimate'
+        if ImageFont is not None:
+            path = find_font_file(font_name)
+            try:
+                if path:
+                    self._font = ImageFont.truetype(path, _MEASURE_SIZE)
+                    self.source = path
+                else:
+                    self._font = ImageFont.load_default(_MEASURE_SIZE)
+                    self._bundled = True
+                    self.source = 'Pillow default font'
+            except (OSError, AttributeError, TypeError):
+                self._font = None  # Old Pillow without a scalable default font
+        self._table = np.full(128, np.nan)
+
+    @classmethod
+    @functools.lru_cache(maxsize=16)
+    def get(cls, font_name):
+        """Shared metrics for font_name (loaded once per process)."""
+        return cls(font_name)
+
+    def _measure(self, ch):
+        if ch in '\n\r':
+            return 0.0
+        # Pillow's bundled font has no CJK glyphs; estimate those instead
+        if self._font is not None and not (self._bundled and unicodedata.east_asian_width(ch) in ('W', 'F')):
+            return self._font.getlength(ch) / _MEASURE_SIZE
+        return _estimated_advance(ch)
+
+    def advances(self, codepoints):
+        """Advance in ems of each codepoint (uint32 array); newlines are 0."""
+        if not len(codepoints):
+            return np.zeros(0)
+        top = int(codepoints.max()) + 1
+        if top > len(self._table):
+            grown = np.full(max(top, 2 * len(self._table)), np.nan)
+            grown[:len(self._table)] = self._table
+            self._table = grown
+        widths = self._table[codepoints]
+        unknown = np.isnan(widths)
+        if unknown.any():
+            for c in np.unique(codepoints[unknown]):
+                self._table[c] = self._measure(chr(c))
+            widths = self._table[codepoints]
+        return widths
+
+def cell_width_pt(num_columns):
+    """Usable width of one label cell in create_docx, in points."""
+    return (PAGE_WIDTH_IN - SIDE_MARGINS_IN) * 72 / num_columns
+
+def item_text(item):
+    """(printed text of a queue item, number of leading characters set in bold)."""
+    ctype = item.get('type', 'text')
+    if ctype == 'data_v2':
+        header = str(item.get('header', ''))
+        return f"{header}\n{item.get('body', '')}", len(header)
+    if ctype == 'rich':
+        return ''.join(seg for seg, _ in item['content']), 0
+    content = item['content'] if 'content' in item else item.get('text', '')
+    return str(content), 0
+
+def check_fit(queue, font_name, font_size, num_columns, char_spacing=0.0):
+    """
+    Measures every queue item against the cell width. Returns one dict per
+    item: index, width (widest line, pt), cell (pt), overflow (bool) and
+    fit_size (largest font size, in 0.5pt steps, at which it fits; None if
+    even MIN_FONT_SIZE is too large). An item's own 'font_size' takes
+    precedence over font_size.
+    """
+    if not queue:
+        return []
+    cell = cell_width_pt(num_columns)
+    texts, bold_len = zip(*(item_text(item) for item in queue))
+    n = len(queue)
+    # All items in one string, one '\n' after each: every item owns >= 1 line
+    full = '\n'.join(texts) + '\n'
+    codepoints = np.frombuffer(full.encode('utf-32-le'), dtype=np.uint32)
+    item_end = np.cumsum(np.fromiter(map(len, texts), dtype=np.int64, count=n) + 1) - 1
+
+    # Per character: advances only; everything else is per line
+    cum_ems = np.concatenate(([0.0], np.cumsum(FontMetrics.get(font_name).advances(codepoints))))
+    line_end = np.flatnonzero(codepoints == 10)
+    line_start = np.concatenate(([0], line_end[:-1] + 1))
+    line_chars = line_end - line_start
+    line_owner = np.searchsorted(item_end, line_end)
+    first_line = np.searchsorted(line_owner, np.arange(n))
+    item_start = item_end - np.diff(np.concatenate(([-1], item_end))) + 1
+    bold = (line_start - item_start[line_owner]) < np.asarray(bold_len)[line_owner]
+    line_ems = (cum_ems[line_end] - cum_ems[line_start]) * np.where(bold, BOLD_WIDTH_FACTOR, 1.0)
+
+    sizes = np.array([item.get('font_size', font_size) for item in queue], dtype=float)
+    widths = line_ems * sizes[line_owner] + line_chars * char_spacing
+    widest = np.maximum.reduceat(widths, first_line)
+    overflow = widest > cell
+    # Largest size at which a line fits: (cell - spacing) / ems
+    with np.errstate(divide='ignore', invalid='ignore'):
+        line_fit = np.where(line_ems > 0, (cell - line_chars * char_spacing) / line_ems, np.inf)
+    fit = np.floor(np.minimum(np.minimum.reduceat(line_fit, first_line), sizes) * 2) / 2
+
+    cell = round(cell, 1)
+    return [
+        {'index': i, 'width': w, 'cell': cell, 'overflow': o, 'fit_size': f if f >= MIN_FONT_SIZE else None}
+        for i, (w, o, f) in enumerate(zip(np.round(widest, 1).tolist(), overflow.tolist(), fit.tolist()))
+    ]
+
+def shrink_to_fit(queue, font_name, font_size, num_columns, char_spacing=0.0):
+    """
+    Lowers 'font_size' on overflowing items to the largest size that fits.
+    Returns (items shrunk, items that cannot fit even at MIN_FONT_SIZE).
+    """
+    shrunk = unfit = 0
+    for result in check_fit(queue, font_name, font_size, num_columns, char_spacing):
+        if not result['overflow']:
+            continue
+        if result['fit_size'] is None:
+            unfit += 1
+            continue
+        queue[result['index']]['font_size'] = result['fit_size']
+        shrunk += 1
+    return shrunk, unfit
@@ -1,138 +1,78 @@
 import streamlit as st
 from streamlit_folium import st_folium
 import folium
-import requests
+from folium.plugins import FastMarkerCluster
 import pandas as pd
 import datetime
-from docx import Document
-from docx.shared import Pt, Inches, RGBColor
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.oxml.ns import qn
-from docx.oxml import OxmlElement
-import io
+from label_render import generate_label_body_v2, generate_html_sheet
+from docx_stream import write_docx
+from docx_batch import split_queue, write_docx_zip
+from queue_index import QueueIndex, compact_queue
+from queue_search import QueueSearchIndex
+from queue_store import QueueStore, new_queue_id, valid_queue_id
+from rerun_profiler import RerunProfiler
+from regions import REGION_COLORS, RegionIndex, assign_region_colors
+from coord_parser import parse_coordinate_text
+from label_fit import MIN_FONT_SIZE, check_fit, shrink_to_fit
+from geocoding_core import Geocoder, ResultCache, SpatialCache, address_struct, elevation_value, failure_kind, make_provider
 import re
 import json
 import os
+import tempfile
 
-# --- Auto-Save / Auto-Load ---
+# --- Auto-Save / Auto-Load (one stored queue per browser session, see queue_store.py) ---
 AUTOSAVE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+QUEUE_DIR = os.path.join(AUTOSAVE_DIR, "queues")
+# Shared autosave of older versions; the first session to load adopts it
 AUTOSAVE_PATH = os.path.join(AUTOSAVE_DIR, "queue_autosave.json")
+# Rows per page of the queue summary table
+SUMMARY_PAGE_SIZE = 50
+
+@st.cache_resource
+def get_queue_store():
+    """Queue store shared by all sessions of this server process (its locks must be shared)."""
+    return QueueStore(QUEUE_DIR, legacy_path=AUTOSAVE_PATH)
+
+def session_queue_id():
+    """
+    Id of this session's stored queue. Kept in the URL (?queue=...) so a
+    reload or bookmark returns to the same queue.
+    """
+    if 'queue_id' not in st.session_state:
+        queue_id = st.query_params.get('queue')
+        st.session_state.queue_id = queue_id if valid_queue_id(queue_id) else new_queue_id()
+    if st.query_params.get('queue') != st.session_state.queue_id:
+        st.query_params['queue'] = st.session_state.queue_id
+    return st.session_state.queue_id
 
 def auto_save_queue():
-    """Saves the current label_queue to a local JSON file."""
+    """Saves the current label_queue to this session's queue file."""
     try:
-        os.makedirs(AUTOSAVE_DIR, exist_ok=True)
-        with open(AUTOSAVE_PATH, 'w', encoding='utf-8') as f:
-            json.dump(st.session_state.label_queue, f, ensure_ascii=False, indent=2)
+        get_queue_store().save(session_queue_id(), st.session_state.label_queue)
     except Exception:
         pass  # Fail silently to avoid disrupting the UI
 
 def auto_load_queue():
-    """Loads the label_queue from a local JSON file if it exists."""
+    """Loads this session's label_queue if it was saved before."""
     try:
-        if os.path.exists(AUTOSAVE_PATH):
-            with open(AUTOSAVE_PATH, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                if isinstance(data, list):
-                    return data
+        return get_queue_store().load(session_queue_id())
     except Exception:
-        pass
-    return []
-
-# --- Constants ---
-# Region Color Mapping
-REGION_COLORS = {
-    "Palearctic (White)": "#FFFFFF",
-    "Oriental (Yellow)": "#FFFF00",
-    "Wallacea/Melanesia (Orange)": "#FFA500",
-    "Australian (Red)": "#FF0000",
-    "NZ/Pacific (Brown)": "#964B00",
-    "Nearctic (Green)": "#008000",
-    "Neotropical (Yellow-Green)": "#9ACD32",
-    "Ethiopian (Blue)": "#0000FF",
-    "Madagascar (Purple)": "#800080"
-}
-
-def generate_html_sheet(queue, num_columns, font_name, font_size, label_color):
-    """Generates an HTML representation of the full A4 sheet."""
-    
-    # CSS for A4 Sheet and Grid
-    # A4 is 210mm x 297mm.
-    # Grid columns = num_columns.
-    
-    css = f"""
-    <style>
-        @page {{ size: A4; margin: 0; }}
-        .sheet {{
-            width: 210mm;
-            min-height: 297mm;
-            padding: 5mm; /* Margins */
-            box-sizing: border-box;
-            background: white;
-            border: 1px solid #eee;
-            margin: 0 auto;
-            display: grid;
-            grid-template-columns: repeat({num_columns}, 1fr);
-            grid-auto-rows: min-content;
-            font-family: "{font_name}", Arial, sans-serif;
-        }}
-        .cell {{
-            border: 1px dotted #CCCCCC; /* Dotted Gray */
-            padding: 1px;
-            box-sizing: border-box;
-            overflow: hidden;
-            font-size: {font_size}pt;
-            line-height: 1.1;
-        }}
-        .header {{ font-weight: bold; }}
-        .bar {{ height: 2px; margin: 1px 0; }}
-        .body {{ white-space: pre-wrap; }}
-    </style>
-    """
-    
-    # Build Cells
-    cells_html = ""
-    
-    # Flatten items
-    all_items = []
-    for item in queue:
-        for _ in range(item['quantity']):
-            all_items.append(item)
-            
-    for item in all_items:
-        ctype = item.get('type', 'text')
-        content_html = ""
-        
-        if ctype == 'data_v2':
-            # Use item color or default
-            i_color = item.get('color', '#000000')
-            content_html = f"""
-                <div class="header">{item['header']}</div>
-                <div class="bar" style="background-color: {i_color};"></div>
-                <div class="body">{item['body']}</div>
-            """
-        elif ctype == 'rich':
-            # Simplified rich text render for preview
-            # (In a real full implementation, we'd parse the list of tuples)
-            preview_txt = item['preview']
-            content_html = f"<div>{preview_txt}</div>"
-        else:
-             content_html = f"<div>{str(item.get('content', ''))}</div>"
-             
-        cells_html += f'<div class="cell">{content_html}</div>'
-
-    html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>{css}</head>
-    <body>
-        <div class="sheet">
-            {cells_html}
-        </div>
-    </body>
-    </html>
-    """
-    return html
+        return []
+
+def get_search_index():
+    """Search index of st.session_state.label_queue, brought up to date with the queue."""
+    if 'search_index' not in st.session_state:
+        st.session_state.search_index = QueueSearchIndex()
+    st.session_state.search_index.sync(st.session_state.label_queue)
+    return st.session_state.search_index
+
+def get_queue_index():
+    """Content index of st.session_state.label_queue (rebuilt when the list is replaced)."""
+    index = st.session_state.get('queue_index')
+    if index is None or index.queue is not st.session_state.label_queue:
+        index = st.session_state.queue_index = QueueIndex(st.session_state.label_queue)
+    return index
+
 
 # Tabs
 tab1, tab2, tab3, tab4 = st.tabs(["🌎 Data Label", "🔍 Identification Label", "🧬 Molecular Label", "📄 Sheet Preview"])
@@ -154,10 +94,6 @@ tab1, tab2, tab3, tab4 = st.tabs(["🌎 Data Label", "🔍 Identification Label"
 
 
 # --- Configuration ---
-# API endpoints
-GEOCODING_API_ENDPOINT = "https://maps.googleapis.com/maps/api/geocode/json"
-ELEVATION_API_ENDPOINT = "https://maps.googleapis.com/maps/api/elevation/json"
-
 # Default API Key (Securely loaded from secrets)
 # When running locally, create .streamlit/secrets.toml
 # When running on Streamlit Cloud, set this in the App Settings
@@ -170,91 +106,26 @@ except KeyError:
 
 
 # --- Helper Functions (Adapted from label_app.py) ---
-def get_elevation(lat, lon, api_key):
-    """Calls the Google Elevation API to get the altitude. Returns None if invalid."""
-    if not api_key: return None
-    params = {'locations': f'{lat},{lon}', 'key': api_key}
-    try:
-        response = requests.get(ELEVATION_API_ENDPOINT, params=params, timeout=10)
-        data = response.json()
-        if data['status'] == 'OK' and len(data['results']) > 0:
-            return int(round(data['results'][0]['elevation']))
-    except:
-        pass
-    return None
-
-def to_roman(n):
-    """Converts 1-12 to Roman numerals."""
-    return ["", "I", "II", "III", "IV", "V", "VI", "VII", "VIII", "IX", "X", "XI", "XII"][n]
-
-def format_coordinates_v2(lat, lon):
-    """Formats coordinates as 35.689°N, 139.691°E"""
-    lat_dir = "N" if lat >= 0 else "S"
-    lon_dir = "E" if lon >= 0 else "W"
-    return f"{abs(lat):.3f}°{lat_dir}, {abs(lon):.3f}°{lon_dir}"
-
-def get_google_address_struct(lat, lon, api_key):
+@st.cache_resource
+def get_geocoder(api_key):
     """
-    Returns a dict with structured address components.
+    One Geocoder per API key and server process (provider chosen by
+    GEOCODING_PROVIDER), so sessions share its HTTP connection pool and
+    result cache.
     """
-    if not api_key: return None
-    params = {'latlng': f'{lat},{lon}', 'key': api_key, 'language': 'en'}
-    try:
-        response = requests.get(GEOCODING_API_ENDPOINT, params=params, timeout=10)
-        data = response.json()
-    except:
-        return None
-        
-    if data['status'] == 'OK' and len(data['results']) > 0:
-        result = data['results'][0]
-        components = result.get('address_components', [])
-        
-        addr_info = {'country': '', 'admin': '', 'locality': ''}
-        
-        for c in components:
-            types = c.get('types', [])
-            if 'country' in types:
-                addr_info['country'] = c.get('short_name', '').upper() # Country Code or Name? User requested CAPS. Short name is usually code (JP). Long name is JAPAN. User style showed MADAGASCAR. Let's use long_name and Upper it.
-                if 'long_name' in c: addr_info['country'] = c.get('long_name', '').upper()
-            if 'administrative_area_level_1' in types:
-                addr_info['admin'] = c.get('long_name', '')
-            if 'locality' in types:
-                addr_info['locality'] = c.get('long_name', '')
-            if not addr_info['locality'] and 'administrative_area_level_2' in types:
-                 addr_info['locality'] = c.get('long_name', '')
-                 
-        return addr_info
-    return None
-
-def generate_label_body_v2(locality, elev, lat, lon, date_obj, collector, method):
-    """Generates the body text (excluding header) for the new style."""
-    
-    # Line 1 (Body): Locality, (alt. XXX m),
-    parts_L1 = []
-    if locality: parts_L1.append(locality)
-    if elev is not None: parts_L1.append(f"(alt. {elev} m)")
-    line1 = ", ".join(parts_L1)
-    if line1 and not line1.endswith(','): line1 += ","
-
-    # Line 2: Coords, Date
-    coords = format_coordinates_v2(lat, lon)
-    # Date: 7-12 II 2018. We have single date. -> 15 II 2023
-    d_str = f"{date_obj.day} {to_roman(date_obj.month)} {date_obj.year}"
-    line2 = f"{coords}, {d_str},"
-    
-    # Line 3: Collector, (Method)
-    line3 = collector
-    if method:
-        # Check if method already hasparens
-        if method.startswith('(') and method.endswith(')'):
-            line3 += f", {method}"
-        else:
-            line3 += f", ({method})"
-            
-    return f"{line1}\n{line2}\n{line3}"
+    return Geocoder(make_provider(api_key), cache=ResultCache(), spatial=SpatialCache())
+
+def fetch_location_info(lat, lon, api_key):
+    """
+    Returns (address struct or None, elevation or None, error) for the auto-fetch.
+    error is set when a lookup failed transiently (network error, quota) and is worth retrying.
+    """
+    geocoder = get_geocoder(api_key)
+    geo = geocoder.reverse_geocode(lat, lon, 'en')
+    elev = geocoder.elevation(lat, lon)
+    transient = [r.get('error_message') or r['status'] for r in (geo, elev) if failure_kind(r) == 'transient']
+    return address_struct(geo), elevation_value(elev), '; '.join(transient) or None
 
-# Keep old helpers for backward compatibility if needed, or replace. 
-# For safety, I'll modify existing calls in the main loop to use these new V2 functions.
 
 # --- Helper Functions (New) ---
 
@@ -265,166 +136,78 @@ def parse_coordinates(coord_string):
     - "35.123, 139.456"
     - "35.123 139.456"
     - "N35.123 E139.456"
+    - "35°39'31\"N 139°44'43\"E", "35 39.5 S, 139 44.7 W"
+    Returns (lat, lon, message); lat/lon are None and message says why when
+    the input is invalid, message notes a lat/lon swap otherwise.
     """
-    coord_string = coord_string.replace(',', ' ').replace('N', '').replace('E', '').replace('n', '').replace('e', '')
-    parts = coord_string.split()
-    if len(parts) >= 2:
-        try:
-            return float(parts[0]), float(parts[1])
-        except ValueError:
-            return None, None
-    return None, None
-
-def set_paragraph_shading(paragraph, color_hex):
-    """Sets the background shading of a paragraph."""
-    val = color_hex.replace("#", "")
-    shd = OxmlElement('w:shd')
-    shd.set(qn('w:val'), 'clear')
-    shd.set(qn('w:color'), 'auto')
-    shd.set(qn('w:fill'), val)
-    paragraph._p.get_or_add_pPr().append(shd)
-
-def set_run_spacing(run, value_pt):
-    """Sets character spacing (kerning/condensing). Value in points."""
-    if value_pt == 0: return
-    val = int(value_pt * 20)
-    rPr = run._r.get_or_add_rPr()
-    spacing = OxmlElement('w:spacing')
-    spacing.set(qn('w:val'), str(val))
-    rPr.append(spacing)
-
-def set_table_properties(table, show_borders=True):
+    result = parse_coordinate_text([coord_string])
+    if result.empty:
+        return None, None, "empty input"
+    row = result.iloc[0]
+    if row['error'] is not None:
+        return None, None, row['error']
+    return float(row['lat']), float(row['lon']), "latitude/longitude swapped" if row['swapped'] else None
+
+def parse_body_coordinates(body):
+    """Extracts (lat, lon) from a data_v2 body line such as '35.689°N, 139.691°E'."""
+    match = re.search(r'([\d.]+)°([NS]),\s*([\d.]+)°([EW])', body or '')
+    if not match:
+        return None, None
+    lat = float(match.group(1)) * (-1 if match.group(2) == 'S' else 1)
+    lon = float(match.group(3)) * (-1 if match.group(4) == 'W' else 1)
+    return lat, lon
+
+def item_coordinates(item):
+    """(lat, lon) of a data_v2 item, or None."""
+    lat, lon = item.get('lat'), item.get('lon')
+    if lat is None or lon is None:
+        # Items saved before lat/lon were stored: recover from the body text
+        lat, lon = parse_body_coordinates(item.get('body', ''))
+    if lat is None or lon is None:
+        return None
+    return lat, lon
+
+def queue_coordinates(queue):
+    """Returns [lat, lon] pairs for all data_v2 items in the queue (one point per item)."""
+    points = []
+    for item in queue:
+        if item.get('type') != 'data_v2':
+            continue
+        coords = item_coordinates(item)
+        if coords is not None:
+            points.append(list(coords))
+    return points
+
+@st.cache_resource
+def get_region_index():
+    """Region polygons (biogeographic_regions.geojson), loaded once per server process."""
+    return RegionIndex.load()
+
+def assign_queue_regions(queue):
+    """Sets region and bar color on every data_v2 item in one batch. Returns (assigned, skipped)."""
+    items = [item for item in queue if item.get('type') == 'data_v2']
+    return assign_region_colors(items, [item_coordinates(item) for item in items], get_region_index())
+
+@st.cache_resource
+def get_base_map(_on_miss=None):
     """
-    Sets custom table properties:
-    1. Borders: Dotted Light Gray (#CCCCCC) if show_borders is True.
-    2. Margins: 0 for max density.
+    Builds the location map once per server process.
+    Only the queue overlay (see build_queue_layer) changes between reruns.
+    _on_miss (not hashed) is called when the map is actually built.
     """
-    tbl = table._tbl
-    tblPr = tbl.tblPr
-    
-    # 1. Borders
-    if show_borders:
-        tblBorders = OxmlElement('w:tblBorders')
-        for border_name in ['top', 'left', 'bottom', 'right', 'insideH', 'insideV']:
-            border = OxmlElement(f'w:{border_name}')
-            border.set(qn('w:val'), 'dotted')
-            border.set(qn('w:sz'), '4') # 1/8 pt, minimal vis
-            border.set(qn('w:space'), '0')
-            border.set(qn('w:color'), 'CCCCCC') # Light Gray
-            tblBorders.append(border)
-        tblPr.append(tblBorders)
-    
-    # 2. Cell Margins (Zero)
-    tblCellMar = OxmlElement('w:tblCellMar')
-    for side in ['top', 'left', 'bottom', 'right']:
-        width = OxmlElement(f'w:{side}')
-        width.set(qn('w:w'), '0')
-        width.set(qn('w:type'), 'dxa')
-        tblCellMar.append(width)
-    tblPr.append(tblCellMar)
-
-def create_docx(label_queue, font_size=4.0, show_borders=True, num_columns=13, font_name='Arial', char_spacing=0.0):
+    if _on_miss: _on_miss()
+    return folium.Map(location=[36.2048, 138.2529], zoom_start=5)
+
+def build_queue_layer(points):
     """
-    Creates a DOCX file from a list of label objects using a Grid Layout (Table).
-    Optimized for insect specimens (small font, efficient cutting).
+    Builds the marker overlay for queued specimen locations.
+    FastMarkerCluster ships the points as a single JS array and clusters them
+    client-side, so it stays responsive with 10k+ markers.
     """
-    doc = Document()
-    
-    # A4 Setup (Narrow margins to maximize printing area)
-    section = doc.sections[0]
-    section.page_width = Inches(8.27)
-    section.page_height = Inches(11.69)
-    section.left_margin = Inches(0.2) 
-    section.right_margin = Inches(0.2)
-    section.top_margin = Inches(0.3)
-    section.bottom_margin = Inches(0.3)
-    
-    # Style
-    style = doc.styles['Normal']
-    font = style.font
-    font.name = font_name
-    font.size = Pt(font_size)
-    paragraph_format = style.paragraph_format
-    paragraph_format.space_after = Pt(0)
-    paragraph_format.line_spacing = 1.0 # Single spacing
-
-    # Flatten queue into individual labels
-    all_labels = []
-    for item in label_queue:
-        for _ in range(item['quantity']):
-            all_labels.append(item) 
-
-    # Create Table
-    COLS = num_columns
-    rows = -(-len(all_labels) // COLS) # Ceiling division
-    
-    if rows > 0:
-        table = doc.add_table(rows=rows, cols=COLS)
-        set_table_properties(table, show_borders)
-    else:
-        return io.BytesIO()
-
-    # Populate Cells
-    for idx, item in enumerate(all_labels):
-        row = idx // COLS
-        col = idx % COLS
-        cell = table.cell(row, col)
-        
-        # Access the first paragraph (default) or add one
-        p = cell.paragraphs[0]
-        p.paragraph_format.space_after = Pt(0) # Tighter packing
-        
-        ctype = item.get('type', 'text')
-        
-        if ctype == 'data_v2':
-            # 1. Header (Bold)
-            run_h = p.add_run(item['header'])
-            run_h.font.name = font_name
-            run_h.font.size = Pt(font_size)
-            run_h.bold = True
-            set_run_spacing(run_h, char_spacing)
-            
-            # 2. Colored Bar
-            p_bar = cell.add_paragraph()
-            p_bar.paragraph_format.space_after = Pt(0)
-            p_bar.paragraph_format.line_spacing = Pt(2) 
-            run_bar = p_bar.add_run(" " * 5)
-            run_bar.font.size = Pt(1.5) 
-            set_paragraph_shading(p_bar, item['color'])
-            
-            # 3. Body
-            p_body = cell.add_paragraph()
-            p_body.paragraph_format.space_after = Pt(0) # Zero spacing
-            run_b = p_body.add_run(item['body'])
-            run_b.font.name = font_name
-            run_b.font.size = Pt(font_size)
-            set_run_spacing(run_b, char_spacing)
-            
-        elif ctype == 'rich':
-            content = item['content']
-            for segment, is_italic in content:
-                run = p.add_run(segment)
-                run.font.name = font_name
-                run.font.size = Pt(font_size)
-                run.italic = is_italic
-                set_run_spacing(run, char_spacing)
-        else:
-            # content is simple string
-            content = item['content'] if 'content' in item else item.get('text', '')
-            run = p.add_run(str(content))
-            run.font.name = font_name
-            run.font.size = Pt(font_size)
-            set_run_spacing(run, char_spacing)
-
-    buffer = io.BytesIO()
-    doc.save(buffer)
-    buffer.seek(0)
-    return buffer
-
-    buffer = io.BytesIO()
-    doc.save(buffer)
-    buffer.seek(0)
-    return buffer
+    layer = folium.FeatureGroup(name="Queued Labels")
+    if points:
+        FastMarkerCluster(points).add_to(layer)
+    return layer
 
 # --- Main App ---
 
@@ -441,8 +224,11 @@ if 'last_fetched_coords' not in st.session_state: st.session_state.last_fetched_
 if 'address_input' not in st.session_state: st.session_state.address_input = ""
 if 'elevation_val' not in st.session_state: st.session_state.elevation_val = None
 
+# Opt-in rerun profiler (toggle in the sidebar "Debug" section)
+profiler = RerunProfiler(st.session_state.get('debug_profiler', False))
+
 # Sidebar for Settings
-with st.sidebar:
+with st.sidebar, profiler.section("Sidebar"):
     st.header("Settings")
     api_key = st.text_input("Google Maps API Key", value=DEFAULT_API_KEY, type="password")
     
@@ -478,10 +264,20 @@ with st.sidebar:
             if item.get('type') == 'data_v2':
                 item['color'] = label_color
                 count += 1
+        get_queue_index().rebuild()
         auto_save_queue()
         st.success(f"Updated color for {count} items.")
         st.rerun()
 
+    # Automatic colors from each label's coordinates (see regions.py)
+    st.checkbox("Auto-assign region color from coordinates", key="auto_region_color",
+                help="New and loaded data labels get the bar color of the region their coordinates fall in.")
+    if st.button("Assign Region Colors to All Queued Items"):
+        assigned, skipped = assign_queue_regions(st.session_state.label_queue)
+        get_queue_index().rebuild()
+        auto_save_queue()
+        st.success(f"Assigned regions to {assigned} items" + (f" ({skipped} without coordinates or outside all regions)." if skipped else "."))
+
     
     st.divider()
     st.info("Paste Coordinates Example:\n35.689, 139.691")
@@ -511,25 +307,41 @@ with st.sidebar:
              try:
                  loaded_data = json.load(uploaded_file)
                  if isinstance(loaded_data, list):
+                     merge_load = st.checkbox("Merge into current queue", help="Identical labels add to the quantity of the queued item.")
                      if st.button("Confirm Load", type="primary"):
-                         st.session_state.label_queue = loaded_data
+                         if st.session_state.get('auto_region_color'):
+                             assign_queue_regions(loaded_data)
+                         if merge_load:
+                             merged = get_queue_index().extend(loaded_data)
+                         else:
+                             st.session_state.label_queue, merged = compact_queue(loaded_data)
                          auto_save_queue()
-                         st.success("Data Loaded!")
+                         st.success("Data Loaded!" + (f" ({merged} duplicate items merged)" if merged else ""))
                          st.rerun()
                  else:
                      st.error("Invalid JSON format (must be a list).")
              except Exception as e:
                  st.error(f"Error loading JSON: {e}")
 
+    st.caption(f"Queue ID: `{session_queue_id()}` (このURLをブックマークすると同じキューに戻れます)")
     if st.session_state.label_queue:
         st.write(f"Items in queue: {len(st.session_state.label_queue)}")
         if st.button("Clear Queue", type="secondary"):
             st.session_state.label_queue = []
             auto_save_queue()
             st.rerun()
+        if st.button("🧹 Compact Queue", help="Merges identical items into one entry with the summed quantity."):
+            st.session_state.label_queue, merged = compact_queue(st.session_state.label_queue)
+            auto_save_queue()
+            st.toast(f"{merged} duplicate items merged")
+            st.rerun()
     else:
         st.write("Queue is empty.")
 
+    st.divider()
+    with st.expander("🛠️ Debug"):
+        st.checkbox("Rerun profiler", key="debug_profiler", help="Times each section of the page on every rerun.")
+
 # Tabs for Modules
 tab1, tab2, tab3, tab4 = st.tabs(["🌎 Data Label", "🔍 Identification Label", "🧬 Molecular Label", "📄 Sheet Preview"])
 
@@ -538,7 +350,7 @@ if 'header_input' not in st.session_state: st.session_state.header_input = ""
 if 'locality_input' not in st.session_state: st.session_state.locality_input = ""
 
 # --- TAB 1: DATA LABEL (Existing Internal Logic) ---
-with tab1:
+with tab1, profiler.section("Tab 1: Data label"):
     col1, col2 = st.columns([1.5, 1])
 
     with col1:
@@ -548,20 +360,42 @@ with tab1:
         def on_paste_change():
             val = st.session_state.paste_coords
             if val:
-                p_lat, p_lon = parse_coordinates(val)
+                p_lat, p_lon, note = parse_coordinates(val)
                 if p_lat is not None:
                     st.session_state.lat = p_lat
                     st.session_state.lon = p_lon
-                    st.toast(f"Coordinates Updated: {p_lat}, {p_lon}")
+                    st.toast(f"Coordinates Updated: {p_lat:.6f}, {p_lon:.6f}" + (f" ({note})" if note else ""))
                 else:
-                    st.toast("Invalid coordinate format", icon="⚠️")
+                    st.toast(f"Invalid coordinate format: {note}", icon="⚠️")
 
         # Coordinate Paste Input
-        st.text_input("Paste Coordinates (Lat, Lon)", key="paste_coords", placeholder="e.g. 35.6586, 139.7454", on_change=on_paste_change)
+        st.text_input("Paste Coordinates (Lat, Lon)", key="paste_coords", placeholder="e.g. 35.6586, 139.7454 or 35°39'31\"N 139°44'43\"E", on_change=on_paste_change)
+
+        with st.expander("Check many coordinates"):
+            bulk_coords = st.text_area("One pair per line", key="bulk_coords", height=120)
+            if bulk_coords.strip():
+                checked = parse_coordinate_text(bulk_coords)
+                n_bad = int(checked['error'].notna().sum())
+                st.caption(f"{len(checked) - n_bad} valid, {n_bad} invalid, {int(checked['swapped'].sum())} swapped")
+                st.dataframe(checked, hide_index=True, use_container_width=True)
         
-        # Map
-        m = folium.Map(location=[36.2048, 138.2529], zoom_start=5)
-        output = st_folium(m, height=400, use_container_width=True)
+        with profiler.section("Tab 1: Map"):
+            # Map (cached base map; only the queue overlay is re-sent on rerun)
+            show_queue_on_map = st.checkbox("Show queued locations on map", value=True)
+            queue_points = queue_coordinates(st.session_state.label_queue) if show_queue_on_map else []
+            map_built = []
+            base_map = get_base_map(_on_miss=lambda: map_built.append(True))
+            profiler.record_cache("Base map (st.cache_resource)", hit=not map_built)
+            output = st_folium(
+                base_map,
+                key="location_map",
+                feature_group_to_add=build_queue_layer(queue_points),
+                height=400,
+                use_container_width=True,
+                returned_objects=["last_clicked"],
+            )
+            if show_queue_on_map:
+                st.caption(f"Queued locations: {len(queue_points)}")
 
         # Logic to update state from Map Click
         if output and output['last_clicked'] != st.session_state.last_map_click:
@@ -580,27 +414,32 @@ with tab1:
         
         # --- Auto-Fetch Logic V2 ---
         current_coords = (st.session_state.lat, st.session_state.lon)
-        if current_coords != st.session_state.last_fetched_coords:
-            if api_key and not (current_coords[0] == 0.0 and current_coords[1] == 0.0):
-                with st.spinner("Fetching Info..."):
-                    addr_struct = get_google_address_struct(current_coords[0], current_coords[1], api_key)
-                    elev = get_elevation(current_coords[0], current_coords[1], api_key)
-                    
-                    if addr_struct:
-                        # Construct Header: COUNTRY: Region,
-                        parts = []
-                        if addr_struct['country']: parts.append(addr_struct['country'])
-                        header_str = f"{addr_struct['country']}: {addr_struct['admin']},"
-                        locality_str = addr_struct['locality']
+        profiler.record_cache("Auto-fetch (last_fetched_coords)", hit=current_coords == st.session_state.last_fetched_coords)
+        with profiler.section("Tab 1: Auto-fetch"):
+            if current_coords != st.session_state.last_fetched_coords:
+                if api_key and not (current_coords[0] == 0.0 and current_coords[1] == 0.0):
+                    with st.spinner("Fetching Info..."):
+                        addr_struct, elev, fetch_error = fetch_location_info(current_coords[0], current_coords[1], api_key)
+
+                    if fetch_error:
+                        # Keep the current fields and leave last_fetched_coords unset, so the next rerun retries
+                        st.warning(f"Could not fetch location info ({fetch_error}). It will be retried automatically.")
                     else:
-                        header_str = "COUNTRY: Region,"
-                        locality_str = "Locality Not Found"
-
-                    st.session_state.header_input = header_str
-                    st.session_state.locality_input = locality_str
-                    # Update manual elevation field
-                    st.session_state.elevation_manual = str(elev) if elev is not None else ""
-                    st.session_state.last_fetched_coords = current_coords
+                        if addr_struct:
+                            # Construct Header: COUNTRY: Region,
+                            parts = []
+                            if addr_struct['country']: parts.append(addr_struct['country'])
+                            header_str = f"{addr_struct['country']}: {addr_struct['admin']},"
+                            locality_str = addr_struct['locality']
+                        else:
+                            header_str = "COUNTRY: Region,"
+                            locality_str = "Locality Not Found"
+
+                        st.session_state.header_input = header_str
+                        st.session_state.locality_input = locality_str
+                        # Update manual elevation field
+                        st.session_state.elevation_manual = str(elev) if elev is not None else ""
+                        st.session_state.last_fetched_coords = current_coords
         
         # Inputs (V2 Fields)
         st.text_input("Header (Bold)", key="header_input", help="Format: COUNTRY: Region,")
@@ -662,19 +501,25 @@ with tab1:
                 st.components.v1.html(preview_html, height=150)
 
             if add_queue_btn:
-                st.session_state.label_queue.append({
+                new_item = {
                     'type': 'data_v2',
                     'header': final_header,
                     'body': body_text,
                     'color': label_color,
                     'quantity': quantity,
+                    'lat': current_lat,
+                    'lon': current_lon,
+                    'collector': collector_name,
                     'preview': f"{final_header} {final_locality}..."
-                })
+                }
+                if st.session_state.get('auto_region_color'):
+                    assign_queue_regions([new_item])
+                merged = get_queue_index().add(new_item)
                 auto_save_queue()
-                st.success(f"Added {quantity} Data Label(s) to Queue!")
+                st.success(f"Added {quantity} Data Label(s) to Queue!" + (" (merged into an identical item)" if merged else ""))
 
 # --- TAB 2: IDENTIFICATION LABEL ---
-with tab2:
+with tab2, profiler.section("Tab 2: Identification"):
     st.header("Identification Label")
     col_id1, col_id2 = st.columns(2)
     
@@ -722,19 +567,19 @@ with tab2:
         rich_content.append((f"det. {det_name} {det_year}", False))
         preview_str += f"det. {det_name} {det_year}"
         
-        st.session_state.label_queue.append({
+        merged = get_queue_index().add({
             'type': 'rich',
             'content': rich_content,
             'quantity': quantity,
             'preview': f"[ID] {genus} {species}"
         })
         auto_save_queue()
-        st.success(f"Added {quantity} ID Label(s) to Queue!")
+        st.success(f"Added {quantity} ID Label(s) to Queue!" + (" (merged into an identical item)" if merged else ""))
         st.text("Preview Format:")
         st.markdown(preview_str)
 
 # --- TAB 3: MOLECULAR LABEL ---
-with tab3:
+with tab3, profiler.section("Tab 3: Molecular"):
     st.header("Molecular Label")
     mol_id = st.text_input("Sample ID (e.g. DNA-001)")
     mol_note = st.text_input("Note / Method", value="DNA extracted")
@@ -746,17 +591,17 @@ with tab3:
             st.error("Sample ID is required.")
         else:
             text = f"{mol_id}\n{mol_note}"
-            st.session_state.label_queue.append({
+            merged = get_queue_index().add({
                 'type': 'text',
                 'content': text,
                 'quantity': quantity,
                 'preview': f"[DNA] {mol_id}"
             })
             auto_save_queue()
-            st.success(f"Added {quantity} Molecular Label(s) to Queue!")
+            st.success(f"Added {quantity} Molecular Label(s) to Queue!" + (" (merged into an identical item)" if merged else ""))
 
 # --- TAB 4: SHEET PREVIEW (Full A4) ---
-with tab4:
+with tab4, profiler.section("Tab 4: Sheet preview"):
     st.header("📄 True Sheet Preview (A4)")
     st.info("This preview simulates the A4 layout. Dotted lines representing cut marks are shown in gray.")
     
@@ -788,25 +633,52 @@ if st.session_state.label_queue:
     # --- Summary Bar ---
     st.markdown(f"**{total_items}** アイテム / **{total_labels}** ラベル（合計）")
 
-    # --- Slider Navigation ---
-    if total_items == 1:
-        selected_idx = 0
+    # --- Search & Filter ---
+    with profiler.section("Queue search"):
+        search_col1, search_col2, search_col3 = st.columns([2, 1, 1])
+        with search_col1:
+            search_query = st.text_input("🔎 検索", key="queue_search", placeholder="ヘッダー・場所・分類群・採集者・日付・サンプルID")
+        with search_col2:
+            search_field = st.selectbox(
+                "検索対象", [None, 'header', 'locality', 'taxon', 'collector', 'date', 'sample_id'],
+                format_func=lambda f: {None: 'すべて', 'header': 'ヘッダー', 'locality': '場所', 'taxon': '分類群',
+                                       'collector': '採集者', 'date': '日付', 'sample_id': 'サンプルID'}[f],
+                key="queue_search_field"
+            )
+        with search_col3:
+            search_types = st.multiselect(
+                "種類", ['data_v2', 'rich', 'text'],
+                format_func=lambda t: {'data_v2': 'Data', 'rich': 'ID', 'text': 'Molecular'}[t],
+                key="queue_search_types"
+            )
+        matches = get_search_index().search(queue, search_query, search_field, search_types or None)
+    if not matches:
+        st.warning("一致するアイテムがありません。全アイテムを表示します。")
+        matches = list(range(total_items))
+    elif len(matches) < total_items:
+        st.caption(f"{len(matches)} / {total_items} アイテムが一致")
+
+    # --- Slider Navigation (over the matching items) ---
+    if len(matches) == 1:
+        selected_idx = matches[0]
         st.markdown("**Item 1 / 1**")
     else:
-        selected_idx = st.slider(
+        if st.session_state.get('queue_slider', 1) > len(matches):
+            st.session_state.queue_slider = 1
+        selected_idx = matches[st.slider(
             "アイテムを選択",
             min_value=1,
-            max_value=total_items,
+            max_value=len(matches),
             value=1,
             format="Item %d",
             key="queue_slider"
-        ) - 1
+        ) - 1]
 
     item = queue[selected_idx]
     item_type = item.get('type', 'text')
 
     # --- Card Display ---
-    with st.container():
+    with st.container(), profiler.section("Queue card"):
         # Type Badge
         type_labels = {
             'data_v2': '🌎 Data Label',
@@ -1010,33 +882,108 @@ if st.session_state.label_queue:
 
         with act_col5:
             if st.button("🗑️ 削除", key=f"del_{selected_idx}", type="secondary"):
-                queue.pop(selected_idx)
+                get_queue_index().remove(selected_idx)
                 auto_save_queue()
                 st.rerun()
 
     st.divider()
 
+    # --- Fit Check (font metrics; flags labels wider than their cell) ---
+    with profiler.section("Fit check"):
+        fit_results = check_fit(queue, font_name, font_size, num_columns, char_spacing)
+    overflowing = [r for r in fit_results if r['overflow']]
+    if overflowing:
+        unfit = sum(1 for r in overflowing if r['fit_size'] is None)
+        st.warning(
+            f"{len(overflowing)} アイテムがセル幅 ({fit_results[0]['cell']} pt) からはみ出します。"
+            + (f" うち {unfit} アイテムは {MIN_FONT_SIZE} pt でも収まりません。" if unfit else "")
+        )
+        with st.expander("はみ出すアイテム", expanded=False):
+            st.dataframe(pd.DataFrame([{
+                '#': r['index'] + 1,
+                'Preview': queue[r['index']].get('preview', '').replace('\n', ' ')[:60],
+                'Width (pt)': r['width'],
+                'Fits at (pt)': r['fit_size'],
+            } for r in overflowing]), use_container_width=True, hide_index=True)
+        if st.button("🔡 はみ出すラベルを縮小", help="収まる最大のフォントサイズ (0.5pt 単位) をアイテムごとに設定します。"):
+            shrunk, _ = shrink_to_fit(queue, font_name, font_size, num_columns, char_spacing)
+            get_queue_index().rebuild()
+            auto_save_queue()
+            st.toast(f"{shrunk} アイテムを縮小しました")
+            st.rerun()
+
     # --- Download Batch ---
-    docx_file = create_docx(
-        queue,
-        font_size=font_size,
-        show_borders=show_borders,
-        num_columns=num_columns,
-        font_name=font_name,
-        char_spacing=char_spacing
-    )
+    # Built on click (separate thread) by streaming into a temp file, not on every rerun
+    docx_queue = [dict(item) for item in queue]
+    def build_docx():
+        docx_file = tempfile.TemporaryFile()
+        write_docx(
+            docx_queue,
+            docx_file,
+            font_size=font_size,
+            show_borders=show_borders,
+            num_columns=num_columns,
+            font_name=font_name,
+            char_spacing=char_spacing
+        )
+        docx_file.seek(0)
+        return docx_file
     st.download_button(
         label=f"📥 Download Batch DOCX ({total_items} types / {total_labels} labels)",
-        data=docx_file,
+        data=build_docx,
         file_name=f"labels_batch_{datetime.date.today()}.docx",
         mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
         type="primary"
     )
 
+    # --- Split Download (one DOCX per group, zipped) ---
+    with st.expander("🗂️ 分割ダウンロード (ZIP)", expanded=False):
+        split_col1, split_col2 = st.columns(2)
+        with split_col1:
+            split_key = st.selectbox(
+                "グループ", [None, 'region', 'color', 'collector', 'type'],
+                format_func=lambda k: {None: 'なし', 'region': '地域', 'color': 'カラー', 'collector': '採集者', 'type': 'ラベル種別'}[k],
+                key="split_key"
+            )
+        with split_col2:
+            split_pages = st.number_input("最大ページ数 / ファイル (0 = 制限なし)", min_value=0, value=0, step=1, key="split_pages")
+        split_parts = split_queue(docx_queue, split_key, split_pages or None, num_columns, font_size)
+        st.caption(" / ".join(f"{name}: {sum(i['quantity'] for i in items)}" for name, items in split_parts[:20])
+                   + (f" … (+{len(split_parts) - 20})" if len(split_parts) > 20 else ""))
+
+        def build_docx_zip():
+            zip_file = tempfile.TemporaryFile()
+            write_docx_zip(
+                docx_queue,
+                zip_file,
+                key=split_key,
+                max_pages=split_pages or None,
+                font_size=font_size,
+                show_borders=show_borders,
+                num_columns=num_columns,
+                font_name=font_name,
+                char_spacing=char_spacing
+            )
+            zip_file.seek(0)
+            return zip_file
+        st.download_button(
+            label=f"📥 Download ZIP ({len(split_parts)} files)",
+            data=build_docx_zip,
+            file_name=f"labels_batch_{datetime.date.today()}.zip",
+            mime="application/zip",
+        )
+
     # --- Summary Table (Collapsible) ---
-    with st.expander("📋 全アイテム一覧", expanded=False):
+    with st.expander("📋 全アイテム一覧", expanded=False), profiler.section("Summary table"):
+        # Only the current page of the matching items is built
+        page_count = (len(matches) - 1) // SUMMARY_PAGE_SIZE + 1
+        if st.session_state.get('summary_page', 1) > page_count:
+            st.session_state.summary_page = 1
+        page = st.number_input(f"ページ (全 {page_count} ページ, {len(matches)} アイテム)", min_value=1,
+                               max_value=page_count, value=1, step=1, key="summary_page")
         summary_data = []
-        for i, item in enumerate(queue):
+        for i in matches[(page - 1) * SUMMARY_PAGE_SIZE:page * SUMMARY_PAGE_SIZE]:
+            item = queue[i]
             item_type = item.get('type', 'text')
             type_name = {'data_v2': 'Data', 'rich': 'ID', 'text': 'Molecular'}.get(item_type, 'Other')
             preview = item.get('preview', '').replace('\n', ' ')
@@ -1047,9 +994,13 @@ if st.session_state.label_queue:
                 'Type': type_name,
                 'Preview': preview,
                 'Qty': item['quantity'],
+                'Size (pt)': item.get('font_size', font_size),
             })
         df = pd.DataFrame(summary_data)
         st.dataframe(df, use_container_width=True, hide_index=True)
 
 else:
     st.info("Queue is empty. Add labels from the tabs above.")
+
+profiler.finish()
+profiler.render()
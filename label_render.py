@@ -0,0 +1,114 @@
+"""
+Label rendering: body text formatting (via label_templates), the HTML sheet preview
+and DOCX output (via docx_stream).
+
+Kept free of Streamlit so it can be imported by benchmarks and batch tools.
+"""
+import io
+from docx_stream import write_docx
+from label_templates import get_template
+
+def generate_label_body_v2(locality, elev, lat, lon, date_obj, collector, method):
+    """Generates the body text (excluding header) for the new style, with the built-in 'v2' template."""
+    return get_template('v2').render({
+        'locality': locality, 'elevation': elev, 'lat': lat, 'lon': lon,
+        'date': date_obj, 'collector': collector, 'method': method,
+    })
+
+def generate_html_sheet(queue, num_columns, font_name, font_size, label_color):
+    """Generates an HTML representation of the full A4 sheet."""
+    
+    # CSS for A4 Sheet and Grid
+    # A4 is 210mm x 297mm.
+    # Grid columns = num_columns.
+    
+    css = f"""
+    <style>
+        @page {{ size: A4; margin: 0; }}
+        .sheet {{
+            width: 210mm;
+            min-height: 297mm;
+            padding: 5mm; /* Margins */
+            box-sizing: border-box;
+            background: white;
+            border: 1px solid #eee;
+            margin: 0 auto;
+            display: grid;
+            grid-template-columns: repeat({num_columns}, 1fr);
+            grid-auto-rows: min-content;
+            font-family: "{font_name}", Arial, sans-serif;
+        }}
+        .cell {{
+            border: 1px dotted #CCCCCC; /* Dotted Gray */
+            padding: 1px;
+            box-sizing: border-box;
+            overflow: hidden;
+            font-size: {font_size}pt;
+            line-height: 1.1;
+        }}
+        .header {{ font-weight: bold; }}
+        .bar {{ height: 2px; margin: 1px 0; }}
+        .body {{ white-space: pre-wrap; }}
+    </style>
+    """
+    
+    # Build Cells
+    cells_html = ""
+    
+    # Flatten items
+    all_items = []
+    for item in queue:
+        for _ in range(item['quantity']):
+            all_items.append(item)
+            
+    for item in all_items:
+        ctype = item.get('type', 'text')
+        content_html = ""
+        # Per-item size set by label_fit.shrink_to_fit
+        size_style = f' style="font-size: {item["font_size"]}pt;"' if 'font_size' in item else ''
+        
+        if ctype == 'data_v2':
+            # Use item color or default
+            i_color = item.get('color', '#000000')
+            content_html = f"""
+                <div class="header">{item['header']}</div>
+                <div class="bar" style="background-color: {i_color};"></div>
+                <div class="body">{item['body']}</div>
+            """
+        elif ctype == 'rich':
+            # Simplified rich text render for preview
+            # (In a real full implementation, we'd parse the list of tuples)
+            preview_txt = item['preview']
+            content_html = f"<div>{preview_txt}</div>"
+        else:
+             content_html = f"<div>{str(item.get('content', ''))}</div>"
+             
+        cells_html += f'<div class="cell"{size_style}>{content_html}</div>'
+
+    html = f"""
+    <!DOCTYPE html>
+    <html>
+    <head>{css}</head>
+    <body>
+        <div class="sheet">
+            {cells_html}
+        </div>
+    </body>
+    </html>
+    """
+    return html
+
+def create_docx(label_queue, font_size=4.0, show_borders=True, num_columns=13, font_name='Arial', char_spacing=0.0):
+    """
+    Creates a DOCX file from a list of label objects using a Grid Layout (Table).
+    Optimized for insect specimens (small font, efficient cutting).
+    Returns an in-memory buffer; use docx_stream.write_docx to write large
+    sheets straight to a file instead.
+    """
+    if not any(item['quantity'] for item in label_queue):
+        return io.BytesIO()
+    buffer = io.BytesIO()
+    write_docx(label_queue, buffer, font_size=font_size, show_borders=show_borders,
+               num_columns=num_columns, font_name=font_name, char_spacing=char_spacing)
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,371 @@
+"""
+Label text templates.
+
+A template is plain text with tags in braces:
+
+    {field}                   value of a field (empty when missing)
+    {field|filter|filter:arg} value passed through filters, left to right
+    {a,b,c|join:'. '}         the present values of several fields, as a list
+    {?expr} ... {else} ... {/}  conditional: first branch when expr is non-empty
+    {[} ... {/|filter}        group: the enclosed output passed through filters
+    {{ and }}                 literal braces
+
+A closing {/} may carry filters for any block. Missing means None, NaN/NaT,
+'' or 'nan'. Filters are looked up in FILTERS; add entries there for
+museum-specific formatting.
+
+compile_template() turns a template into a LabelTemplate once: the tag tree
+becomes the source of a single Python function taking one argument per field,
+so rendering a row is one call with no parsing or dispatch left. render_frame()
+feeds it whole DataFrame columns at once instead of building a row per label.
+
+The three label formats of the batch CLI, the Tk app and the Streamlit app
+ship as BUILTIN_TEMPLATES.
+"""
+import datetime
+import functools
+import numbers
+import os
+import re
+import pandas as pd
+
+class TemplateError(ValueError):
+    """Raised for a malformed template, with the offending position."""
+
+def _missing(value):
+    if value is None:
+        return True
+    cls = value.__class__
+    if cls is str:
+        return value == '' or value == 'nan'
+    if cls is list or cls is tuple:
+        return all(_missing(v) for v in value)
+    # NaN / NaT compare unequal to themselves
+    return value != value
+
+def _text(value):
+    """Text of a value; '' exactly when the value is missing."""
+    cls = value.__class__
+    if cls is str:
+        return '' if value == 'nan' else value
+    if value is None or _missing(value):
+        return ''
+    if cls is list or cls is tuple:
+        return ', '.join(_text(v) for v in value if not _missing(v))
+    return str(value)
+
+# --- Filters: f(value, arg) -> value (None when the result is missing) ---
+
+ROMAN_MONTHS = ["", "I", "II", "III", "IV", "V", "VI", "VII", "VIII", "IX", "X", "XI", "XII"]
+
+def _as_date(value):
+    if isinstance(value, datetime.date):  # Includes datetime and pd.Timestamp
+        return value
+    try:
+        return datetime.date.fromisoformat(str(value).strip()[:10])
+    except ValueError:
+        return None
+
+def f_roman_date(value, arg=None):
+    """Date as '15 II 2023'; unparsable text is kept as is."""
+    if not isinstance(value, datetime.date) and _missing(value):
+        return None
+    date = _as_date(value)
+    if date is None:
+        return value
+    return f"{date.day} {ROMAN_MONTHS[date.month]} {date.year}"
+
+def _hemisphere(value, positive, negative):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None if _missing(value) else value
+    if number != number:
+        return None
+    return f"{abs(number):.3f}°{positive if number >= 0 else negative}"
+
+def f_lat(value, arg=None):
+    """Latitude as '35.689°N'."""
+    return _hemisphere(value, 'N', 'S')
+
+def f_lon(value, arg=None):
+    """Longitude as '139.691°E'."""
+    return _hemisphere(value, 'E', 'W')
+
+def f_number(value, arg=None):
+    """The value if it is a number, else missing (for conditions)."""
+    cls = value.__class__
+    if cls is int or (cls is not bool and isinstance(value, numbers.Number) and value == value):
+        return value
+    return None
+
+def f_error(value, arg=None):
+    """The value if it is an error message, else missing (for conditions)."""
+    if isinstance(value, str) and ('エラー' in value or 'Error' in value):
+        return value
+    return None
+
+def f_paren(value, arg=None):
+    """Wraps in parentheses unless already wrapped."""
+    if _missing(value):
+        return None
+    text = _text(value)
+    return text if text.startswith('(') and text.endswith(')') else f"({text})"
+
+def f_join(value, arg=', '):
+    """Joins a list of values with arg."""
+    if isinstance(value, (list, tuple)):
+        return arg.join(_text(v) for v in value if not _missing(v)) or None
+    return value
+
+def f_end(value, arg='.'):
+    """Appends arg unless the text is empty or already ends with it."""
+    text = _text(value)
+    if not text or text.endswith(arg):
+        return text or None
+    return text + arg
+
+def f_default(value, arg=''):
+    """arg when the value is missing."""
+    return arg if _missing(value) else value
+
+def f_upper(value, arg=None):
+    return None if _missing(value) else _text(value).upper()
+
+FILTERS = {
+    'roman_date': f_roman_date,
+    'lat': f_lat,
+    'lon': f_lon,
+    'number': f_number,
+    'error': f_error,
+    'paren': f_paren,
+    'join': f_join,
+    'end': f_end,
+    'default': f_default,
+    'upper': f_upper,
+}
+
+# --- Parsing ---
+
+_TAG_RE = re.compile(r'\{\{|\}\}|\{([^{}]*)\}')
+_FILTER_RE = re.compile(r'''\|\s*(\w+)\s*(?::\s*('[^']*'|"[^"]*"|[^|]*))?''')
+
+def _parse_filters(text, pos):
+    filters = []
+    end = 0
+    for m in _FILTER_RE.finditer(text):
+        if text[end:m.start()].strip():
+            break
+        name, arg = m.group(1), m.group(2)
+        if name not in FILTERS:
+            raise TemplateError(f"unknown filter '{name}' at position {pos}")
+        if arg is not None:
+            arg = arg.strip()
+            if len(arg) >= 2 and arg[0] == arg[-1] and arg[0] in '\'"':
+                arg = arg[1:-1]
+        filters.append((name, arg))
+        end = m.end()
+    if text[end:].strip():
+        raise TemplateError(f"cannot parse filters '{text}' at position {pos}")
+    return filters
+
+def _parse_expr(text, pos):
+    """'a,b|f:x' -> (['a', 'b'], [('f', 'x')])"""
+    head, bar, tail = text.partition('|')
+    fields = [f.strip() for f in head.split(',')]
+    if not all(fields):
+        raise TemplateError(f"empty field name in '{{{text}}}' at position {pos}")
+    if any(':' in f for f in fields):
+        raise TemplateError(f"':' outside a filter in '{{{text}}}' at position {pos} (use field|filter:arg)")
+    return fields, _parse_filters(bar + tail, pos) if bar else []
+
+def parse_template(source):
+    """
+    Parses a template into a node tree:
+    ('text', s) | ('expr', fields, filters) | ('if', expr, then, else, filters)
+    | ('group', body, filters)
+    """
+    root = []
+    stack = [('root', root, None)]  # (kind, current body, open node)
+    pos = 0
+    for m in _TAG_RE.finditer(source):
+        body = stack[-1][1]
+        if m.start() > pos:
+            body.append(('text', source[pos:m.start()]))
+        pos = m.end()
+        tag = m.group(0)
+        if tag in ('{{', '}}'):
+            body.append(('text', tag[0]))
+            continue
+        inner = m.group(1).strip()
+        if inner.startswith('?'):
+            node = {'kind': 'if', 'expr': _parse_expr(inner[1:], m.start()), 'then': [], 'else': None}
+            body.append(node)
+            stack.append(('if', node['then'], node))
+        elif inner == '[':
+            node = {'kind': 'group', 'body': []}
+            body.append(node)
+            stack.append(('group', node['body'], node))
+        elif inner == 'else':
+            kind, _, node = stack[-1]
+            if kind != 'if' or node['else'] is not None:
+                raise TemplateError(f"{{else}} outside a {{?...}} block at position {m.start()}")
+            node['else'] = []
+            stack[-1] = ('if', node['else'], node)
+        elif inner.startswith('/'):
+            if len(stack) == 1:
+                raise TemplateError(f"unmatched {{/}} at position {m.start()}")
+            _, _, node = stack.pop()
+            node['filters'] = _parse_filters(inner[1:], m.start())
+        else:
+            body.append(('expr',) + _parse_expr(inner, m.start()))
+    if len(stack) > 1:
+        raise TemplateError(f"unclosed {{{'?' if stack[-1][0] == 'if' else '['}...}} block")
+    if pos < len(source):
+        root.append(('text', source[pos:]))
+    return root
+
+# --- Compilation ---
+
+class _Compiler:
+    def __init__(self):
+        self.fields = []
+        self.texts = set()  # Indexes of fields whose text (t) is used
+
+    def var(self, field, prefix='v'):
+        """Argument name of a field's raw value (v) or its text (t)."""
+        if field not in self.fields:
+            self.fields.append(field)
+        index = self.fields.index(field)
+        if prefix == 't':
+            self.texts.add(index)
+        return f"{prefix}{index}"
+
+    def value(self, fields, filters):
+        """Python expression for a field expression's raw (filtered) value."""
+        if len(fields) == 1:
+            code = self.var(fields[0])
+        else:
+            code = '[' + ', '.join(self.var(f) for f in fields) + ']'
+        return self.filtered(code, filters)
+
+    def filtered(self, code, filters):
+        for name, arg in filters:
+            code = f"_f_{name}({code}{'' if arg is None else ', ' + repr(arg)})"
+        return code
+
+    def body(self, nodes):
+        """Python expression for the text of a node list."""
+        parts = []
+        for node in nodes:
+            if isinstance(node, tuple) and node[0] == 'text':
+                parts.append(repr(node[1]))
+            elif isinstance(node, tuple):
+                fields, filters = node[1], node[2]
+                if len(fields) == 1 and not filters:
+                    parts.append(self.var(fields[0], 't'))
+                else:
+                    parts.append(f"_text({self.value(fields, filters)})")
+            elif node['kind'] == 'if':
+                fields, filters = node['expr']
+                if len(fields) == 1 and not filters:
+                    condition = self.var(fields[0], 't')
+                else:
+                    condition = f"not _missing({self.value(fields, filters)})"
+                code = f"({self.body(node['then'])} if {condition} else {self.body(node['else'] or [])})"
+                parts.append(self.wrap(code, node['filters']))
+            else:
+                parts.append(self.wrap(self.body(node['body']), node['filters']))
+        if not parts:
+            return "''"
+        return parts[0] if len(parts) == 1 else '(' + ' + '.join(parts) + ')'
+
+    def wrap(self, code, filters):
+        return f"_text({self.filtered(code, filters)})" if filters else code
+
+class LabelTemplate:
+    """A compiled template. fields lists the field names it reads."""
+
+    def __init__(self, source, name=None):
+        self.source = source
+        self.name = name
+        compiler = _Compiler()
+        expression = compiler.body(parse_template(source))
+        self.fields = tuple(compiler.fields)
+        args = ', '.join(f"v{i}" for i in range(len(self.fields)))
+        # Each field's text is computed once and shared by every tag that uses it
+        prelude = ''.join(f"    t{i} = _text(v{i})\n" for i in sorted(compiler.texts))
+        self.code = f"def render({args}):\n{prelude}    return {expression}\n"
+        namespace = {'_text': _text, '_missing': _missing}
+        namespace.update({f"_f_{name}": fn for name, fn in FILTERS.items()})
+        exec(compile(self.code, f"<template {name or ''}>", 'exec'), namespace)
+        self._render = namespace['render']
+
+    def render(self, row, columns=None):
+        """
+        Label text for one row (any mapping: dict, pandas Series).
+        columns maps field names to row keys where they differ.
+        """
+        if not columns:
+            return self._render(*map(row.get, self.fields))
+        return self._render(*(row.get(columns.get(f, f)) for f in self.fields))
+
+    def render_frame(self, df, columns=None):
+        """Label text for every row of a DataFrame, as a Series on its index."""
+        columns = columns or {}
+        values = []
+        for field in self.fields:
+            column = columns.get(field, field)
+            values.append(df[column].tolist() if column in df.columns else [None] * len(df))
+        if not values:
+            return pd.Series([self._render()] * len(df), index=df.index, dtype=object)
+        return pd.Series([self._render(*row) for row in zip(*values)], index=df.index, dtype=object)
+
+    def __call__(self, row, columns=None):
+        return self.render(row, columns)
+
+# label_app.py CLI: address / GPS elevation / date. method. collector. / raw coordinates
+CLI_TEMPLATE = (
+    "{?address|error}住所取得エラー: {address}{else}{?address}JAPAN: {address}{else}住所取得エラー: {/}{/}\n"
+    "{?elevation|number}GPS({elevation}m){else}{?elevation}GPS(エラー: {elevation}){else}GPS(高度取得失敗){/}{/}\n"
+    "{date,method,collector|join:'. '|end:'.'}\n"
+    "N{lat}, E{lon}"
+)
+
+# generate_data_sheet.py LabelApp
+TK_TEMPLATE = (
+    "JAPAN: {address}\n"
+    "GPS({elevation}m)\n"
+    "{?date,method,collector}{date,method,collector|join:'. '}.\n{/}"
+    "N{lat}, E{lon}"
+)
+
+# label_generator_app.py data label body (header line excluded)
+V2_TEMPLATE = (
+    "{[}{locality}{?locality}{?elevation}, {/}{/}{?elevation}(alt. {elevation} m){/}{/|end:','}\n"
+    "{lat|lat}, {lon|lon}, {date|roman_date},\n"
+    "{collector}{?method}, {method|paren}{/}"
+)
+
+BUILTIN_TEMPLATES = {
+    'cli': CLI_TEMPLATE,
+    'tk': TK_TEMPLATE,
+    'v2': V2_TEMPLATE,
+}
+
+@functools.lru_cache(maxsize=64)
+def compile_template(source, name=None):
+    """Compiles (and caches) a template."""
+    return LabelTemplate(source, name)
+
+def get_template(spec):
+    """
+    A compiled template from a built-in name ('cli', 'tk', 'v2') or the path of
+    a UTF-8 text file holding a template.
+    """
+    if spec in BUILTIN_TEMPLATES:
+        return compile_template(BUILTIN_TEMPLATES[spec], spec)
+    if not os.path.exists(spec):
+        raise TemplateError(f"unknown template '{spec}' (built-in: {', '.join(BUILTIN_TEMPLATES)})")
+    with open(spec, 'r', encoding='utf-8') as f:
+        return compile_template(f.read(), os.path.basename(spec))
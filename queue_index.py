@@ -0,0 +1,102 @@
+"""
+Content-addressed index over the label queue (a plain list of item dicts).
+
+Two items are the same label when everything except their quantity (and the
+UI-only preview caption) is equal; content_key() hashes that content. Adding
+through QueueIndex merges an identical item into the existing entry's
+quantity in O(1) instead of appending a duplicate that would be rendered,
+saved and paginated separately. compact_queue() merges the duplicates
+already in a queue in one pass.
+
+Items edited in place (bar colors, font size) keep their old key until
+rebuild(); a stale key is detected on lookup and never merges wrongly.
+"""
+import hashlib
+import json
+import re
+
+# Keys that do not change what is printed
+IGNORED_KEYS = ('quantity', 'preview')
+
+def content_key(item):
+    """Hash of everything that is printed for an item (tuples and lists hash alike, as after a JSON round trip)."""
+    content = {k: v for k, v in item.items() if k not in IGNORED_KEYS}
+    data = json.dumps(content, sort_keys=True, ensure_ascii=False, default=str, separators=(',', ':'))
+    return hashlib.blake2b(data.encode('utf-8'), digest_size=16).hexdigest()
+
+def item_collector(item):
+    """Collector of a data_v2 item: stored value, else line 3 of the body without the method."""
+    if item.get('collector'):
+        return item['collector']
+    lines = item.get('body', '').split('\n')
+    if item.get('type') != 'data_v2' or len(lines) < 3:
+        return None
+    return re.sub(r',\s*\(.+?\)\s*$', '', lines[2]).strip() or None
+
+def compact_queue(label_queue):
+    """
+    Merges identical items (quantities summed) keeping first-appearance order.
+    Returns (new queue, number of items merged away).
+    """
+    first = {}
+    compacted = []
+    for item in label_queue:
+        key = content_key(item)
+        if key in first:
+            first[key]['quantity'] += item['quantity']
+        else:
+            first[key] = item
+            compacted.append(item)
+    return compacted, len(label_queue) - len(compacted)
+
+class QueueIndex:
+    """Maps content_key -> item for one queue list; add/extend/remove keep it current."""
+
+    def __init__(self, label_queue):
+        self.queue = label_queue
+        self.rebuild()
+
+    def rebuild(self):
+        """Re-hashes every item (after in-place edits of many items)."""
+        self._items = {}
+        self._counts = {}
+        for item in self.queue:
+            key = content_key(item)
+            self._items.setdefault(key, item)
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+    def add(self, item):
+        """Appends item, or adds its quantity to an identical queued item. Returns True if merged."""
+        key = content_key(item)
+        existing = self._items.get(key)
+        if existing is not None and existing is not item and content_key(existing) == key:
+            existing['quantity'] += item['quantity']
+            return True
+        self._items[key] = item
+        self._counts[key] = self._counts.get(key, 0) + 1
+        self.queue.append(item)
+        return False
+
+    def extend(self, items):
+        """add() for each item; returns how many were merged."""
+        return sum(self.add(item) for item in items)
+
+    def remove(self, position):
+        """Removes and returns the item at position."""
+        item = self.queue.pop(position)
+        key = content_key(item)
+        count = self._counts.get(key, 1) - 1
+        if count > 0:
+            self._counts[key] = count
+            if self._items.get(key) is item:
+                # Duplicates from before indexing: point the key at the next one
+                other = next((other for other in self.queue if content_key(other) == key), None)
+                if other is None:
+                    del self._items[key]
+                else:
+                    self._items[key] = other
+        else:
+            self._counts.pop(key, None)
+            if self._items.get(key) is item:
+                del self._items[key]
+        return item
@@ -0,0 +1,146 @@
+"""
+In-memory search over the label queue.
+
+Each item is split into searchable fields: header, locality, taxon,
+collector, date and sample ID. Their words go into an inverted index with a
+sorted vocabulary per field, so a query term matches every word it prefixes
+through one bisect. Japanese (wide) text has no spaces, so its words are also
+indexed as character bigrams.
+
+The index follows the queue incrementally. sync() tokenizes only the items
+that are new since the last call and drops removed ones, matching items by
+object identity. Label text is never edited in place in the app. Bar colors
+and sizes are, but they are not searched.
+"""
+import bisect
+import re
+import unicodedata
+from queue_index import item_collector
+
+SEARCH_FIELDS = ('header', 'locality', 'taxon', 'collector', 'date', 'sample_id')
+
+_WORD_RE = re.compile(r'\w+')
+_ROMAN_DATE_RE = re.compile(r'\d+\s+[IVXLCDM]+\s+\d{4}')
+
+def item_fields(item):
+    """{field: text} of the searchable parts of a queue item."""
+    ctype = item.get('type', 'text')
+    if ctype == 'data_v2':
+        lines = str(item.get('body', '')).split('\n')
+        date = _ROMAN_DATE_RE.search(lines[1]) if len(lines) > 1 else None
+        return {
+            'header': str(item.get('header', '')),
+            'locality': lines[0],
+            'collector': item_collector(item) or '',
+            'date': date.group(0) if date else '',
+        }
+    if ctype == 'rich':
+        text = ''.join(segment for segment, _ in item['content'])
+        # Last line is "det. Name Year"
+        taxon, _, det = text.rpartition('\n')
+        return {'taxon': taxon, 'collector': det}
+    content = str(item['content'] if 'content' in item else item.get('text', ''))
+    return {'sample_id': content.split('\n')[0]}
+
+def _is_wide(word):
+    return any(unicodedata.east_asian_width(ch) in ('W', 'F') for ch in word)
+
+def tokenize(text):
+    """Lowercased NFKC words, plus character bigrams of words with wide characters."""
+    tokens = set()
+    for word in _WORD_RE.findall(unicodedata.normalize('NFKC', str(text)).lower()):
+        tokens.add(word)
+        if len(word) > 2 and _is_wide(word):
+            tokens.update(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+class QueueSearchIndex:
+    """Inverted index over the items of one queue list."""
+
+    def __init__(self):
+        self._items = {}  # id(item) -> (item, {field: tokens})
+        self._postings = {field: {} for field in SEARCH_FIELDS}  # field -> token -> {id}
+        self._vocab = {field: [] for field in SEARCH_FIELDS}  # field -> sorted tokens
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, item):
+        key = id(item)
+        if key in self._items:
+            return
+        fields = {field: tokenize(text) for field, text in item_fields(item).items()}
+        self._items[key] = (item, fields)
+        for field, tokens in fields.items():
+            postings = self._postings[field]
+            for token in tokens:
+                if token not in postings:
+                    postings[token] = set()
+                    bisect.insort(self._vocab[field], token)
+                postings[token].add(key)
+
+    def remove(self, item):
+        entry = self._items.pop(id(item), None)
+        if entry is None:
+            return
+        for field, tokens in entry[1].items():
+            postings = self._postings[field]
+            for token in tokens:
+                ids = postings[token]
+                ids.discard(id(item))
+                if not ids:
+                    del postings[token]
+                    vocab = self._vocab[field]
+                    del vocab[bisect.bisect_left(vocab, token)]
+
+    def sync(self, label_queue):
+        """Indexes items new to the queue and forgets removed ones."""
+        current = {id(item): item for item in label_queue}
+        for key in [key for key in self._items if key not in current]:
+            self.remove(self._items[key][0])
+        for key, item in current.items():
+            if key not in self._items:
+                self.add(item)
+
+    def _prefix_ids(self, field, prefix):
+        vocab = self._vocab[field]
+        postings = self._postings[field]
+        ids = set()
+        for i in range(bisect.bisect_left(vocab, prefix), len(vocab)):
+            if not vocab[i].startswith(prefix):
+                break
+            ids |= postings[vocab[i]]
+        return ids
+
+    def _term_ids(self, term, fields):
+        # Wide-character terms: every bigram must occur
+        if len(term) > 2 and _is_wide(term):
+            parts = [term[i:i + 2] for i in range(len(term) - 1)]
+        else:
+            parts = [term]
+        result = None
+        for part in parts:
+            ids = set()
+            for field in fields:
+                ids |= self._prefix_ids(field, part)
+            result = ids if result is None else result & ids
+            if not result:
+                break
+        return result
+
+    def search(self, label_queue, query='', field=None, types=None):
+        """
+        Queue positions of the items matching every word of query (prefix
+        match) in field (None: any field) and of a type in types (None: any).
+        """
+        fields = [field] if field else SEARCH_FIELDS
+        hits = None
+        for term in _WORD_RE.findall(unicodedata.normalize('NFKC', query).lower()):
+            ids = self._term_ids(term, fields)
+            hits = ids if hits is None else hits & ids
+            if not hits:
+                return []
+        return [
+            position for position, item in enumerate(label_queue)
+            if (hits is None or id(item) in hits) and (types is None or item.get('type', 'text') in types)
+        ]
@@ -0,0 +1,123 @@
+"""
+Per-session label queue storage.
+
+Every queue is its own JSON file, <directory>/<queue id>.json, so curators
+working at the same time never overwrite each other, and saving one queue
+costs the same however many others exist. A save writes a temp file in the
+same directory, fsyncs it and moves it into place with os.replace: readers
+see either the old or the new queue, never a half-written one, even after a
+crash. Saves to the same queue are serialised by a per-queue thread lock
+(two browser tabs on one Streamlit server) and an OS file lock on
+.<queue id>.lock (several server processes), so the last save wins as a
+whole. Adopting the legacy autosave holds a lock on <legacy path>.lock, so
+only one queue ever takes it over.
+"""
+import json
+import os
+import re
+import secrets
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+_QUEUE_ID_RE = re.compile(r'[A-Za-z0-9_-]{8,64}')
+
+def new_queue_id():
+    """Random, URL-safe queue id."""
+    return secrets.token_urlsafe(12)
+
+def valid_queue_id(queue_id):
+    return bool(queue_id) and _QUEUE_ID_RE.fullmatch(str(queue_id)) is not None
+
+@contextmanager
+def _file_lock(lock_path):
+    """Holds an exclusive OS-level lock on lock_path (created if missing)."""
+    with open(lock_path, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            # Locks the first byte; LK_LOCK retries for about 10 s, then raises OSError
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+class QueueStore:
+    """JSON files of label queues in one directory, keyed by queue id."""
+
+    def __init__(self, directory, legacy_path=None):
+        self.directory = directory
+        # Single shared autosave of older versions; adopted by the first queue loaded
+        self.legacy_path = legacy_path
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def path(self, queue_id):
+        if not valid_queue_id(queue_id):
+            raise ValueError(f"Invalid queue id: {queue_id!r}")
+        return os.path.join(self.directory, f"{queue_id}.json")
+
+    def _lock(self, queue_id):
+        with self._locks_lock:
+            return self._locks.setdefault(queue_id, threading.Lock())
+
+    def load(self, queue_id):
+        """The stored queue (a list), or [] if there is none."""
+        path = self.path(queue_id)
+        if not os.path.exists(path) and self.legacy_path and os.path.exists(self.legacy_path):
+            queue = self._adopt_legacy(queue_id)
+            if queue is not None:
+                return queue
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return []
+        return data if isinstance(data, list) else []
+
+    def _adopt_legacy(self, queue_id):
+        try:
+            with _file_lock(self.legacy_path + '.lock'):
+                # Another process may have adopted it, or saved this queue, meanwhile
+                if os.path.exists(self.path(queue_id)) or not os.path.exists(self.legacy_path):
+                    return None
+                with open(self.legacy_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if not isinstance(data, list):
+                    return None
+                self.save(queue_id, data)
+                os.replace(self.legacy_path, self.legacy_path + '.migrated')
+                return data
+        except (OSError, ValueError):
+            return None
+
+    def save(self, queue_id, label_queue):
+        """Atomically replaces the stored queue."""
+        path = self.path(queue_id)
+        data = json.dumps(label_queue, ensure_ascii=False, separators=(',', ':'))
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock(queue_id), _file_lock(os.path.join(self.directory, f".{queue_id}.lock")):
+            fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=f".{queue_id}.", suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    f.write(data)
+                    # On disk before the rename, so a crash never leaves an empty queue file
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, path)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
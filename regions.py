@@ -0,0 +1,108 @@
+"""
+Biogeographic region assignment for data label bar colours.
+
+Region outlines come from biogeographic_regions.geojson (coarse polygons,
+one or more per region, with a priority for overlaps). RegionIndex tests
+whole coordinate arrays at once: a per-polygon bounding-box index picks the
+candidate points, and an even-odd ray-casting test runs over all candidate
+points x polygon edges as one NumPy broadcast.
+"""
+import json
+import os
+import numpy as np
+
+REGIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "biogeographic_regions.geojson")
+
+# Region Color Mapping
+REGION_COLORS = {
+    "Palearctic (White)": "#FFFFFF",
+    "Oriental (Yellow)": "#FFFF00",
+    "Wallacea/Melanesia (Orange)": "#FFA500",
+    "Australian (Red)": "#FF0000",
+    "NZ/Pacific (Brown)": "#964B00",
+    "Nearctic (Green)": "#008000",
+    "Neotropical (Yellow-Green)": "#9ACD32",
+    "Ethiopian (Blue)": "#0000FF",
+    "Madagascar (Purple)": "#800080"
+}
+
+def points_in_polygon(lons, lats, ring):
+    """
+    Even-odd test of many points against one polygon ring (array of [lon, lat]).
+    Returns a boolean array. Vectorised over points x edges.
+    """
+    x0, y0 = ring[:, 0], ring[:, 1]
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+    px, py = lons[:, None], lats[:, None]
+    # Edges that straddle the horizontal ray through each point
+    straddles = (y0 > py) != (y1 > py)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_cross = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+    crossings = straddles & (px < x_cross)
+    return (crossings.sum(axis=1) % 2) == 1
+
+class RegionIndex:
+    """Polygons of all regions plus their bounding boxes, in priority order."""
+
+    def __init__(self, polygons):
+        # polygons: [(region, priority, ring ndarray)]
+        self.polygons = sorted(polygons, key=lambda p: p[1])
+        self.bboxes = np.array([
+            [ring[:, 0].min(), ring[:, 1].min(), ring[:, 0].max(), ring[:, 1].max()]
+            for _, _, ring in self.polygons
+        ]).reshape(-1, 4)
+
+    @classmethod
+    def load(cls, path=REGIONS_PATH):
+        with open(path, 'r', encoding='utf-8') as f:
+            collection = json.load(f)
+        polygons = []
+        for feature in collection.get('features', []):
+            props = feature.get('properties', {})
+            geometry = feature.get('geometry', {})
+            rings = geometry.get('coordinates', [])
+            if geometry.get('type') == 'MultiPolygon':
+                rings = [poly[0] for poly in rings]
+            elif rings:
+                rings = [rings[0]]  # Outer ring only; the dataset has no holes
+            for ring in rings:
+                polygons.append((props['region'], props.get('priority', 0), np.asarray(ring, dtype=float)))
+        return cls(polygons)
+
+    def assign(self, lats, lons):
+        """
+        Region name for each (lat, lon), or None outside every polygon.
+        NaN coordinates give None.
+        """
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        result = np.full(lats.shape, None, dtype=object)
+        unassigned = ~(np.isnan(lats) | np.isnan(lons))
+        for (region, _, ring), (min_x, min_y, max_x, max_y) in zip(self.polygons, self.bboxes):
+            # Bounding-box index: only points inside the box reach the edge test
+            candidates = np.flatnonzero(
+                unassigned & (lons >= min_x) & (lons <= max_x) & (lats >= min_y) & (lats <= max_y)
+            )
+            if not len(candidates):
+                continue
+            inside = candidates[points_in_polygon(lons[candidates], lats[candidates], ring)]
+            result[inside] = region
+            unassigned[inside] = False
+        return result
+
+def assign_region_colors(items, coordinates, index):
+    """
+    Sets 'region' and 'color' on each item from its (lat, lon) (None if unknown)
+    in one batch. Returns (number assigned, number left unchanged).
+    """
+    pairs = [(i, c) for i, c in enumerate(coordinates) if c is not None and None not in c]
+    if not pairs:
+        return 0, len(items)
+    regions = index.assign([c[0] for _, c in pairs], [c[1] for _, c in pairs])
+    assigned = 0
+    for (i, _), region in zip(pairs, regions):
+        if region is not None:
+            items[i]['region'] = region
+            items[i]['color'] = REGION_COLORS[region]
+            assigned += 1
+    return assigned, len(items) - assigned
@@ -0,0 +1,102 @@
+"""
+Opt-in rerun cost profiler for the Streamlit app.
+
+Every interaction re-executes label_generator_app.py from the top. Wrap each
+top-level section in `profiler.section(name)`; when the debug toggle is on,
+timings are kept in a rolling per-session history and shown by `render()`.
+"""
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import pandas as pd
+import streamlit as st
+
+from run_metrics import percentile
+
+HISTORY_KEY = '_rerun_profiler_history'
+CACHE_STATS_KEY = '_rerun_profiler_cache_stats'
+HISTORY_LENGTH = 50  # Reruns kept per session
+
+
+class RerunProfiler:
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.timings = {}
+        self._start = time.perf_counter()
+        if enabled:
+            st.session_state.setdefault(HISTORY_KEY, deque(maxlen=HISTORY_LENGTH))
+            st.session_state.setdefault(CACHE_STATS_KEY, {})
+
+    @contextmanager
+    def section(self, name):
+        """Times one top-level section of the script (no-op when disabled)."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+    def record_cache(self, name, hit):
+        """Counts a lookup against one of the app's caches (st.cache_* or session-state memo)."""
+        if not self.enabled:
+            return
+        stats = st.session_state[CACHE_STATS_KEY].setdefault(name, {'hits': 0, 'misses': 0})
+        stats['hits' if hit else 'misses'] += 1
+
+    def finish(self):
+        """Stores this rerun in the history. Call once, after the last section."""
+        if not self.enabled:
+            return
+        total = (time.perf_counter() - self._start) * 1000
+        st.session_state[HISTORY_KEY].append({'total': total, 'sections': dict(self.timings)})
+
+    def render(self):
+        if not self.enabled:
+            return
+        history = list(st.session_state.get(HISTORY_KEY, []))
+        if not history:
+            return
+        with st.expander("⏱️ Rerun Profiler", expanded=True):
+            last = history[-1]
+            totals = [run['total'] for run in history]
+            c1, c2, c3 = st.columns(3)
+            c1.metric("Last rerun", f"{last['total']:.0f} ms",
+                      delta=f"{last['total'] - totals[-2]:+.0f} ms" if len(totals) > 1 else None,
+                      delta_color="inverse")
+            c2.metric("Mean rerun", f"{sum(totals) / len(totals):.0f} ms")
+            c3.metric("Reruns recorded", len(history))
+
+            # Per-section stats over the rolling window, slowest first
+            names = sorted({name for run in history for name in run['sections']})
+            rows = []
+            for name in names:
+                values = sorted(run['sections'][name] for run in history if name in run['sections'])
+                rows.append({
+                    'Section': name,
+                    'Last (ms)': round(last['sections'].get(name, 0.0), 1),
+                    'Mean (ms)': round(sum(values) / len(values), 1),
+                    'p95 (ms)': round(percentile(values, 95), 1),
+                    'Max (ms)': round(values[-1], 1),
+                    'Share of last (%)': round(100 * last['sections'].get(name, 0.0) / last['total'], 1) if last['total'] else 0.0,
+                })
+            df = pd.DataFrame(rows).sort_values('Mean (ms)', ascending=False)
+            st.dataframe(df, use_container_width=True, hide_index=True)
+
+            st.line_chart(pd.DataFrame({'Rerun total (ms)': totals}))
+
+            cache_stats = st.session_state.get(CACHE_STATS_KEY, {})
+            if cache_stats:
+                st.markdown("**Cache hit rates**")
+                st.dataframe(pd.DataFrame([
+                    {'Cache': name, 'Hits': s['hits'], 'Misses': s['misses'],
+                     'Hit rate (%)': round(100 * s['hits'] / (s['hits'] + s['misses']), 1)}
+                    for name, s in cache_stats.items()
+                ]), use_container_width=True, hide_index=True)
+
+            if st.button("Reset profiler history"):
+                st.session_state[HISTORY_KEY].clear()
+                st.session_state[CACHE_STATS_KEY] = {}
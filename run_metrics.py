@@ -0,0 +1,149 @@
+"""
+Run instrumentation shared by the batch tools (label_app.py CLI and the Tk LabelApp).
+
+Records per-stage wall time, per-endpoint API latency, retries and response
+statuses, and exports them as a JSON summary or a Prometheus textfile
+(node_exporter textfile collector format).
+"""
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds (seconds) for the Prometheus export
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list (q in 0-100)."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(q * len(sorted_values) / 100) - 1))
+    return sorted_values[rank]
+
+class RunMetrics:
+    """Thread-safe counters for one batch run."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.stages = {}     # name -> {'seconds': float, 'calls': int}
+        self.latencies = {}  # endpoint -> [seconds, ...]
+        self.statuses = {}   # endpoint -> {status: count}
+        self.retries = {}    # endpoint -> count
+        self.counters = {}   # free-form counters (rows, cache_hits, ...)
+
+    @contextmanager
+    def stage(self, name):
+        """Times a block and adds it to the named stage. Nested/concurrent use accumulates."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage_time(name, time.perf_counter() - start)
+
+    def add_stage_time(self, name, seconds):
+        with self._lock:
+            entry = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+            entry['seconds'] += seconds
+            entry['calls'] += 1
+
+    def observe(self, endpoint, seconds, status):
+        """Records one API call: its latency and the resulting status (API status, HTTP code or exception name)."""
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            by_status = self.statuses.setdefault(endpoint, {})
+            by_status[status] = by_status.get(status, 0) + 1
+
+    def count_retry(self, endpoint):
+        with self._lock:
+            self.retries[endpoint] = self.retries.get(endpoint, 0) + 1
+
+    def incr(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self):
+        with self._lock:
+            endpoints = {}
+            for endpoint in sorted(set(self.latencies) | set(self.statuses) | set(self.retries)):
+                values = sorted(self.latencies.get(endpoint, []))
+                endpoints[endpoint] = {
+                    'calls': len(values),
+                    'latency_seconds': {
+                        'mean': round(sum(values) / len(values), 4) if values else None,
+                        'p50': percentile(values, 50),
+                        'p95': percentile(values, 95),
+                        'p99': percentile(values, 99),
+                        'max': values[-1] if values else None,
+                    },
+                    'statuses': dict(self.statuses.get(endpoint, {})),
+                    'retries': self.retries.get(endpoint, 0),
+                }
+            return {
+                'started_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started_at)),
+                'wall_seconds': round(time.perf_counter() - self._t0, 3),
+                'stages': {k: {'seconds': round(v['seconds'], 4), 'calls': v['calls']} for k, v in self.stages.items()},
+                'endpoints': endpoints,
+                'counters': dict(self.counters),
+            }
+
+    def write_json(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+
+    def write_prometheus(self, path, job='label_batch'):
+        """Writes a Prometheus textfile. Written to a temp name and renamed, as the textfile collector expects."""
+        lines = []
+        with self._lock:
+            lines.append('# HELP label_batch_stage_seconds Cumulative wall time per processing stage.')
+            lines.append('# TYPE label_batch_stage_seconds gauge')
+            for name, entry in self.stages.items():
+                lines.append(f'label_batch_stage_seconds{{job="{job}",stage="{name}"}} {entry["seconds"]:.6f}')
+
+            lines.append('# HELP label_batch_api_latency_seconds API call latency.')
+            lines.append('# TYPE label_batch_api_latency_seconds histogram')
+            for endpoint, values in self.latencies.items():
+                for bound in LATENCY_BUCKETS:
+                    count = sum(1 for v in values if v <= bound)
+                    lines.append(f'label_batch_api_latency_seconds_bucket{{job="{job}",endpoint="{endpoint}",le="{bound}"}} {count}')
+                lines.append(f'label_batch_api_latency_seconds_bucket{{job="{job}",endpoint="{endpoint}",le="+Inf"}} {len(values)}')
+                lines.append(f'label_batch_api_latency_seconds_sum{{job="{job}",endpoint="{endpoint}"}} {sum(values):.6f}')
+                lines.append(f'label_batch_api_latency_seconds_count{{job="{job}",endpoint="{endpoint}"}} {len(values)}')
+
+            lines.append('# HELP label_batch_api_responses_total API responses by status.')
+            lines.append('# TYPE label_batch_api_responses_total counter')
+            for endpoint, by_status in self.statuses.items():
+                for status, count in by_status.items():
+                    lines.append(f'label_batch_api_responses_total{{job="{job}",endpoint="{endpoint}",status="{status}"}} {count}')
+
+            lines.append('# HELP label_batch_api_retries_total Requests re-queued after throttling.')
+            lines.append('# TYPE label_batch_api_retries_total counter')
+            for endpoint, count in self.retries.items():
+                lines.append(f'label_batch_api_retries_total{{job="{job}",endpoint="{endpoint}"}} {count}')
+
+            for name, value in self.counters.items():
+                lines.append(f'# TYPE label_batch_{name}_total counter')
+                lines.append(f'label_batch_{name}_total{{job="{job}"}} {value}')
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
+
+    def format_report(self):
+        """Short human-readable summary for the console."""
+        s = self.summary()
+        out = [f"総処理時間: {s['wall_seconds']:.1f} 秒"]
+        for name, entry in s['stages'].items():
+            out.append(f"  {name:<12} {entry['seconds']:>9.2f} 秒 ({entry['calls']} 回)")
+        for endpoint, e in s['endpoints'].items():
+            lat = e['latency_seconds']
+            if e['calls']:
+                out.append(
+                    f"  {endpoint:<12} p50 {lat['p50'] * 1000:.0f}ms / p95 {lat['p95'] * 1000:.0f}ms / "
+                    f"p99 {lat['p99'] * 1000:.0f}ms, リトライ {e['retries']}, ステータス {e['statuses']}"
+                )
+        return '\n'.join(out)
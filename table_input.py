@@ -0,0 +1,120 @@
+"""
+Input loading for the batch tools (label_app.py CLI and the Tk LabelApp).
+
+read_table() parses CSV / XLSX input with optional column projection, so the
+enrichment pass only materialises the mapped lat/lon/date/method/collector
+columns; read_projected() also hands back a loader for the full table, for
+callers that pass the other columns through. A full parse is stored in a Parquet sidecar (<input>.parquet) keyed
+by the source file's size and mtime; re-runs on an unchanged file read the
+requested columns straight from it and skip CSV/XLSX parsing entirely.
+
+Both accelerators are optional: XLSX is parsed with the calamine engine when
+python-calamine is installed (openpyxl otherwise), and the sidecar cache is
+skipped when pyarrow is missing.
+"""
+import json
+import os
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Sidecar cache disabled
+    pa = pq = None
+
+try:
+    import python_calamine  # noqa: F401  (only needed as a pandas engine)
+    XLSX_ENGINE = 'calamine'
+except ImportError:
+    XLSX_ENGINE = 'openpyxl'
+
+SIDECAR_SUFFIX = '.parquet'
+# Parquet schema metadata key holding the source file's size and mtime
+SOURCE_META_KEY = b'label_app.source'
+
+def sidecar_path(path):
+    return path + SIDECAR_SUFFIX
+
+def _source_stamp(path):
+    st = os.stat(path)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+def _parse(path, usecols=None):
+    if path.lower().endswith('.csv'):
+        return pd.read_csv(path, usecols=usecols)
+    return pd.read_excel(path, usecols=usecols, engine=XLSX_ENGINE if path.lower().endswith('.xlsx') else None)
+
+def _read_sidecar(path, columns):
+    """Projected DataFrame from a fresh sidecar, or None if missing or stale."""
+    cache = sidecar_path(path)
+    if pq is None or not os.path.exists(cache):
+        return None
+    try:
+        schema = pq.read_schema(cache)
+        stamp = json.loads((schema.metadata or {}).get(SOURCE_META_KEY, b'null'))
+        if stamp != _source_stamp(path):
+            return None
+        if columns is not None:
+            wanted = set(columns)
+            columns = [c for c in schema.names if c in wanted]
+        return pd.read_parquet(cache, columns=columns)
+    except (OSError, ValueError, pa.ArrowException):
+        return None
+
+def _write_sidecar(path, df):
+    """Stores a full parse next to the input. Failures only cost the cache."""
+    cache = sidecar_path(path)
+    tmp = cache + '.tmp'
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        meta = dict(table.schema.metadata or {})
+        meta[SOURCE_META_KEY] = json.dumps(_source_stamp(path)).encode('utf-8')
+        pq.write_table(table.replace_schema_metadata(meta), tmp)
+        os.replace(tmp, cache)
+    except (OSError, ValueError, pa.ArrowException):
+        # Mixed-type object columns cannot always be stored; just skip the cache
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def read_table(path, columns=None, use_cache=True):
+    """
+    Reads a CSV / XLSX file. With columns, only those columns (the ones that
+    exist) are returned, in file order. Missing files raise FileNotFoundError.
+    """
+    if use_cache:
+        df = _read_sidecar(path, columns)
+        if df is not None:
+            return df
+
+    if not use_cache or pq is None:
+        wanted = None if columns is None else set(columns)
+        return _parse(path, usecols=None if wanted is None else (lambda c: c in wanted))
+
+    # First run: parse everything once, so later projections hit the cache
+    df = _parse(path)
+    _write_sidecar(path, df)
+    if columns is None:
+        return df
+    wanted = set(columns)
+    return df[[c for c in df.columns if c in wanted]]
+
+def read_projected(path, columns):
+    """
+    (projected DataFrame, load_full) for callers that enrich a few columns
+    and pass the rest through afterwards. load_full() never parses the input
+    a second time: it reads the sidecar when the projection came from it, and
+    otherwise returns the full parse already made (also when the sidecar
+    could not be written, or pyarrow is missing).
+    """
+    df = _read_sidecar(path, columns)
+    if df is not None:
+        def load_full():
+            full = _read_sidecar(path, None)
+            return full if full is not None else _parse(path)
+        return df, load_full
+
+    full = _parse(path)
+    if pq is not None:
+        _write_sidecar(path, full)
+    wanted = set(columns)
+    return full[[c for c in full.columns if c in wanted]], lambda: full
@@ -0,0 +1,74 @@
+import math
+
+import pandas as pd
+import pytest
+
+from coord_parser import MISSING, parse_coordinate_columns, parse_coordinate_text
+
+
+def parse_one(lat, lon):
+    return parse_coordinate_columns([lat], [lon]).iloc[0]
+
+
+@pytest.mark.parametrize('lat, lon, expected', [
+    ('35.6586', '139.7454', (35.6586, 139.7454)),
+    (35.6586, 139.7454, (35.6586, 139.7454)),
+    ('-12.5', '-77.0', (-12.5, -77.0)),
+    ("35°39.5'N", "139°44.5'E", (35 + 39.5 / 60, 139 + 44.5 / 60)),
+    ('N 35 39 31', 'E 139 44 43', (35 + 39 / 60 + 31 / 3600, 139 + 44 / 60 + 43 / 3600)),
+    ('35°39′31″S', '139°44′43.4″W', (-(35 + 39 / 60 + 31 / 3600), -(139 + 44 / 60 + 43.4 / 3600))),
+    ('n35.5', 'e139.5', (35.5, 139.5)),
+])
+def test_notations(lat, lon, expected):
+    row = parse_one(lat, lon)
+    assert row['error'] is None
+    assert not row['swapped']
+    assert row['lat'] == pytest.approx(expected[0])
+    assert row['lon'] == pytest.approx(expected[1])
+
+
+@pytest.mark.parametrize('lat, lon', [('E139.7', 'N35.6'), ('139.7', '35.6')])
+def test_swapped_pairs_are_corrected(lat, lon):
+    row = parse_one(lat, lon)
+    assert row['error'] is None
+    assert row['swapped']
+    assert (row['lat'], row['lon']) == pytest.approx((35.6, 139.7))
+
+
+@pytest.mark.parametrize('lat, lon, error', [
+    (None, '139.7', MISSING),
+    ('', '', MISSING),
+    ('abc', '139.7', 'unrecognised format'),
+    ('35 70 00', '139', 'minutes/seconds must be below 60'),
+    ('35.5 30', '139', 'fraction before minutes/seconds'),
+    ('-35N', '139', 'both sign and hemisphere given'),
+    ('N35N', '139', 'two hemisphere letters'),
+    ('95', '100', 'latitude out of range'),
+    ('35', '200', 'longitude out of range'),
+    ('35E', '139E', 'E/W hemisphere on latitude'),
+    ('35N', '139N', 'N/S hemisphere on longitude'),
+])
+def test_errors(lat, lon, error):
+    row = parse_one(lat, lon)
+    assert row['error'] == error
+    assert math.isnan(row['lat']) and math.isnan(row['lon'])
+    assert not row['swapped']
+
+
+def test_columns_keep_row_order_and_fresh_index():
+    lats = pd.Series(['35.1', 'bad', None, '36.2'], index=[10, 11, 12, 13])
+    lons = pd.Series(['139.1', '139.2', '139.3', '140.2'], index=[10, 11, 12, 13])
+    result = parse_coordinate_columns(lats, lons)
+    assert result.index.tolist() == [0, 1, 2, 3]
+    assert result['lat'].tolist()[::3] == [35.1, 36.2]
+    assert result['error'].tolist() == [None, 'unrecognised format', MISSING, None]
+
+
+def test_text_paste():
+    text = "35.1, 139.1\n\nN35 39 31 E139 44 43\n139.7 35.6\n35.1\n"
+    result = parse_coordinate_text(text)
+    assert result['line'].tolist() == [1, 3, 4, 5]
+    assert result['error'].tolist()[:3] == [None, None, None]
+    assert result['lat'][1] == pytest.approx(35 + 39 / 60 + 31 / 3600)
+    assert bool(result['swapped'][2])
+    assert result['error'][3] == 'expected a latitude and a longitude'
@@ -0,0 +1,75 @@
+import io
+import zipfile
+
+from docx import Document
+
+from docx_batch import GROUP_KEYS, PAGE_HEIGHT_PT, label_height_pt, split_queue, write_docx_zip
+
+
+def data_item(region, color, collector='M. Tsuchioka', quantity=1, n=0):
+    return {
+        'type': 'data_v2', 'header': 'JAPAN: Tokyo,', 'region': region, 'color': color, 'quantity': quantity,
+        'body': f"Mt. Takao {n}, (alt. 599 m),\n35.625°N, 139.244°E, 26 VII 2024,\n{collector}, (Light trap)",
+    }
+
+
+def total(items):
+    return sum(item['quantity'] for item in items)
+
+
+def test_single_group_keeps_queue():
+    queue = [data_item('A', '#fff'), {'type': 'text', 'content': 'DNA', 'quantity': 2}]
+    assert split_queue(queue) == [('labels', queue)]
+
+
+def test_group_by_key_in_first_appearance_order():
+    queue = [
+        data_item('Oriental (Yellow)', '#FFFF00'),
+        data_item('Palearctic (White)', '#ffffff'),
+        data_item(None, ''),
+        data_item('Oriental (Yellow)', '#FFFF00', quantity=0),
+        data_item('Oriental (Yellow)', '#FFFF00', n=1),
+    ]
+    groups = split_queue(queue, key='region')
+    assert [name for name, _ in groups] == ['Oriental (Yellow)', 'Palearctic (White)', 'other']
+    # Items with quantity 0 are left out
+    assert len(groups[0][1]) == 2
+    assert [name for name, _ in split_queue(queue, key='color')] == ['#FFFF00', '#FFFFFF', 'other']
+
+
+def test_collector_and_type_keys():
+    item = data_item('A', '#fff', collector='K. Sato')
+    assert GROUP_KEYS['collector'](item) == 'K. Sato'
+    assert GROUP_KEYS['collector'](dict(item, collector='Stored')) == 'Stored'
+    assert GROUP_KEYS['type']({'content': 'x', 'quantity': 1}) == 'text'
+
+
+def test_max_pages_splits_quantities_without_losing_labels():
+    item = data_item('A', '#fff', quantity=5000)
+    rows_per_page = int(PAGE_HEIGHT_PT // label_height_pt(item, 4.0))
+    parts = split_queue([item], max_pages=2, num_columns=10)
+    assert len(parts) > 1
+    assert [name for name, _ in parts][:2] == ['labels_part1', 'labels_part2']
+    assert sum(total(items) for _, items in parts) == 5000
+    # Every part but the last holds exactly max_pages full pages
+    for _, items in parts[:-1]:
+        assert total(items) == 2 * rows_per_page * 10
+    # The input item is not modified
+    assert item['quantity'] == 5000
+
+
+def test_max_pages_per_group():
+    queue = [data_item('A', '#fff', quantity=3000), data_item('B', '#000', quantity=10)]
+    names = [name for name, _ in split_queue(queue, key='region', max_pages=1)]
+    assert names[0] == 'A_part1' and names[-1] == 'B'
+
+
+def test_write_docx_zip_in_process():
+    queue = [data_item('Oriental (Yellow)', '#FFFF00', quantity=3), data_item('Palearctic (White)', '#FFFFFF')]
+    buf = io.BytesIO()
+    files = write_docx_zip(queue, buf, key='region', workers=1)
+    assert files == [('01_Oriental_Yellow.docx', 3), ('02_Palearctic_White.docx', 1)]
+    with zipfile.ZipFile(buf) as zf:
+        assert zf.namelist() == [name for name, _ in files]
+        document = Document(io.BytesIO(zf.read('01_Oriental_Yellow.docx')))
+    assert len(document.tables) == 1
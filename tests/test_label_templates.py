@@ -0,0 +1,178 @@
+import datetime
+
+import pandas as pd
+import pytest
+
+from label_render import generate_label_body_v2
+from label_templates import TemplateError, compile_template, get_template
+
+# The formatters the built-in templates replaced, kept as references.
+# Their one intended difference: missing values no longer print as 'None' / 'nan'.
+
+
+def old_cli_label(row, lat_col, lon_col, date_col, method_col, collector_col):
+    date = row.get(date_col, '')
+    method = row.get(method_col, '')
+    collector = row.get(collector_col, '')
+    full_address = row.get('api_address', '')
+    elevation_val = row.get('api_elevation', '')
+    lat = row.get(lat_col, '')
+    lon = row.get(lon_col, '')
+
+    if isinstance(elevation_val, (int, float)):
+        elevation_str = f"GPS({elevation_val}m)"
+    elif pd.notna(elevation_val) and str(elevation_val) != '':
+        elevation_str = f"GPS(エラー: {elevation_val})"
+    else:
+        elevation_str = "GPS(高度取得失敗)"
+
+    if not full_address or 'エラー' in str(full_address) or 'Error' in str(full_address):
+        address_str = f"住所取得エラー: {full_address}"
+    else:
+        address_str = f"JAPAN: {full_address}"
+
+    label = f"{address_str}\n"
+    label += f"{elevation_str}\n"
+    line3_parts = []
+    if pd.notna(date) and date != '': line3_parts.append(str(date))
+    if pd.notna(method) and method != '': line3_parts.append(str(method))
+    if pd.notna(collector) and collector != '': line3_parts.append(str(collector))
+    if line3_parts:
+        label += ". ".join(line3_parts)
+        if not label.endswith('.'):
+            label += "."
+    label += f"\nN{lat}, E{lon}"
+    return label
+
+
+def old_tk_label(row, col_map):
+    date = str(row.get(col_map["日付の列名"], ''))
+    method = str(row.get(col_map["採集方法の列名"], ''))
+    collector = str(row.get(col_map["採集者名の列名"], ''))
+    addr = row.get('地点名の表記', '')
+    elev = row.get('alt', '')
+    lat = row.get(col_map["緯度の列名"], '')
+    lon = row.get(col_map["経度の列名"], '')
+
+    lines = [f"JAPAN: {addr}", f"GPS({elev}m)"]
+    line3 = []
+    if date and date != 'nan': line3.append(date)
+    if method and method != 'nan': line3.append(method)
+    if collector and collector != 'nan': line3.append(collector)
+    if line3: lines.append(". ".join(line3) + ".")
+    lines.append(f"N{lat}, E{lon}")
+    return "\n".join(lines)
+
+
+def old_v2_body(locality, elev, lat, lon, date_obj, collector, method):
+    roman = ["", "I", "II", "III", "IV", "V", "VI", "VII", "VIII", "IX", "X", "XI", "XII"]
+    parts_L1 = []
+    if locality: parts_L1.append(locality)
+    if elev is not None: parts_L1.append(f"(alt. {elev} m)")
+    line1 = ", ".join(parts_L1)
+    if line1 and not line1.endswith(','): line1 += ","
+    coords = f"{abs(lat):.3f}°{'N' if lat >= 0 else 'S'}, {abs(lon):.3f}°{'E' if lon >= 0 else 'W'}"
+    line2 = f"{coords}, {date_obj.day} {roman[date_obj.month]} {date_obj.year},"
+    line3 = collector
+    if method:
+        if method.startswith('(') and method.endswith(')'):
+            line3 += f", {method}"
+        else:
+            line3 += f", ({method})"
+    return f"{line1}\n{line2}\n{line3}"
+
+
+CLI_COLUMNS = {
+    'address': 'api_address', 'elevation': 'api_elevation', 'lat': 'latitude', 'lon': 'longitude',
+    'date': '採集年月日', 'method': '採集方法', 'collector': '採集者名',
+}
+CLI_ROWS = [
+    {'api_address': '東京都八王子市高尾町', 'api_elevation': 599.2, 'latitude': 35.625, 'longitude': 139.2436,
+     '採集年月日': '2024-07-26', '採集方法': 'Light trap', '採集者名': 'M. Tsuchioka'},
+    {'api_address': 'APIエラー: ZERO_RESULTS', 'api_elevation': 'REQUEST_DENIED', 'latitude': 35.0, 'longitude': 139.0,
+     '採集年月日': '2024-07-26', '採集方法': '', '採集者名': 'M. Tsuchioka'},
+    {'api_address': '', 'api_elevation': 12, 'latitude': -12.5, 'longitude': -77.25,
+     '採集年月日': '2024-07-26.', '採集方法': '', '採集者名': ''},
+    {'api_address': 'Error: timeout', 'api_elevation': 0, 'latitude': 1, 'longitude': 2,
+     '採集年月日': '', '採集方法': 'Sweeping', '採集者名': ''},
+]
+
+
+@pytest.mark.parametrize('row', CLI_ROWS)
+def test_cli_template_matches_old_formatter(row):
+    expected = old_cli_label(row, 'latitude', 'longitude', '採集年月日', '採集方法', '採集者名')
+    assert get_template('cli').render(row, CLI_COLUMNS) == expected
+
+
+def test_cli_render_frame_matches_render():
+    df = pd.DataFrame(CLI_ROWS)
+    template = get_template('cli')
+    expected = [template.render(row, CLI_COLUMNS) for row in df.to_dict('records')]
+    assert template.render_frame(df, CLI_COLUMNS).tolist() == expected
+
+
+TK_COL_MAP = {"緯度の列名": "緯度", "経度の列名": "経度", "日付の列名": "採集年月日",
+              "採集者名の列名": "採集者", "採集方法の列名": "採集方法"}
+TK_COLUMNS = {
+    'address': '地点名の表記', 'elevation': 'alt', 'lat': '緯度', 'lon': '経度',
+    'date': '採集年月日', 'method': '採集方法', 'collector': '採集者',
+}
+
+
+@pytest.mark.parametrize('row', [
+    {'地点名の表記': '東京都八王子市', 'alt': 599.2, '緯度': 35.625, '経度': 139.2436,
+     '採集年月日': '2024-07-26', '採集方法': 'Light trap', '採集者': 'M. Tsuchioka'},
+    {'地点名の表記': '沖縄県国頭郡', 'alt': 12.3, '緯度': 26.7, '経度': 128.2,
+     '採集年月日': '2024-07-26', '採集方法': '', '採集者': ''},
+    {'地点名の表記': '北海道', 'alt': 5, '緯度': 43.0, '経度': 141.3,
+     '採集年月日': '', '採集方法': '', '採集者': ''},
+])
+def test_tk_template_matches_old_formatter(row):
+    assert get_template('tk').render(row, TK_COLUMNS) == old_tk_label(row, TK_COL_MAP)
+
+
+@pytest.mark.parametrize('args', [
+    ("Mt. Takao", 599, 35.625, 139.2436, datetime.date(2024, 7, 26), "M. Tsuchioka", "Light trap"),
+    ("Mt. Takao", 599, 35.625, 139.2436, datetime.date(2024, 7, 26), "M. Tsuchioka", "(at light)"),
+    ("Lima", None, -12.0464, -77.0428, datetime.date(2023, 2, 15), "M. Tsuchioka", ""),
+    ("", 0, 1.0, -0.5, datetime.date(2023, 12, 1), "M. Tsuchioka", "Sweeping"),
+    ("Yakushima Is.,", None, 30.3, 130.5, datetime.date(2024, 1, 9), "", ""),
+    ("", None, 0.0, 0.0, datetime.date(2024, 9, 30), "A. B", ""),
+])
+def test_v2_template_matches_old_formatter(args):
+    assert generate_label_body_v2(*args) == old_v2_body(*args)
+
+
+def test_missing_values_print_as_empty():
+    label = get_template('tk').render({'緯度': 35.0, '経度': None, '採集年月日': float('nan')}, TK_COLUMNS)
+    assert label == "JAPAN: \nGPS(m)\nN35.0, E"
+    assert 'nan' not in label and 'None' not in label
+
+
+def test_template_language():
+    template = compile_template("{{{name|upper}}} {?n|number}#{n}{else}-{/} {a,b|join:'/'|end:'.'}")
+    assert template.fields == ('name', 'n', 'a', 'b')
+    assert template.render({'name': 'x', 'n': 3, 'a': 'p', 'b': 'q'}) == "{X} #3 p/q."
+    assert template.render({'name': 'x', 'n': 'err', 'a': '', 'b': None}) == "{X} - "
+    assert template({'name': 'x'}) == "{X} - "
+
+
+def test_group_filter():
+    template = compile_template("{[}{a}{?b}, {b}{/}{/|end:','}")
+    assert template.render({'a': 'p', 'b': 'q'}) == "p, q,"
+    assert template.render({'a': 'p,'}) == "p,"
+    assert template.render({}) == ""
+
+
+@pytest.mark.parametrize('source', ["{a|nosuchfilter}", "{?a}unclosed", "{/}"])
+def test_template_errors(source):
+    with pytest.raises(TemplateError):
+        compile_template(source)
+
+
+def test_get_template_from_file(tmp_path):
+    path = tmp_path / 'museum.txt'
+    path.write_text("{collector|upper}", encoding='utf-8')
+    assert get_template(str(path)).render({'collector': 'tsuchioka'}) == "TSUCHIOKA"
+    with pytest.raises(TemplateError):
+        get_template(str(tmp_path / 'missing.txt'))
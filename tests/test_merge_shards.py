@@ -0,0 +1,67 @@
+import pandas as pd
+import pytest
+
+from label_app import ROW_INDEX_COL, merge_shards, select_shard
+
+
+def make_input():
+    return pd.DataFrame({
+        'latitude': [35.1, 35.2, 35.1, None, 36.0, 34.5],
+        'longitude': [139.1, 139.2, 139.1, None, 140.0, 135.5],
+        'memo': list('abcdef'),
+    })
+
+
+def write_shards(tmp_path, df, shard_count):
+    paths = []
+    for i in range(1, shard_count + 1):
+        path = tmp_path / f"shard{i}.csv"
+        select_shard(df, 'latitude', 'longitude', i, shard_count).to_csv(path, index=False, encoding='utf-8-sig')
+        paths.append(str(path))
+    return paths
+
+
+def test_shards_partition_rows_and_keep_duplicate_sites_together():
+    df = make_input()
+    shards = [select_shard(df, 'latitude', 'longitude', i, 3) for i in (1, 2, 3)]
+    rows = sorted(row for shard in shards for row in shard[ROW_INDEX_COL])
+    assert rows == list(range(len(df)))
+    # Rows 0 and 2 share a site
+    owner = {row: i for i, shard in enumerate(shards) for row in shard[ROW_INDEX_COL]}
+    assert owner[0] == owner[2]
+
+
+def test_merge_restores_original_order(tmp_path):
+    df = make_input()
+    # Later shards first: the order of the arguments must not matter
+    paths = write_shards(tmp_path, df, 3)[::-1]
+    out = tmp_path / 'merged.csv'
+
+    assert merge_shards(paths, str(out)) == len(df)
+    merged = pd.read_csv(out, encoding='utf-8-sig')
+    assert ROW_INDEX_COL not in merged.columns
+    assert merged['memo'].tolist() == list('abcdef')
+
+
+def test_merge_rejects_overlapping_shards(tmp_path):
+    paths = write_shards(tmp_path, make_input(), 1)
+    with pytest.raises(ValueError):
+        merge_shards(paths + paths, str(tmp_path / 'merged.csv'))
+
+
+def test_merge_rejects_files_without_row_index(tmp_path):
+    path = tmp_path / 'plain.csv'
+    make_input().to_csv(path, index=False)
+    with pytest.raises(ValueError):
+        merge_shards([str(path)], str(tmp_path / 'merged.csv'))
+
+
+def test_merge_warns_about_missing_rows(tmp_path, capsys):
+    df = make_input()
+    paths = write_shards(tmp_path, df, 3)
+    # Drop a shard that does not hold the last row, so the gap is detectable
+    last = len(df) - 1
+    rows = {p: set(pd.read_csv(p, encoding='utf-8-sig')[ROW_INDEX_COL]) for p in paths}
+    dropped = next(p for p in paths if rows[p] and last not in rows[p])
+    merge_shards([p for p in paths if p != dropped], str(tmp_path / 'merged.csv'))
+    assert '警告' in capsys.readouterr().out
@@ -0,0 +1,59 @@
+from queue_index import QueueIndex, compact_queue, content_key
+
+
+def text_item(content, quantity=1, **extra):
+    return dict({'type': 'text', 'content': content, 'quantity': quantity, 'preview': f"[DNA] {content}"}, **extra)
+
+
+def test_content_key_ignores_quantity_and_preview():
+    a = text_item('DNA-1', 1)
+    b = dict(text_item('DNA-1', 5), preview='other caption')
+    assert content_key(a) == content_key(b)
+    assert content_key(a) != content_key(text_item('DNA-2'))
+    assert content_key(a) != content_key(text_item('DNA-1', font_size=3.0))
+
+
+def test_content_key_survives_json_round_trip():
+    rich = {'type': 'rich', 'content': [("Carabus ", True), ("1869", False)], 'quantity': 1}
+    reloaded = {'type': 'rich', 'content': [["Carabus ", True], ["1869", False]], 'quantity': 1}
+    assert content_key(rich) == content_key(reloaded)
+
+
+def test_compact_queue_merges_in_first_appearance_order():
+    queue = [text_item('A', 1), text_item('B', 2), text_item('A', 3), text_item('C'), text_item('B', 1)]
+    compacted, merged = compact_queue(queue)
+    assert merged == 2
+    assert [(item['content'], item['quantity']) for item in compacted] == [('A', 4), ('B', 3), ('C', 1)]
+    assert compact_queue([]) == ([], 0)
+
+
+def test_compact_queue_keeps_different_items():
+    queue = [text_item('A'), text_item('A', color='#FFFF00'), text_item('a')]
+    compacted, merged = compact_queue(queue)
+    assert merged == 0
+    assert compacted == queue
+
+
+def test_index_add_merges_duplicates():
+    queue = []
+    index = QueueIndex(queue)
+    assert index.add(text_item('A', 2)) is False
+    assert index.add(text_item('A', 3)) is True
+    assert index.extend([text_item('B'), text_item('A')]) == 1
+    assert [(item['content'], item['quantity']) for item in queue] == [('A', 6), ('B', 1)]
+
+
+def test_index_remove_and_stale_keys():
+    queue = [text_item('A'), text_item('A')]  # Duplicates from before indexing
+    index = QueueIndex(queue)
+    index.remove(0)
+    # The key now points at the remaining copy
+    assert index.add(text_item('A')) is True
+    assert len(queue) == 1 and queue[0]['quantity'] == 2
+
+    # Edited in place: the old key must not merge a new item into it
+    queue[0]['content'] = 'Z'
+    assert index.add(text_item('A')) is False
+    assert [item['content'] for item in queue] == ['Z', 'A']
+    index.rebuild()
+    assert index.add(text_item('Z')) is True
@@ -0,0 +1,51 @@
+import math
+
+import numpy as np
+import pytest
+
+from regions import REGION_COLORS, RegionIndex, assign_region_colors, points_in_polygon
+
+SQUARE = np.array([[0, 0], [10, 0], [10, 10], [0, 10]], dtype=float)
+INNER = np.array([[2, 2], [4, 2], [4, 4], [2, 4]], dtype=float)
+
+
+@pytest.fixture(scope='module')
+def index():
+    return RegionIndex.load()
+
+
+def test_points_in_polygon():
+    inside = points_in_polygon(np.array([5.0, -1.0, 9.9, 5.0]), np.array([5.0, 5.0, 0.1, 11.0]), SQUARE)
+    assert inside.tolist() == [True, False, True, False]
+
+
+def test_lower_priority_value_wins_on_overlap():
+    index = RegionIndex([('outer', 5, SQUARE), ('inner', 1, INNER)])
+    assert index.assign([3, 8], [3, 8]).tolist() == ['inner', 'outer']
+
+
+def test_nan_and_outside_give_none():
+    index = RegionIndex([('outer', 0, SQUARE)])
+    assert index.assign([math.nan, 5, 20], [5, math.nan, 20]).tolist() == [None, None, None]
+
+
+@pytest.mark.parametrize('lat, lon, region', [
+    (35.68, 139.7, 'Palearctic (White)'),        # Tokyo
+    (1.35, 103.8, 'Oriental (Yellow)'),          # Singapore
+    (-18.9, 47.5, 'Madagascar (Purple)'),        # Antananarivo
+    (-33.87, 151.2, 'Australian (Red)'),         # Sydney
+    (-41.3, 174.8, 'NZ/Pacific (Brown)'),        # Wellington
+    (40.7, -74.0, 'Nearctic (Green)'),           # New York
+    (-23.5, -46.6, 'Neotropical (Yellow-Green)'),  # Sao Paulo
+])
+def test_bundled_regions(index, lat, lon, region):
+    assert index.assign([lat], [lon]).tolist() == [region]
+
+
+def test_assign_region_colors_sets_region_and_color(index):
+    items = [{'color': '#123456'}, {'color': '#123456'}, {'color': '#123456'}]
+    assigned, unchanged = assign_region_colors(items, [(35.68, 139.7), None, (-18.9, 47.5)], index)
+    assert (assigned, unchanged) == (2, 1)
+    assert items[0] == {'region': 'Palearctic (White)', 'color': REGION_COLORS['Palearctic (White)']}
+    assert items[1] == {'color': '#123456'}
+    assert items[2]['color'] == REGION_COLORS['Madagascar (Purple)']
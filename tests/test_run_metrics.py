@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from run_metrics import RunMetrics, percentile
+
+
+def test_percentile_empty():
+    assert percentile([], 95) is None
+
+
+@pytest.mark.parametrize('q, expected', [(0, 1), (1, 1), (50, 50), (95, 95), (99, 99), (100, 100)])
+def test_percentile_nearest_rank(q, expected):
+    assert percentile(list(range(1, 101)), q) == expected
+
+
+def test_percentile_small_samples():
+    values = [0.1, 0.2, 0.3, 0.4, 0.5]
+    assert percentile(values, 50) == 0.3
+    # ceil(0.95 * 5) = 5th value
+    assert percentile(values, 95) == 0.5
+    assert percentile([7], 99) == 7
+
+
+def test_percentile_exact_ranks_are_not_rounded_up():
+    # 20 * 95 / 100 is exactly 19: the 19th value, not the 20th
+    values = list(range(1, 21))
+    assert percentile(values, 95) == 19
+
+
+def test_summary_and_exports(tmp_path):
+    metrics = RunMetrics()
+    with metrics.stage('read_input'):
+        pass
+    metrics.add_stage_time('read_input', 0.5)
+    for seconds in (0.01, 0.02, 0.03):
+        metrics.observe('geocoding', seconds, 'OK')
+    metrics.observe('geocoding', 0.2, 'OVER_QUERY_LIMIT')
+    metrics.count_retry('geocoding')
+    metrics.incr('rows', 4)
+
+    summary = metrics.summary()
+    assert summary['stages']['read_input']['calls'] == 2
+    geocoding = summary['endpoints']['geocoding']
+    assert geocoding['calls'] == 4
+    assert geocoding['latency_seconds']['p50'] == 0.02
+    assert geocoding['latency_seconds']['max'] == 0.2
+    assert geocoding['statuses'] == {'OK': 3, 'OVER_QUERY_LIMIT': 1}
+    assert geocoding['retries'] == 1
+    assert summary['counters'] == {'rows': 4}
+
+    metrics.write_json(tmp_path / 'metrics.json')
+    assert json.loads((tmp_path / 'metrics.json').read_text(encoding='utf-8'))['counters'] == {'rows': 4}
+    prom = tmp_path / 'metrics.prom'
+    metrics.write_prometheus(str(prom))
+    text = prom.read_text(encoding='utf-8')
+    assert 'label_batch_api_latency_seconds_count{job="label_batch",endpoint="geocoding"} 4' in text
+    assert 'label_batch_rows_total{job="label_batch"} 4' in text
@@ -0,0 +1,94 @@
+"""
+Constant-memory XLSX output for the batch tools.
+
+Rows go to an openpyxl write-only workbook as they are produced: each row is
+serialised to a temporary file on append, so memory does not grow with the
+row count the way DataFrame.to_excel does. The workbook is written next to the
+target and moved into place on close(), so cancelled or failed runs never
+leave a half-written output behind.
+"""
+import os
+from openpyxl import Workbook
+
+# Columns added by the enrichment step, in output order
+ENRICHED_COLUMNS = ['地点名の表記', '国名', '県名', '地点(ローマ字)', '島・大陸名', '市区町村', '市区町村種別', 'alt', 'status', 'label']
+
+INPUT_SHEET_NAME = '入力用シート'
+# 入力用シート layout: (header, source). A source ending in 'の列名' is a
+# column-mapping key and is resolved through col_map; anything else is an
+# enriched column.
+INPUT_SHEET_LAYOUT = [
+    ('地点名の表記', '地点名の表記'),
+    ('国名', '国名'),
+    ('県名', '県名'),
+    ('島・大陸名', '島・大陸名'),
+    ('市区町村', '市区町村'),
+    ('地点(ローマ字)', '地点(ローマ字)'),
+    ('緯度', '緯度の列名'),
+    ('経度', '経度の列名'),
+    ('標高', 'alt'),
+    ('採集年月日', '日付の列名'),
+    ('採集方法', '採集方法の列名'),
+    ('採集者名', '採集者名の列名'),
+    ('ラベル', 'label'),
+]
+
+def input_sheet_columns(col_map):
+    """(headers, record keys) of the 入力用シート layout for a column mapping."""
+    headers = [header for header, _ in INPUT_SHEET_LAYOUT]
+    keys = [col_map.get(source, source) for _, source in INPUT_SHEET_LAYOUT]
+    return headers, keys
+
+def _cell_value(value):
+    # NaN / NaT compare unequal to themselves; write them as empty cells
+    if value is None or value != value:
+        return None
+    return value
+
+class XlsxStreamWriter:
+    """
+    Appends rows to a single-sheet XLSX file without keeping them in memory.
+
+    Use as a context manager and call close() once every row is written;
+    leaving the block without close() (cancel, exception) discards the file.
+    """
+    def __init__(self, path, headers, sheet_name='Sheet1'):
+        self.path = path
+        self._tmp_path = f"{path}.part"
+        self._wb = Workbook(write_only=True)
+        self._ws = self._wb.create_sheet(title=sheet_name)
+        self._ws.append(list(headers))
+        self.rows = 0
+        self.closed = False
+
+    def write_row(self, values):
+        self._ws.append([_cell_value(v) for v in values])
+        self.rows += 1
+
+    def close(self):
+        """Finishes the workbook and atomically replaces the target file."""
+        if self.closed:
+            return
+        try:
+            self._wb.save(self._tmp_path)
+            os.replace(self._tmp_path, self.path)
+        finally:
+            self.closed = True
+            self._discard_tmp()
+
+    def abort(self):
+        """Drops everything written so far."""
+        self.closed = True
+        self._discard_tmp()
+
+    def _discard_tmp(self):
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.closed:
+            self.abort()
+        return False